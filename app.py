@@ -1,10 +1,22 @@
-from flask import Flask, request, abort
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import timedelta
+from flask import Flask, request, abort, jsonify
+from sqlalchemy import delete, tuple_
 from config import Config
-from models import Session, Event
-from utils import parse_command, parse_remove_command, format_datetime
+from models import Session, Event, bump_list_versions, get_list_version, hash_description, to_epoch
+from commands import COMMAND_LIST, COMMAND_REMOVE, parse_message
+from utils import format_datetime, get_list_messages
+from scheduler import notify_event_scheduled, notify_event_removed
+from line_client import get_client, text_message
+from webhook_queue import WebhookQueue
+from idempotency import WebhookDeduplicator
+from list_cache import ListPageCache
+from group_keys import GroupKeyCache
+from event_writer import EventWriter
+from outbox import enqueue_reply, is_retryable_error, new_push, notify_dispatcher
+import atexit
 import logging
 import json
-import requests
 import hashlib
 import hmac
 import base64
@@ -24,12 +36,28 @@ except ValueError as e:
     logger.error(f"配置錯誤: {e}")
     logger.error("請確保 .env 文件中設定了正確的 LINE Bot 憑證")
 
-# LINE API 設定（使用 requests 避免 OpenSSL 問題）
-LINE_REPLY_URL = "https://api.line.me/v2/bot/message/reply"
-LINE_HEADERS = {
-    "Content-Type": "application/json",
-    "Authorization": f"Bearer {Config.LINE_CHANNEL_ACCESS_TOKEN}"
-}
+
+# Webhook 重送去重
+deduplicator = WebhookDeduplicator(
+    maxsize=Config.WEBHOOK_DEDUP_CACHE_SIZE,
+    ttl_seconds=Config.WEBHOOK_DEDUP_TTL_SECONDS
+)
+
+# /list 渲染結果快取
+list_cache = ListPageCache(
+    maxsize=Config.LIST_CACHE_SIZE,
+    ttl_seconds=Config.LIST_CACHE_TTL_SECONDS
+)
+
+# LINE 來源 ID 到群組鍵的快取
+group_keys = GroupKeyCache(maxsize=Config.GROUP_KEY_CACHE_SIZE)
+
+# 新增事件的批次寫入（EVENT_WRITE_MODE=batch 時使用）
+event_writer = EventWriter(
+    max_batch=Config.EVENT_WRITER_MAX_BATCH,
+    linger_seconds=Config.EVENT_WRITER_LINGER_MS / 1000,
+    group_keys=group_keys
+)
 
 
 @app.route("/", methods=['GET'])
@@ -62,12 +90,13 @@ def webhook():
         logger.error("無效的簽名")
         abort(400)
     
-    # 處理請求
+    # 放入背景佇列後立即回應，避免 LINE 等待逾時重送
     try:
         body_json = json.loads(body)
-        if 'events' in body_json:
-            for event_data in body_json['events']:
-                handle_event(event_data)
+        events = body_json.get('events', [])
+        if events and not event_queue.submit(events):
+            logger.error(f"Webhook 佇列已滿，拒絕 {len(events)} 個事件")
+            return 'Service Unavailable', 503
         return 'OK', 200
     except Exception as e:
         logger.error(f"處理 Webhook 時發生錯誤: {e}", exc_info=True)
@@ -103,25 +132,34 @@ def handle_event(event_data):
         if not user_message.startswith('/'):
             return
         
+        # 略過 LINE 重送的事件
+        webhook_event_id = event_data.get('webhookEventId')
+        if webhook_event_id and not deduplicator.claim(webhook_event_id):
+            logger.info(f"略過重送的事件: {webhook_event_id}")
+            return
+        
+        # 解析指令（單次比對同時判斷指令種類）
+        kind, parsed = parse_message(user_message)
+        
         # 處理 /list 指令
-        if user_message.strip().lower() == '/list':
-            handle_list_command(reply_token, group_id)
+        if kind == COMMAND_LIST:
+            handle_list_command(reply_token, group_id, parsed)
             return
         
         # 處理 /rm 刪除指令
-        if user_message.strip().lower().startswith('/rm'):
-            handle_remove_command(reply_token, group_id, user_message)
+        if kind == COMMAND_REMOVE:
+            handle_remove_command(reply_token, group_id, parsed)
             return
         
-        # 解析指令
-        parsed = parse_command(user_message)
-        
         if parsed is None:
             # 指令格式錯誤
             reply_message = (
                 "指令格式錯誤或時間已過\n\n"
                 "正確格式：\n"
-                "/MM-DD HH:mm 事情描述\n\n"
+                "/MM-DD HH:mm 事情描述\n"
+                "/YYYY-MM-DD HH:mm 事情描述\n"
+                "/tomorrow HH:mm 事情描述\n"
+                "/+30m 事情描述（30 分鐘後，也可用 h、d）\n\n"
                 "範例：\n"
                 "/01-28 14:30 專案週會"
             )
@@ -129,30 +167,24 @@ def handle_event(event_data):
             return
         
         # 儲存到資料庫
-        session = Session()
         try:
-            new_event = Event(
-                group_id=group_id,
-                event_datetime=parsed['event_datetime'],
-                description=parsed['description'],
-                remind_level=0
-            )
-            session.add(new_event)
-            session.commit()
+            event_id = save_event(group_id, parsed['event_datetime'], parsed['description'])
+            list_cache.invalidate(group_id)
             
             # 回覆成功訊息
             time_str = format_datetime(parsed['event_datetime'])
             reply_message = f"✅ 已設定提醒！\n\n📅 時間：{time_str}\n📝 事項：{parsed['description']}\n\n將在以下時間發送提醒：\n• 前 1 天\n• 前 60 分鐘\n• 前 30 分鐘\n• 整點時刻"
             
             send_reply(reply_token, reply_message)
-            logger.info(f" 成功建立提醒: ID={new_event.id}, 時間={time_str}")
+            logger.info(f" 成功建立提醒: ID={event_id}, 時間={time_str}")
             
+        except FutureTimeoutError:
+            # 寫入仍在進行，不回覆錯誤（使用者重新輸入會造成重複），完成後另外推播結果
+            logger.warning(f"等待事件寫入逾時: {group_id} {parsed['description']}")
+            send_reply(reply_token, "⏳ 已收到，稍後確認（設定完成後會另外通知，請勿重新輸入）")
         except Exception as e:
             logger.error(f"儲存事件失敗: {e}", exc_info=True)
-            session.rollback()
             send_reply(reply_token, "系統錯誤，請稍後再試")
-        finally:
-            session.close()
             
     except Exception as e:
         logger.error(f"處理事件失敗: {e}", exc_info=True)
@@ -163,72 +195,213 @@ def handle_event(event_data):
                 pass
 
 
-def send_reply(reply_token, message_text):
-    """發送回覆訊息（使用 requests 避免 OpenSSL 問題）"""
+def save_event(group_id, event_datetime, description):
+    """
+    新增事件並遞增群組清單版本
+    
+    Args:
+        group_id: 群組 ID
+        event_datetime: 事件時間（有時區）
+        description: 事情描述
+    
+    Returns:
+        int: 新事件的 ID
+    """
+    if Config.EVENT_WRITE_MODE == 'batch':
+        # 與其他指令合併成同一個交易，等待寫入執行緒 commit；
+        # 逾時時事件仍會寫入，改由寫入完成後推播結果（與 direct 模式相同，每個指令只新增一筆）
+        future = event_writer.submit(group_id, event_datetime, description)
+        try:
+            return future.result(timeout=Config.EVENT_WRITER_TIMEOUT_SECONDS)
+        except FutureTimeoutError:
+            future.add_done_callback(lambda done: _confirm_event_later(group_id, event_datetime, description, done))
+            raise
+    
+    group_key = group_keys.resolve(group_id)
+    session = Session()
     try:
-        payload = {
-            "replyToken": reply_token,
-            "messages": [
-                {
-                    "type": "text",
-                    "text": message_text
-                }
-            ]
-        }
-        
-        response = requests.post(
-            LINE_REPLY_URL,
-            headers=LINE_HEADERS,
-            json=payload,
-            timeout=10
+        new_event = Event(
+            group_key=group_key,
+            event_datetime=event_datetime,
+            description=description,
+            remind_level=0
         )
-        
-        if response.status_code == 200:
-            logger.info("回覆訊息發送成功")
-        else:
-            logger.error(f"回覆訊息發送失敗: {response.status_code} - {response.text}")
+        session.add(new_event)
+        bump_list_versions(session, [group_key])
+        session.commit()
+        notify_event_scheduled(new_event.id, new_event.next_fire_epoch, new_event.shard_key)
+        return new_event.id
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def _confirm_event_later(group_id, event_datetime, description, future):
+    """等待逾時的新增指令在寫入完成後，以推播告知結果（reply token 已用於「稍後確認」的回覆）"""
+    if future.exception() is None:
+        message = f"✅ 已設定提醒！\n\n📅 時間：{format_datetime(event_datetime)}\n📝 事項：{description}"
+    else:
+        message = f"❌ 提醒設定失敗，請重新輸入\n\n📝 事項：{description}"
+    try:
+        session = Session()
+        try:
+            session.add(new_push(group_id, [text_message(message)]))
+            session.commit()
+        finally:
+            session.close()
+        notify_dispatcher()
+    except Exception as e:
+        logger.error(f"排入新增結果推播失敗: {e}", exc_info=True)
+
+
+# Webhook 事件背景處理佇列
+event_queue = WebhookQueue(
+    handle_event,
+    maxsize=Config.WEBHOOK_QUEUE_SIZE,
+    workers=Config.WEBHOOK_WORKERS
+)
+# 行程結束（gunicorn worker 重啟、SIGTERM）前處理完已回應 200 的事件
+atexit.register(lambda: event_queue.shutdown(Config.WEBHOOK_SHUTDOWN_TIMEOUT))
+
+
+@app.route("/metrics", methods=['GET'])
+def metrics():
+    """佇列深度與等待時間等執行指標"""
+    return jsonify({
+        'webhook_queue': event_queue.stats(),
+        'webhook_dedup': deduplicator.stats(),
+        'list_cache': list_cache.stats(),
+        'group_keys': group_keys.stats(),
+        'event_writer': event_writer.stats(),
+        'line_rate_limit': get_client().limiter.stats()
+    })
+
+
+@app.route("/health", methods=['GET'])
+def health():
+    """
+    健康檢查：LINE API 斷路器開啟時回報 degraded（webhook 仍可接收，訊息改由 outbox 稍後發送）
+    斷路器是本行程的狀態，排程 worker 分開執行時不包含 worker 推播用的斷路器
+    """
+    breaker = get_client().breaker.stats()
+    return jsonify({
+        'status': 'ok' if breaker['state'] == 'closed' else 'degraded',
+        'line_api': breaker
+    })
+
+
+def send_reply(reply_token, message_text):
+    """發送回覆訊息（透過共用連線池的 LINE 用戶端，可重試的失敗改由 outbox 重送；可傳入最多 5 則訊息的清單）"""
+    texts = message_text if isinstance(message_text, list) else [message_text]
+    messages = [text_message(text) for text in texts]
+    try:
+        get_client().reply(reply_token, messages)
+        logger.info("回覆訊息發送成功")
             
     except Exception as e:
         logger.error(f"發送回覆失敗: {e}", exc_info=True)
+        if is_retryable_error(e):
+            try:
+                enqueue_reply(reply_token, messages)
+                logger.info("已將回覆訊息排入 outbox 重試")
+            except Exception as enqueue_error:
+                logger.error(f"回覆訊息排入 outbox 失敗: {enqueue_error}")
+
+
+def render_list_page(session, group_key, page, day=None, after=None):
+    """
+    查詢並渲染 /list 的一頁
+    
+    Args:
+        session: 資料庫 Session
+        group_key: 群組鍵（群組尚未建立時為 None）
+        page: 頁數（從 1 開始）
+        day: 只列出當天（設定時區的 00:00），None 表示全部
+        after: 上一頁最後一筆的 (event_epoch, id) 游標（來自下一頁的指令），None 時依頁數定位
+    
+    Returns:
+        str 或 list: 回覆訊息
+    """
+    page_size = Config.LIST_PAGE_SIZE
+    
+    # 查詢該群組未完成的事件（remind_level < 4），指定日期時只查當天
+    criteria = [Event.group_key == group_key, Event.remind_level < 4]
+    if day is not None:
+        day_end = day.replace(tzinfo=None) + timedelta(days=1)
+        criteria += [Event.event_epoch >= to_epoch(day), Event.event_epoch < to_epoch(day_end)]
+    
+    rows = []
+    if group_key is not None:
+        # 以 (event_epoch, id) 為 keyset 游標：下一頁的指令帶有游標，只需 WHERE > 游標 LIMIT；
+        # 使用者直接輸入頁數時才以 OFFSET 在索引欄位上找到上一頁的最後一筆
+        if after is None and page > 1:
+            after = session.query(Event.event_epoch, Event.id).filter(*criteria).order_by(
+                Event.event_epoch, Event.id
+            ).offset((page - 1) * page_size - 1).limit(1).first()
+            if after is None:
+                return f"❌ 沒有第 {page} 頁"
+        query = session.query(
+            Event.event_epoch, Event.id, Event.event_datetime, Event.remind_level, Event.description
+        ).filter(*criteria)
+        if after is not None:
+            query = query.filter(tuple_(Event.event_epoch, Event.id) > tuple_(*after))
+        # 多取一筆判斷是否還有下一頁（不需要 COUNT）
+        rows = query.order_by(Event.event_epoch, Event.id).limit(page_size + 1).all()
+    
+    if not rows:
+        if page > 1:
+            return f"❌ 沒有第 {page} 頁"
+        if day is not None:
+            return f"📋 {day.strftime('%Y-%m-%d')} 沒有任何行程"
+        return "📋 目前沒有任何行程"
+    
+    # 組合清單訊息（只渲染本頁，依長度分成多則訊息）
+    has_next = len(rows) > page_size
+    rows = rows[:page_size]
+    if page == 1 and not has_next:
+        scope = f"{day.strftime('%Y-%m-%d')} 有" if day is not None else "目前有"
+        title = f"📋 {scope} {len(rows)} 個行程："
+    else:
+        scope = f"{day.strftime('%Y-%m-%d')} 的" if day is not None else "目前的"
+        title = f"📋 {scope}行程（第 {page} 頁）："
+    footer = None
+    if has_next:
+        last_epoch, last_id = rows[-1][:2]
+        prefix = f"/list {day.strftime('%m-%d')}" if day is not None else "/list"
+        footer = f"👉 下一頁：{prefix} {page + 1} @{last_epoch}.{last_id}"
+    return get_list_messages(title, [row[2:] for row in rows], (page - 1) * page_size + 1, footer)
 
 
-def handle_list_command(reply_token, group_id):
-    """處理 /list 指令，列出當前群組的所有行程"""
+def handle_list_command(reply_token, group_id, parsed):
+    """處理 /list 指令，分頁列出當前群組的行程（/list [頁數]、/list MM-DD [頁數]），渲染結果依群組快取"""
+    if parsed is None:
+        reply_message = (
+            "❌ 清單指令格式錯誤\n\n"
+            "正確格式：\n"
+            "/list [頁數]\n"
+            "/list MM-DD [頁數]（只列出當天）"
+        )
+        send_reply(reply_token, reply_message)
+        return
+    
     session = Session()
     try:
-        # 查詢該群組所有未完成的事件（remind_level < 4）
-        events = session.query(Event).filter(
-            Event.group_id == group_id,
-            Event.remind_level < 4
-        ).order_by(Event.event_datetime).all()
-        
-        if not events:
-            reply_message = "📋 目前沒有任何行程"
-            send_reply(reply_token, reply_message)
-            return
+        page = parsed['page']
+        day = parsed['day']
         
-        # 組合清單訊息
-        reply_message = f"📋 目前有 {len(events)} 個行程：\n\n"
+        # 先讀取群組的清單版本再查詢事件：查詢期間有其他寫入時快取的是舊版本，下一次 /list 就會重新渲染
+        group_key = group_keys.lookup(group_id)
+        version = get_list_version(session, group_key)
+        page_key = (to_epoch(day) if day is not None else None, page, parsed['after'])
+        messages = list_cache.get(group_id, page_key, version)
+        if messages is None:
+            messages = render_list_page(session, group_key, page, day, parsed['after'])
+            list_cache.put(group_id, page_key, version, messages)
         
-        for idx, event in enumerate(events, 1):
-            time_str = format_datetime(event.event_datetime)
-            # 狀態標記：0=未提醒, 1=已提醒1天, 2=已提醒60分, 3=已提醒30分
-            if event.remind_level == 0:
-                status_emoji = "⏳"
-            elif event.remind_level == 1:
-                status_emoji = "📅"
-            elif event.remind_level == 2:
-                status_emoji = "🔔"
-            else:
-                status_emoji = "⏰"
-            reply_message += f"{status_emoji} {idx}. {time_str}\n   {event.description}\n\n"
-        
-        # LINE 訊息有長度限制，若超過 2000 字元則截斷
-        if len(reply_message) > 1900:
-            reply_message = reply_message[:1900] + "\n\n... (清單過長，已截斷)"
-        
-        send_reply(reply_token, reply_message)
-        logger.info(f"✅ 已回覆行程清單: {len(events)} 個事件")
+        send_reply(reply_token, messages)
+        logger.info(f"✅ 已回覆行程清單: 第 {page} 頁")
         
     except Exception as e:
         logger.error(f"處理 /list 指令失敗: {e}", exc_info=True)
@@ -237,18 +410,35 @@ def handle_list_command(reply_token, group_id):
         session.close()
 
 
-def handle_remove_command(reply_token, group_id, user_message):
-    """處理 /rm 指令，刪除指定的行程"""
-    from utils import parse_remove_command
-    
-    # 解析刪除指令
-    parsed = parse_remove_command(user_message)
+def _delete_group_events(session, group_key, *criteria):
+    """
+    以單一 DELETE 語句刪除群組中符合條件的事件
     
+    Returns:
+        list: 被刪除事件的 ID
+    """
+    if group_key is None:
+        # 群組尚未建立，沒有任何事件
+        return []
+    criteria = (Event.group_key == group_key, *criteria)
+    statement = delete(Event).where(*criteria).execution_options(synchronize_session=False)
+    if session.get_bind().dialect.delete_returning:
+        return list(session.execute(statement.returning(Event.id)).scalars())
+    # 不支援 DELETE ... RETURNING 的資料庫（如 MySQL）先查出 ID 再刪除
+    event_ids = [row.id for row in session.query(Event.id).filter(*criteria)]
+    session.execute(statement)
+    return event_ids
+
+
+def handle_remove_command(reply_token, group_id, parsed):
+    """處理 /rm 指令，刪除指定的行程、某一天的行程或群組的所有行程"""
     if parsed is None:
         reply_message = (
             "❌ 刪除指令格式錯誤\n\n"
             "正確格式：\n"
-            "/rm MM-DD HH:mm 事情描述\n\n"
+            "/rm MM-DD HH:mm 事情描述\n"
+            "/rm MM-DD（刪除當天所有行程）\n"
+            "/rm all（刪除所有行程）\n\n"
             "範例：\n"
             "/rm 01-29 15:00 重要會議"
         )
@@ -257,27 +447,61 @@ def handle_remove_command(reply_token, group_id, user_message):
     
     session = Session()
     try:
-        # 查詢符合條件的事件（相同群組、相同時間、相同描述）
-        target_datetime = parsed['event_datetime']
-        target_description = parsed['description']
-        
-        events = session.query(Event).filter(
-            Event.group_id == group_id,
-            Event.event_datetime == target_datetime,
-            Event.description == target_description
-        ).all()
+        scope = parsed['scope']
+        group_key = group_keys.lookup(group_id)
+        if scope == 'all':
+            deleted_ids = _delete_group_events(session, group_key)
+        elif scope == 'day':
+            # 當天 00:00 到隔天 00:00（以設定時區計算）
+            day_start = parsed['event_datetime']
+            day_end = day_start.replace(tzinfo=None) + timedelta(days=1)
+            deleted_ids = _delete_group_events(
+                session, group_key,
+                Event.event_epoch >= to_epoch(day_start),
+                Event.event_epoch < to_epoch(day_end)
+            )
+        else:
+            # 相同群組、相同時間、相同描述（以索引比對描述的雜湊，再確認原文）
+            target_datetime = parsed['event_datetime']
+            target_description = parsed['description']
+            deleted_ids = _delete_group_events(
+                session, group_key,
+                Event.event_epoch == to_epoch(target_datetime),
+                Event.description_hash == hash_description(target_description),
+                Event.description == target_description
+            )
+        if deleted_ids:
+            bump_list_versions(session, [group_key])
+        session.commit()
+        if deleted_ids:
+            list_cache.invalidate(group_id)
+        for event_id in deleted_ids:
+            notify_event_removed(event_id)
         
-        if not events:
-            reply_message = f"❌ 找不到符合的行程\n\n📅 時間：{format_datetime(target_datetime)}\n📝 事項：{target_description}"
+        deleted_count = len(deleted_ids)
+        if scope == 'all':
+            if deleted_count == 0:
+                reply_message = "📋 目前沒有任何行程"
+            else:
+                reply_message = f" 已刪除全部 {deleted_count} 個提醒"
             send_reply(reply_token, reply_message)
+            logger.info(f" 成功刪除群組所有提醒: {deleted_count} 個")
             return
         
-        # 刪除所有符合的事件
-        deleted_count = len(events)
-        for event in events:
-            session.delete(event)
+        if scope == 'day':
+            date_str = parsed['event_datetime'].strftime('%Y-%m-%d')
+            if deleted_count == 0:
+                reply_message = f"❌ {date_str} 沒有任何行程"
+            else:
+                reply_message = f" 已刪除 {date_str} 的 {deleted_count} 個提醒"
+            send_reply(reply_token, reply_message)
+            logger.info(f" 成功刪除 {deleted_count} 個提醒: 日期={date_str}")
+            return
         
-        session.commit()
+        if deleted_count == 0:
+            reply_message = f"❌ 找不到符合的行程\n\n📅 時間：{format_datetime(target_datetime)}\n📝 事項：{target_description}"
+            send_reply(reply_token, reply_message)
+            return
         
         # 回覆成功訊息
         time_str = format_datetime(target_datetime)
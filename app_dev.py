@@ -4,10 +4,11 @@
 from flask import Flask, request
 from config import Config
 from models import Session, Event
+from group_keys import GroupKeyCache
 from utils import parse_command, format_datetime
+from line_client import get_client, text_message
 import logging
 import json
-import requests
 
 # 初始化 Flask 應用
 app = Flask(__name__)
@@ -17,13 +18,8 @@ app.config.from_object(Config)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# LINE API 端點
-LINE_REPLY_URL = "https://api.line.me/v2/bot/message/reply"
-LINE_PUSH_URL = "https://api.line.me/v2/bot/message/push"
-LINE_HEADERS = {
-    "Content-Type": "application/json",
-    "Authorization": f"Bearer {Config.LINE_CHANNEL_ACCESS_TOKEN}"
-}
+# LINE 來源 ID 對應的群組鍵（在開啟 Session 之前取得）
+group_keys = GroupKeyCache(maxsize=Config.GROUP_KEY_CACHE_SIZE)
 
 
 @app.route("/", methods=['GET'])
@@ -102,10 +98,11 @@ def handle_event(event_data):
             return
         
         # 儲存到資料庫 - 添加額外的錯誤處理
+        group_key = group_keys.resolve(group_id)
         session = Session()
         try:
             new_event = Event(
-                group_id=group_id,
+                group_key=group_key,
                 event_datetime=parsed['event_datetime'],
                 description=parsed['description'],
                 remind_level=0
@@ -137,29 +134,10 @@ def handle_event(event_data):
 
 
 def send_reply(reply_token, message_text):
-    """發送回覆訊息（使用 requests 避免 OpenSSL 問題）"""
+    """發送回覆訊息（透過共用連線池的 LINE 用戶端）"""
     try:
-        payload = {
-            "replyToken": reply_token,
-            "messages": [
-                {
-                    "type": "text",
-                    "text": message_text
-                }
-            ]
-        }
-        
-        response = requests.post(
-            LINE_REPLY_URL,
-            headers=LINE_HEADERS,
-            json=payload,
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            logger.info("✅ 回覆訊息發送成功")
-        else:
-            logger.error(f"❌ 回覆訊息發送失敗: {response.status_code} - {response.text}")
+        get_client().reply(reply_token, [text_message(message_text)])
+        logger.info("✅ 回覆訊息發送成功")
             
     except Exception as e:
         logger.error(f"發送回覆失敗: {e}", exc_info=True)
@@ -0,0 +1,546 @@
+"""
+效能測試腳本 - 以暫存 SQLite 資料庫量測排程器在大量資料下的耗時
+
+用法：
+    python benchmark.py catchup [事件數量]
+    python benchmark.py tick [事件數量]
+    python benchmark.py timediff [事件數量]
+    python benchmark.py engine [事件數量]
+    python benchmark.py memory [最大事件數量]
+    python benchmark.py parse [訊息數量]
+    python benchmark.py insert [事件數量] [並行執行緒數]
+    python benchmark.py dbprofile [操作次數]
+    python benchmark.py groupkey [事件數量]
+
+insert、dbprofile 預設使用暫存 SQLite；設定 BENCHMARK_DATABASE_URL 時改用該資料庫（例如 PostgreSQL，會寫入測試事件）
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+
+def _use_temp_database(directory):
+    """在匯入 models 之前切換到暫存資料庫"""
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(directory, 'benchmark.db')}"
+
+
+def _insert_backlog(count, since, now):
+    """
+    建立停機期間累積的事件：事件時間平均分布在停機前後，
+    remind_level 為上次檢查 (since) 時應有的等級
+    """
+    from sqlalchemy import insert
+    from models import Session, Event, compute_next_fire_epoch, compute_shard_key, create_group, from_epoch, to_epoch
+    from scheduler import missed_reminders
+
+    since_epoch = to_epoch(since)
+    start = since_epoch - 3600
+    span = to_epoch(now) + 25 * 3600 - start
+    created_at = datetime.now() - timedelta(days=2)
+    group_keys = [create_group(f"benchmark_group_{i}") for i in range(1000)]
+    rows = []
+    for i in range(count):
+        event_epoch = start + span * i // count
+        _, level = missed_reminders(0, event_epoch, 0, since_epoch)
+        group_key = group_keys[i % 1000]
+        rows.append({
+            'group_key': group_key,
+            'event_datetime': from_epoch(event_epoch),
+            'event_epoch': event_epoch,
+            'description': f"效能測試事件 {i}",
+            'remind_level': level,
+            'next_fire_epoch': compute_next_fire_epoch(event_epoch, level),
+            'shard_key': compute_shard_key(group_key),
+            'created_at': created_at,
+        })
+
+    session = Session()
+    try:
+        for i in range(0, len(rows), 5000):
+            session.execute(insert(Event), rows[i:i + 5000])
+        session.commit()
+    finally:
+        session.close()
+
+
+def benchmark_catch_up(count=100000):
+    """量測停機 3 小時後的補發檢查（單一查詢 + 批次更新 + 摘要寫入 outbox）與後續第一次檢查"""
+    with tempfile.TemporaryDirectory() as directory:
+        _use_temp_database(directory)
+        from models import Session, OutboxMessage, SchedulerCheckpoint, init_database, to_local_naive, tz
+        import scheduler
+
+        init_database()
+        now = to_local_naive(datetime.now(tz))
+        since = now - timedelta(hours=3)
+        _insert_backlog(count, since, now)
+        session = Session()
+        session.add(SchedulerCheckpoint(name=scheduler.CHECKPOINT_NAME, last_tick_at=since))
+        session.commit()
+        session.close()
+
+        started = time.perf_counter()
+        missed = scheduler.catch_up_missed_reminders(policy='digest')
+        catch_up_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        scheduler.check_and_send_reminders()
+        tick_seconds = time.perf_counter() - started
+
+        session = Session()
+        pushes = session.query(OutboxMessage).count()
+        session.close()
+
+    print(f"\n事件數量: {count}，停機 3 小時")
+    print(f"補發檢查: {catch_up_seconds:.2f} 秒，{missed} 個事件錯過提醒")
+    print(f"補發後第一次檢查: {tick_seconds:.2f} 秒")
+    print(f"outbox 推播: {pushes} 則")
+
+
+def benchmark_tick(count=100000):
+    """量測一次提醒檢查處理大量到期事件（狀態轉換計算 + 批次更新 + 寫入 outbox）的耗時"""
+    with tempfile.TemporaryDirectory() as directory:
+        _use_temp_database(directory)
+        from models import init_database, to_local_naive, tz
+        import scheduler
+
+        init_database()
+        now = to_local_naive(datetime.now(tz))
+        _insert_backlog(count, now - timedelta(hours=25), now)
+
+        started = time.process_time()
+        wall_started = time.perf_counter()
+        scheduler.check_and_send_reminders()
+        cpu_seconds = time.process_time() - started
+        wall_seconds = time.perf_counter() - wall_started
+
+    print(f"\n事件數量: {count}")
+    print(f"提醒檢查: {wall_seconds:.2f} 秒（CPU {cpu_seconds:.2f} 秒）")
+
+
+def benchmark_time_diff(count=1000000):
+    """量測每個事件計算剩餘分鐘數的成本：naive datetime 經 pytz 轉換 vs. UTC epoch 整數相減"""
+    import pytz
+    from config import Config
+
+    tz = pytz.timezone(Config.TIMEZONE)
+    now = datetime.now(tz)
+    now_epoch = now.timestamp()
+    naive = [datetime(2025, 1, 28, 14, 30) + timedelta(seconds=i) for i in range(count)]
+    epochs = [int(tz.localize(dt).timestamp()) for dt in naive]
+
+    started = time.perf_counter()
+    for event_datetime in naive:
+        (tz.localize(event_datetime) - now).total_seconds() / 60
+    datetime_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for event_epoch in epochs:
+        (event_epoch - now_epoch) / 60
+    epoch_seconds = time.perf_counter() - started
+
+    print(f"\n事件數量: {count}")
+    print(f"pytz 轉換: {datetime_seconds:.2f} 秒")
+    print(f"epoch 相減: {epoch_seconds:.2f} 秒（{datetime_seconds / epoch_seconds:.0f} 倍）")
+
+
+def benchmark_engine(count=1000000):
+    """量測狀態轉換計算：逐筆呼叫 evaluate_event vs. tick_engine 以排序欄位切分區段"""
+    from scheduler import evaluate_event
+    from tick_engine import ColumnBatch, plan, segment_ids
+
+    now_epoch = int(time.time())
+    span = 26 * 3600
+    rows = sorted(
+        ((i, i % 1000 + 1, now_epoch - 3600 + span * i // count, i % 5) for i in range(count)),
+        key=lambda row: (row[3], row[2])
+    )
+
+    started = time.perf_counter()
+    per_row = {}
+    for event_id, _, event_epoch, level in rows:
+        per_row.setdefault(evaluate_event(level, (event_epoch - now_epoch) / 60), []).append(event_id)
+    per_row_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batch = ColumnBatch(rows)
+    build_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    segments = {result: segment_ids(batch, ranges) for result, ranges in plan(batch, now_epoch).items()}
+    plan_seconds = time.perf_counter() - started
+
+    same = all(list(segments.get(result, ())) == ids for result, ids in per_row.items())
+    print(f"\n事件數量: {count}")
+    print(f"逐筆 evaluate_event: {per_row_seconds:.2f} 秒")
+    print(f"建立欄位緩衝區: {build_seconds:.2f} 秒")
+    print(f"區段切分: {plan_seconds * 1000:.1f} 毫秒（{len(segments)} 種狀態轉換，結果{'一致' if same else '不一致'}）")
+
+
+def _insert_future_events(count, group_id, due):
+    """建立一個群組的大量未來事件，其中 due 個事件已到期（一般檢查需要處理）"""
+    from sqlalchemy import insert
+    from models import Session, Event, compute_next_fire_epoch, compute_shard_key, create_group, from_epoch
+
+    now_epoch = int(time.time())
+    group_key = create_group(group_id)
+    shard_key = compute_shard_key(group_key)
+    rows = []
+    for i in range(count):
+        # 已到期的事件在 24 小時提醒時間窗內，其餘事件在 2 天之後
+        event_epoch = now_epoch + 1440 * 60 + i if i < due else now_epoch + 2 * 86400 + i * 60
+        rows.append({
+            'group_key': group_key,
+            'event_datetime': from_epoch(event_epoch),
+            'event_epoch': event_epoch,
+            'description': f"效能測試事件 {i} " + "說明" * 50,
+            'remind_level': 0,
+            'next_fire_epoch': now_epoch - 1 if i < due else compute_next_fire_epoch(event_epoch, 0),
+            'shard_key': shard_key,
+        })
+
+    session = Session()
+    try:
+        for i in range(0, len(rows), 5000):
+            session.execute(insert(Event), rows[i:i + 5000])
+        session.commit()
+    finally:
+        session.close()
+
+
+def _peak_memory(func, *args):
+    """以 tracemalloc 量測函式執行期間的記憶體高峰（KB）"""
+    import tracemalloc
+
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_memory(count=100000):
+    """量測資料表變大時提醒檢查與 /list 的記憶體高峰（每次只有 1000 個事件到期）"""
+    group_id = 'benchmark_group'
+    with tempfile.TemporaryDirectory() as directory:
+        _use_temp_database(directory)
+        from models import Session, Event, find_group_key, init_database
+        import scheduler
+        import app
+
+        init_database()
+        app.send_reply = lambda reply_token, message: None
+
+        def load_entities():
+            session = Session()
+            try:
+                session.query(Event).filter(Event.group_key == find_group_key(session, group_id)).all()
+            finally:
+                session.close()
+
+        print(f"\n{'事件數量':>10} {'提醒檢查':>12} {'/list':>12} {'載入完整 Event':>16}")
+        size = 0
+        for target in (count // 10, count // 2, count):
+            # 資料表逐步變大，每輪新增 1000 個到期事件（上一輪的已在檢查中前進）
+            _insert_future_events(target - size, group_id, due=1000)
+            size = target
+            list_kb = _peak_memory(app.handle_list_command, 'benchmark-token', group_id, {'page': 1, 'day': None})
+            entities_kb = _peak_memory(load_entities)
+            tick_kb = _peak_memory(scheduler.check_and_send_reminders)
+            print(f"{size:>10} {tick_kb:>10.0f}KB {list_kb:>10.0f}KB {entities_kb:>14.0f}KB")
+
+
+def _legacy_parse(text):
+    """舊版的指令分派與解析：逐一比對前綴，每次呼叫 re.match（未編譯的字串）、pytz.timezone 與 datetime.now"""
+    import re
+    import pytz
+    from config import Config
+
+    def resolve(pattern, with_time=True):
+        match = re.match(pattern, text.strip())
+        if not match or match.group(1) is None:
+            return None
+        tz = pytz.timezone(Config.TIMEZONE)
+        now = datetime.now(tz)
+        month, day = int(match.group(1)), int(match.group(2))
+        year = now.year + 1 if month < now.month else now.year
+        try:
+            hour, minute = (int(match.group(3)), int(match.group(4))) if with_time else (0, 0)
+            return tz.localize(datetime(year, month, day, hour, minute)), now
+        except ValueError:
+            return None
+
+    if text.strip().lower().startswith('/list'):
+        resolve(r'^/list(?:\s+(\d{2})-(\d{2}))?(?:\s+(\d+))?$', with_time=False)
+        return 'list'
+    if text.strip().lower().startswith('/rm'):
+        resolve(r'^/rm\s+(\d{2})-(\d{2})\s+(\d{2}):(\d{2})\s+(.+)$')
+        return 'remove'
+    resolve(r'^/(\d{2})-(\d{2})\s+(\d{2}):(\d{2})\s+(.+)$')
+    return 'add'
+
+
+def benchmark_parse(count=200000):
+    """量測每秒可解析的訊息數：舊版逐一比對 vs. commands 預先編譯的單一文法"""
+    from commands import parse_message
+
+    samples = [
+        "/01-28 14:30 專案週會",
+        "/12-31 23:59 跨年倒數",
+        "/list",
+        "/list 2",
+        "/rm 01-28 14:30 專案週會",
+        "/13-45 25:99 錯誤的日期時間",
+    ]
+    messages = [samples[i % len(samples)] for i in range(count)]
+
+    started = time.perf_counter()
+    for text in messages:
+        _legacy_parse(text)
+    legacy_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for text in messages:
+        parse_message(text)
+    compiled_seconds = time.perf_counter() - started
+
+    print(f"\n訊息數量: {count}")
+    print(f"舊版逐一比對: {count / legacy_seconds:,.0f} 則/秒")
+    print(f"預先編譯的單一文法: {count / compiled_seconds:,.0f} 則/秒（{legacy_seconds / compiled_seconds:.1f} 倍）")
+
+
+def benchmark_insert(count=2000, threads=16):
+    """量測多個 webhook 執行緒同時新增事件時，逐筆 commit 與批次寫入的每秒新增數"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    with tempfile.TemporaryDirectory() as directory:
+        _use_temp_database(directory)
+        if os.getenv('BENCHMARK_DATABASE_URL'):
+            os.environ['DATABASE_URL'] = os.environ['BENCHMARK_DATABASE_URL']
+        from config import Config
+        from models import engine, init_database, tz
+        import app
+
+        init_database()
+        event_datetime = datetime.now(tz) + timedelta(days=3)
+
+        def insert_one(i):
+            # 事件分散在 100 個群組，模擬多個群組同時輸入指令
+            return app.save_event(f"benchmark_group_{i % 100}", event_datetime, f"效能測試事件 {i}")
+
+        print(f"\n資料庫: {engine.dialect.name}，事件數量: {count}，並行執行緒: {threads}")
+        results = {}
+        for mode in ('direct', 'batch'):
+            Config.EVENT_WRITE_MODE = mode
+            errors = 0
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                futures = [pool.submit(insert_one, i) for i in range(count)]
+                for future in futures:
+                    try:
+                        future.result()
+                    except Exception:
+                        errors += 1
+            seconds = time.perf_counter() - started
+            results[mode] = (count - errors) / seconds
+            print(f"{mode:>8}: {results[mode]:,.0f} 筆/秒，失敗 {errors} 筆")
+        print(f"批次寫入: {results['batch'] / results['direct']:.1f} 倍，{app.event_writer.stats()}")
+
+
+def _latency(samples):
+    """平均與 p95 延遲（毫秒）"""
+    samples = sorted(samples)
+    return sum(samples) / len(samples) * 1000, samples[int(len(samples) * 0.95)] * 1000
+
+
+def benchmark_db_profile(count=2000):
+    """比較 create_engine 預設值與連線設定檔（SQLite WAL 與 pragma、PostgreSQL 連線池）的讀寫延遲"""
+    import threading
+    from sqlalchemy import create_engine, insert, select
+    from sqlalchemy.orm import sessionmaker
+
+    with tempfile.TemporaryDirectory() as directory:
+        _use_temp_database(directory)
+        url = os.getenv('BENCHMARK_DATABASE_URL')
+        from models import Base, Event, Group, create_database_engine, from_epoch
+
+        print(f"\n{'設定':<10} {'寫入 平均/p95':>18} {'讀取 平均/p95':>18} {'寫入時讀取 平均/p95':>22}")
+        for name, make_engine in (
+            ('預設', lambda database_url: create_engine(database_url)),
+            ('設定檔', create_database_engine),
+        ):
+            database_url = url or f"sqlite:///{os.path.join(directory, name + '.db')}"
+            db_engine = make_engine(database_url)
+            tables = [Group.__table__, Event.__table__]
+            Base.metadata.drop_all(db_engine, tables=tables)
+            Base.metadata.create_all(db_engine, tables=tables)
+            with db_engine.begin() as conn:
+                conn.execute(insert(Group), [
+                    {'id': i + 1, 'line_id': f"benchmark_group_{i}", 'list_version': 0} for i in range(100)
+                ])
+            session_factory = sessionmaker(bind=db_engine)
+            now_epoch = int(time.time())
+
+            def write(i):
+                # 與新增指令相同：每筆事件一個交易
+                event_epoch = now_epoch + 86400 + i * 60
+                session = session_factory()
+                try:
+                    session.execute(insert(Event), [{
+                        'group_key': i % 100 + 1,
+                        'event_datetime': from_epoch(event_epoch),
+                        'event_epoch': event_epoch,
+                        'description': f"效能測試事件 {i}",
+                        'remind_level': 0,
+                        'next_fire_epoch': event_epoch - 1450 * 60,
+                    }])
+                    session.commit()
+                finally:
+                    session.close()
+
+            def read(i):
+                # 與 /list 相同：依群組與事件時間取一頁
+                session = session_factory()
+                try:
+                    session.execute(
+                        select(Event.id, Event.event_epoch, Event.description)
+                        .where(Event.group_key == i % 100 + 1)
+                        .order_by(Event.event_epoch, Event.id).limit(20)
+                    ).all()
+                finally:
+                    session.close()
+
+            def measure(func, offset=0):
+                samples = []
+                for i in range(count):
+                    started = time.perf_counter()
+                    func(offset + i)
+                    samples.append(time.perf_counter() - started)
+                return _latency(samples)
+
+            writes = measure(write)
+            reads = measure(read)
+            # 背景持續寫入時的讀取延遲（rollback journal 模式下讀取會等待寫入鎖）
+            stop = threading.Event()
+
+            def background_writes():
+                i = count
+                while not stop.is_set():
+                    write(i)
+                    i += 1
+
+            writer = threading.Thread(target=background_writes)
+            writer.start()
+            try:
+                contended = measure(read)
+            finally:
+                stop.set()
+                writer.join()
+            db_engine.dispose()
+            print(f"{name:<10} {writes[0]:>8.2f}/{writes[1]:.2f}ms {reads[0]:>8.2f}/{reads[1]:.2f}ms "
+                  f"{contended[0]:>12.2f}/{contended[1]:.2f}ms")
+
+
+def benchmark_group_key(count=200000):
+    """比較事件直接存放 LINE 來源 ID（字串）與參照整數群組鍵的資料表大小、/list 查詢與依群組統計的耗時"""
+    import random
+    from sqlalchemy import insert, text
+    from models import Base, Event, Group, compute_next_fire_epoch, create_database_engine, from_epoch
+
+    with tempfile.TemporaryDirectory() as directory:
+        groups = 1000
+        line_ids = [f"C{random.Random(i).getrandbits(128):032x}" for i in range(groups)]
+        now_epoch = int(time.time())
+        rows = []
+        for i in range(count):
+            event_epoch = now_epoch + 86400 + i * 60
+            rows.append({
+                'group_key': i % groups + 1,
+                'event_datetime': from_epoch(event_epoch),
+                'event_epoch': event_epoch,
+                'description': f"效能測試事件 {i}",
+                'remind_level': i % 4,
+                'next_fire_epoch': compute_next_fire_epoch(event_epoch, i % 4),
+            })
+
+        print(f"\n事件數量: {count}，群組數量: {groups}")
+        print(f"{'欄位':<12} {'資料庫大小':>12} {'/list 一頁':>12} {'依群組統計':>12}")
+        for name, column, keys in (
+            ('group_id 字串', 'group_id', line_ids),
+            ('group_key 整數', 'group_key', list(range(1, groups + 1))),
+        ):
+            db_engine = create_database_engine(f"sqlite:///{os.path.join(directory, column + '.db')}")
+            if column == 'group_id':
+                # 改用群組鍵之前的資料表結構
+                with db_engine.begin() as conn:
+                    conn.execute(text(
+                        "CREATE TABLE events (id INTEGER PRIMARY KEY, group_id VARCHAR(100) NOT NULL, "
+                        "event_datetime DATETIME NOT NULL, event_epoch BIGINT, description TEXT NOT NULL, "
+                        "description_hash VARCHAR(64), remind_level INTEGER NOT NULL, next_fire_epoch BIGINT, "
+                        "shard_key INTEGER, claimed_by VARCHAR(200), claimed_until DATETIME, created_at DATETIME)"
+                    ))
+                    for index_columns in ('group_id', 'event_datetime', 'event_epoch', 'next_fire_epoch', 'shard_key',
+                                          'group_id, event_epoch, description_hash'):
+                        index_name = 'ix_events_' + index_columns.split(',')[0] + ('_event_epoch' if ',' in index_columns else '')
+                        conn.execute(text(f"CREATE INDEX {index_name} ON events ({index_columns})"))
+                    conn.execute(text(
+                        "INSERT INTO events (group_id, event_datetime, event_epoch, description, remind_level, next_fire_epoch) "
+                        "VALUES (:group_id, :event_datetime, :event_epoch, :description, :remind_level, :next_fire_epoch)"
+                    ), [dict(row, group_id=line_ids[row['group_key'] - 1]) for row in rows])
+            else:
+                Base.metadata.create_all(db_engine, tables=[Group.__table__, Event.__table__])
+                with db_engine.begin() as conn:
+                    conn.execute(insert(Group), [
+                        {'id': i + 1, 'line_id': line_id, 'list_version': 0} for i, line_id in enumerate(line_ids)
+                    ])
+                    for i in range(0, len(rows), 5000):
+                        conn.execute(insert(Event), rows[i:i + 5000])
+
+            with db_engine.connect() as conn:
+                conn.execute(text("VACUUM"))
+                size_mb = conn.execute(text("PRAGMA page_count")).scalar() * \
+                    conn.execute(text("PRAGMA page_size")).scalar() / 1024 / 1024
+
+                page = text(
+                    f"SELECT event_datetime, remind_level, description FROM events "
+                    f"WHERE {column} = :key AND remind_level < 4 ORDER BY event_epoch, id LIMIT 20"
+                )
+                started = time.perf_counter()
+                for key in keys * 5:
+                    conn.execute(page, {'key': key}).all()
+                list_ms = (time.perf_counter() - started) / (len(keys) * 5) * 1000
+
+                started = time.perf_counter()
+                for _ in range(5):
+                    conn.execute(text(
+                        f"SELECT {column}, count(*) FROM events WHERE remind_level < 4 GROUP BY {column}"
+                    )).all()
+                group_ms = (time.perf_counter() - started) / 5 * 1000
+            db_engine.dispose()
+            print(f"{name:<12} {size_mb:>10.1f}MB {list_ms:>10.3f}ms {group_ms:>10.1f}ms")
+
+
+BENCHMARKS = {
+    'catchup': benchmark_catch_up,
+    'tick': benchmark_tick,
+    'timediff': benchmark_time_diff,
+    'engine': benchmark_engine,
+    'memory': benchmark_memory,
+    'parse': benchmark_parse,
+    'insert': benchmark_insert,
+    'dbprofile': benchmark_db_profile,
+    'groupkey': benchmark_group_key,
+}
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.INFO)
+
+    name = sys.argv[1] if len(sys.argv) > 1 else 'catchup'
+    args = [int(arg) for arg in sys.argv[2:]]
+    print(f"🧪 效能測試: {name}")
+    BENCHMARKS[name](*args)
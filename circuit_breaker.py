@@ -0,0 +1,108 @@
+"""
+LINE API 斷路器
+連續失敗達到門檻後進入 open 狀態，在冷卻時間內直接拒絕請求而不等待逾時；
+冷卻結束後進入 half-open，只放行一個試探請求，成功即恢復 closed，失敗則重新 open
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """斷路器 open 中，請求未送出"""
+
+    def __init__(self, name, retry_in):
+        super().__init__(f"{name} 斷路器開啟中，{retry_in:.1f} 秒後再試")
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """closed / open / half-open 三態斷路器（執行緒安全）"""
+
+    def __init__(self, name, failure_threshold, reset_seconds):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._state = STATE_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._rejected = 0
+        self._opened = 0
+        self._last_error = None
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now):
+        if self._state == STATE_OPEN and now - self._opened_at >= self.reset_seconds:
+            return STATE_HALF_OPEN
+        return self._state
+
+    def is_open(self):
+        """冷卻中（不會放行任何請求）"""
+        return self.state == STATE_OPEN
+
+    def before_call(self):
+        """
+        請求前檢查，open 中或已有試探請求時拋出 CircuitOpenError
+        """
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == STATE_CLOSED:
+                return
+            if state == STATE_HALF_OPEN and not self._probing:
+                self._state = STATE_HALF_OPEN
+                self._probing = True
+                return
+            self._rejected += 1
+            retry_in = max(0.0, self.reset_seconds - (now - self._opened_at))
+        raise CircuitOpenError(self.name, retry_in)
+
+    def record_success(self):
+        with self._lock:
+            if self._state != STATE_CLOSED:
+                logger.info(f"[斷路器] {self.name} 恢復正常")
+            self._state = STATE_CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self, error):
+        with self._lock:
+            self._failures += 1
+            self._last_error = str(error)
+            if self._state == STATE_HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != STATE_OPEN:
+                    self._opened += 1
+                    logger.warning(
+                        f"[斷路器] {self.name} 開啟：連續失敗 {self._failures} 次，"
+                        f"{self.reset_seconds} 秒後試探 - {error}"
+                    )
+                self._state = STATE_OPEN
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def stats(self):
+        """斷路器狀態"""
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            return {
+                'state': state,
+                'consecutive_failures': self._failures,
+                'retry_in_seconds': round(max(0.0, self.reset_seconds - (now - self._opened_at)), 1)
+                if state == STATE_OPEN else 0.0,
+                'times_opened': self._opened,
+                'rejected': self._rejected,
+                'last_error': self._last_error,
+            }
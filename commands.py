@@ -0,0 +1,177 @@
+"""
+指令文法與解析
+所有指令的文法登記在同一個註冊表中，並預先編譯成單一正規表達式；
+每則訊息只比對一次即可同時得到指令種類與解析結果，時區物件也只在匯入時建立一次
+"""
+import logging
+import re
+from datetime import datetime, timedelta
+import pytz
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# 指令種類
+COMMAND_ADD = 'add'
+COMMAND_LIST = 'list'
+COMMAND_REMOVE = 'remove'
+
+tz = pytz.timezone(Config.TIMEZONE)
+
+# 相對時間單位（/+30m、/+2h、/+1d）
+_RELATIVE_UNITS = {'m': 'minutes', 'h': 'hours', 'd': 'days'}
+
+# 文法註冊表：[(指令種類, 文法, 解析函數)]，依登記順序比對
+_GRAMMARS = []
+_compiled = None
+
+# 不符合任何文法時，依前綴判斷使用者想輸入的指令（回覆對應的格式說明）
+_PREFIXES = re.compile(r'/(?:(list)|(rm))', re.IGNORECASE)
+
+
+def grammar(kind, pattern):
+    """
+    登記指令文法
+
+    Args:
+        kind: 指令種類
+        pattern: 正規表達式（不含 ^ 與 $，群組依序傳給解析函數）
+
+    解析函數的參數為 (目前時間, *群組)，回傳解析結果 dict，格式正確但內容無效時回傳 None
+    """
+    def register(parser):
+        global _compiled
+        _GRAMMARS.append((kind, pattern, parser))
+        _compiled = None
+        return parser
+    return register
+
+
+def _compile():
+    """將所有文法合併成一個正規表達式，記錄每個文法外層群組的編號與內部群組數量"""
+    global _compiled
+    alternatives = []
+    slots = {}
+    index = 1
+    for kind, pattern, parser in _GRAMMARS:
+        alternatives.append(f"({pattern})")
+        groups = re.compile(pattern).groups
+        slots[index] = (kind, parser, groups)
+        index += groups + 1
+    _compiled = (re.compile(r'^(?:' + '|'.join(alternatives) + r')$', re.IGNORECASE), slots)
+    return _compiled
+
+
+def _localize(*fields):
+    """
+    建立設定時區的時間
+    直接使用 tz.localize：跨越時區切換或負日光節約時間（例如 Africa/Casablanca 齋戒月期間）的重複與不存在時間，
+    只依目前 UTC 偏移換算的捷徑會得到不同的結果
+    """
+    return tz.localize(datetime(*fields))
+
+
+def _resolve_year(month, now):
+    """年份處理邏輯：若輸入月份小於當前月份，則設為明年"""
+    return now.year + 1 if month < now.month else now.year
+
+
+def parse_message(text, now=None):
+    """
+    解析訊息並判斷指令種類（單次比對）
+
+    Args:
+        text: 用戶輸入的文字
+        now: 目前時間（有時區），預設為現在
+
+    Returns:
+        tuple: (指令種類, 解析結果)；格式錯誤或時間無效時解析結果為 None，
+               無法判斷指令種類時為 (None, None)
+    """
+    pattern, slots = _compiled or _compile()
+    text = text.strip()
+    match = pattern.match(text)
+    if match is None:
+        prefix = _PREFIXES.match(text)
+        if prefix is None:
+            return (COMMAND_ADD, None) if text.startswith('/') else (None, None)
+        return (COMMAND_LIST, None) if prefix.group(1) else (COMMAND_REMOVE, None)
+
+    # 外層群組最後結束，lastindex 即為符合的文法
+    kind, parser, groups = slots[match.lastindex]
+    values = match.groups()[match.lastindex:match.lastindex + groups]
+    try:
+        return kind, parser(now or datetime.now(tz), *values)
+    except ValueError as e:
+        logger.info(f"指令解析錯誤: {text} - {e}")
+        return kind, None
+
+
+def _future_event(event_datetime, description, now):
+    """新增的事件時間必須在未來"""
+    if event_datetime <= now:
+        return None
+    return {
+        'event_datetime': event_datetime,
+        'description': description.strip()
+    }
+
+
+@grammar(COMMAND_LIST, r'/list(?:\s+(\d{2})-(\d{2}))?(?:\s+(\d+)(?:\s+@(\d+)\.(\d+))?)?')
+def _parse_list(now, month, day, page, after_epoch, after_id):
+    """/list [頁數]、/list MM-DD [頁數]；下一頁的指令另外帶上上一頁最後一筆的 (event_epoch, id) 游標（@epoch.id）"""
+    page = int(page) if page else 1
+    if page < 1:
+        return None
+    after = (int(after_epoch), int(after_id)) if after_epoch else None
+    if month is None:
+        return {'page': page, 'day': None, 'after': after}
+    month = int(month)
+    return {'page': page, 'day': _localize(_resolve_year(month, now), month, int(day)), 'after': after}
+
+
+@grammar(COMMAND_REMOVE, r'/rm\s+all')
+def _parse_remove_all(now):
+    """/rm all"""
+    return {'scope': 'all'}
+
+
+@grammar(COMMAND_REMOVE, r'/rm\s+(\d{2})-(\d{2})(?:\s+(\d{2}):(\d{2})\s+(.+))?')
+def _parse_remove(now, month, day, hour, minute, description):
+    """/rm MM-DD HH:mm 事情描述、/rm MM-DD"""
+    month = int(month)
+    event_datetime = _localize(_resolve_year(month, now), month, int(day), int(hour or 0), int(minute or 0))
+    if description is None:
+        return {'scope': 'day', 'event_datetime': event_datetime}
+    return {'scope': 'event', 'event_datetime': event_datetime, 'description': description.strip()}
+
+
+@grammar(COMMAND_ADD, r'/(\d{2})-(\d{2})\s+(\d{2}):(\d{2})\s+(.+)')
+def _parse_add(now, month, day, hour, minute, description):
+    """/MM-DD HH:mm 事情描述"""
+    month = int(month)
+    event_datetime = _localize(_resolve_year(month, now), month, int(day), int(hour), int(minute))
+    return _future_event(event_datetime, description, now)
+
+
+@grammar(COMMAND_ADD, r'/(\d{4})-(\d{2})-(\d{2})\s+(\d{2}):(\d{2})\s+(.+)')
+def _parse_add_with_year(now, year, month, day, hour, minute, description):
+    """/YYYY-MM-DD HH:mm 事情描述"""
+    event_datetime = _localize(int(year), int(month), int(day), int(hour), int(minute))
+    return _future_event(event_datetime, description, now)
+
+
+@grammar(COMMAND_ADD, r'/\+(\d{1,4})([mhd])\s+(.+)')
+def _parse_add_relative(now, amount, unit, description):
+    """/+30m 事情描述、/+2h、/+1d（從現在起算，取到分鐘）"""
+    delta = timedelta(**{_RELATIVE_UNITS[unit.lower()]: int(amount)})
+    event_datetime = tz.normalize(now + delta).replace(second=0, microsecond=0)
+    return _future_event(event_datetime, description, now)
+
+
+@grammar(COMMAND_ADD, r'/(today|tomorrow)\s+(\d{2}):(\d{2})\s+(.+)')
+def _parse_add_day(now, day, hour, minute, description):
+    """/today HH:mm 事情描述、/tomorrow HH:mm 事情描述"""
+    date = now.date() + timedelta(days=1 if day.lower() == 'tomorrow' else 0)
+    event_datetime = _localize(date.year, date.month, date.day, int(hour), int(minute))
+    return _future_event(event_datetime, description, now)
@@ -15,12 +15,102 @@ class Config:
     LINE_CHANNEL_ACCESS_TOKEN = os.getenv('LINE_CHANNEL_ACCESS_TOKEN')
     LINE_CHANNEL_SECRET = os.getenv('LINE_CHANNEL_SECRET')
     
+    # LINE API 連線設定
+    LINE_API_BASE_URL = os.getenv('LINE_API_BASE_URL', 'https://api.line.me')
+    # keep-alive 連線池大小（建議不小於 PUSH_CONCURRENCY）
+    LINE_HTTP_POOL_SIZE = int(os.getenv('LINE_HTTP_POOL_SIZE', '10'))
+    LINE_CONNECT_TIMEOUT = float(os.getenv('LINE_CONNECT_TIMEOUT', '3'))
+    LINE_READ_TIMEOUT = float(os.getenv('LINE_READ_TIMEOUT', '10'))
+    # 每個行程每秒最多送出的 LINE API 請求數（回覆與推播共用，0 表示不限制）與可累積的突發量
+    # 多個行程共用同一個 channel 時，各行程的預算加總不應超過 LINE 的速率上限
+    LINE_RATE_LIMIT_RPS = float(os.getenv('LINE_RATE_LIMIT_RPS', '100'))
+    LINE_RATE_LIMIT_BURST = float(os.getenv('LINE_RATE_LIMIT_BURST', '0')) or None
+    # 斷路器：連續失敗（逾時、連線錯誤、5xx）幾次後開啟，以及開啟後多久放行試探請求（秒）
+    LINE_BREAKER_FAILURE_THRESHOLD = int(os.getenv('LINE_BREAKER_FAILURE_THRESHOLD', '5'))
+    LINE_BREAKER_RESET_SECONDS = float(os.getenv('LINE_BREAKER_RESET_SECONDS', '30'))
+    
+    # Webhook 背景處理設定
+    # 佇列容量（以 webhook 請求為單位），滿了會回應 503
+    WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+    WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '4'))
+    # 行程結束前等待佇列中已回應 200 的事件處理完成的最長時間（秒），應小於 gunicorn 的 graceful_timeout（預設 30 秒）
+    WEBHOOK_SHUTDOWN_TIMEOUT = float(os.getenv('WEBHOOK_SHUTDOWN_TIMEOUT', '20'))
+    # webhookEventId 去重的記憶體快取大小與保留時間（秒）
+    WEBHOOK_DEDUP_CACHE_SIZE = int(os.getenv('WEBHOOK_DEDUP_CACHE_SIZE', '10000'))
+    WEBHOOK_DEDUP_TTL_SECONDS = int(os.getenv('WEBHOOK_DEDUP_TTL_SECONDS', '86400'))
+    
     # 資料庫設定
     DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///reminders.db')
+    # 串流查詢（排程檢查、/list）每次從資料庫取回的列數，記憶體用量不隨資料表大小增加
+    QUERY_YIELD_PER = int(os.getenv('QUERY_YIELD_PER', '1000'))
+    # PostgreSQL 連線池：每個行程保持的連線數、尖峰時額外允許的連線數、連線汰換時間（秒）
+    # 與取出連線前是否先檢查（平台會關閉閒置連線）；行程數 ×（POOL_SIZE + MAX_OVERFLOW）不應超過資料庫連線上限
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '5'))
+    DB_POOL_RECYCLE_SECONDS = int(os.getenv('DB_POOL_RECYCLE_SECONDS', '1800'))
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    # PostgreSQL 單一語句的執行時間上限（毫秒，0 表示不限制）
+    DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '30000'))
+    # SQLite 連線設定：日誌模式、同步等級、記憶體映射大小（位元組）與等待鎖的時間（毫秒）
+    SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+    # /list 每頁顯示的事件數量（一頁最多以 5 則訊息回覆，建議不超過 40）
+    LIST_PAGE_SIZE = int(os.getenv('LIST_PAGE_SIZE', '20'))
+    # /list 渲染結果快取：最多快取的群組數量與保留時間（秒）
+    LIST_CACHE_SIZE = int(os.getenv('LIST_CACHE_SIZE', '1000'))
+    LIST_CACHE_TTL_SECONDS = int(os.getenv('LIST_CACHE_TTL_SECONDS', '300'))
+    # LINE 來源 ID 到群組鍵的快取數量
+    GROUP_KEY_CACHE_SIZE = int(os.getenv('GROUP_KEY_CACHE_SIZE', '10000'))
+    # 新增事件的寫入方式：direct（每個指令各自 commit）或 batch（由單一寫入執行緒合併成批次交易）
+    EVENT_WRITE_MODE = os.getenv('EVENT_WRITE_MODE', 'direct')
+    # 批次寫入：每批最多筆數、收到第一筆後等待後續事件的時間（毫秒）與指令等待寫入完成的上限（秒）
+    EVENT_WRITER_MAX_BATCH = int(os.getenv('EVENT_WRITER_MAX_BATCH', '200'))
+    EVENT_WRITER_LINGER_MS = float(os.getenv('EVENT_WRITER_LINGER_MS', '5'))
+    EVENT_WRITER_TIMEOUT_SECONDS = float(os.getenv('EVENT_WRITER_TIMEOUT_SECONDS', '10'))
     
     # 時區設定
     TIMEZONE = os.getenv('TIMEZONE', 'Asia/Taipei')
     
+    # 排程器設定
+    # 記憶體中保存的熱區時間窗（小時）
+    SCHEDULER_HOT_WINDOW_HOURS = int(os.getenv('SCHEDULER_HOT_WINDOW_HOURS', '25'))
+    # 從資料表重新載入熱區事件的間隔（秒），涵蓋其他行程寫入的事件
+    SCHEDULER_REHYDRATE_SECONDS = int(os.getenv('SCHEDULER_REHYDRATE_SECONDS', '60'))
+    # 檢查後仍未前進的到期事件（檢查失敗或由其他分片負責）再次檢查前的等待時間（秒）
+    SCHEDULER_RETRY_SECONDS = int(os.getenv('SCHEDULER_RETRY_SECONDS', '5'))
+    # 排程領導者租約時間（秒），持有者停止心跳後其他行程最慢在此時間後接手
+    SCHEDULER_LEASE_SECONDS = int(os.getenv('SCHEDULER_LEASE_SECONDS', '15'))
+    # 排程模式：leader（單一領導者執行檢查）或 sharded（依群組鍵雜湊分片）
+    SCHEDULER_MODE = os.getenv('SCHEDULER_MODE', 'leader')
+    # 固定分片：分片總數與本行程的分片編號；編號設為 -1 時依存活成員動態分配並自動重新平衡
+    SCHEDULER_SHARD_COUNT = int(os.getenv('SCHEDULER_SHARD_COUNT', '1'))
+    SCHEDULER_SHARD_INDEX = int(os.getenv('SCHEDULER_SHARD_INDEX', '-1'))
+    # 分片模式下領取事件的有效時間（秒），行程中斷時其他分片可在到期後接手
+    SCHEDULER_CLAIM_SECONDS = int(os.getenv('SCHEDULER_CLAIM_SECONDS', '60'))
+    # 停機後重新啟動時錯過的提醒：digest（每個群組發送一則錯過提醒的摘要）或 drop（直接略過）
+    SCHEDULER_CATCHUP_POLICY = os.getenv('SCHEDULER_CATCHUP_POLICY', 'digest')
+    # 排程 worker 收到 SIGTERM 後等待進行中檢查完成的最長時間（秒）
+    WORKER_SHUTDOWN_TIMEOUT = int(os.getenv('WORKER_SHUTDOWN_TIMEOUT', '25'))
+    # 並行發送提醒的最大執行緒數
+    PUSH_CONCURRENCY = int(os.getenv('PUSH_CONCURRENCY', '8'))
+    
+    # Outbox 發送設定
+    # 每批取出的訊息數量與沒有新訊息時的輪詢間隔（秒）
+    OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '100'))
+    OUTBOX_POLL_SECONDS = float(os.getenv('OUTBOX_POLL_SECONDS', '1'))
+    # 領取訊息的有效時間（秒），發送 worker 中斷時其他行程可在到期後接手
+    OUTBOX_CLAIM_SECONDS = int(os.getenv('OUTBOX_CLAIM_SECONDS', '60'))
+    # 失敗重試：指數退避的起始與上限秒數、最多嘗試次數
+    OUTBOX_BACKOFF_BASE_SECONDS = float(os.getenv('OUTBOX_BACKOFF_BASE_SECONDS', '2'))
+    OUTBOX_BACKOFF_MAX_SECONDS = float(os.getenv('OUTBOX_BACKOFF_MAX_SECONDS', '300'))
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '8'))
+    # reply token 的有效時間（秒），過期的回覆不再重試
+    REPLY_TOKEN_TTL_SECONDS = int(os.getenv('REPLY_TOKEN_TTL_SECONDS', '60'))
+    # 批次 UPDATE / DELETE 每個語句的 IN 清單大小上限
+    SCHEDULER_BULK_CHUNK_SIZE = int(os.getenv('SCHEDULER_BULK_CHUNK_SIZE', '500'))
+    
     @staticmethod
     def validate():
         """驗證必要的配置是否存在"""
@@ -0,0 +1,138 @@
+"""
+事件批次寫入（group commit）
+大量 webhook 同時新增事件時，由單一寫入執行緒把幾毫秒內送達的事件合併成一個交易，
+每批只 commit（fsync）一次，SQLite 也不會因多個執行緒同時寫入而出現 "database is locked"；
+呼叫端取得 Future，commit 後以新事件的 id 完成
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from models import Session, Event, bump_list_versions
+from scheduler import notify_event_scheduled
+
+logger = logging.getLogger(__name__)
+
+
+class EventWriter:
+    """單一執行緒的事件寫入佇列"""
+
+    def __init__(self, max_batch, linger_seconds, group_keys):
+        self.max_batch = max_batch
+        self.linger_seconds = linger_seconds
+        self.group_keys = group_keys
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._rows = 0
+        self._failed = 0
+        self._batch_max = 0
+        self._commit_total = 0.0
+
+    def _ensure_started(self):
+        """第一次寫入時才啟動寫入執行緒（避免在 gunicorn fork 前建立執行緒）"""
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="event-writer", daemon=True)
+            self._thread.start()
+            logger.info(f"事件批次寫入已啟動: 每批最多 {self.max_batch} 筆，等待 {self.linger_seconds * 1000:.0f} 毫秒")
+
+    def submit(self, group_id, event_datetime, description):
+        """
+        將新增事件放入寫入佇列
+
+        Args:
+            group_id: LINE 的來源 ID
+            event_datetime: 事件時間（有時區）
+            description: 事情描述
+
+        Returns:
+            Future: commit 後的結果為新事件的 id，寫入失敗時為例外
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((future, (group_id, {
+            'event_datetime': event_datetime,
+            'description': description,
+        })))
+        return future
+
+    def _collect(self):
+        """取出一批：等到第一筆後，再收集等待時間內陸續送達的事件"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.linger_seconds
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._write(batch)
+            except Exception as e:
+                # 整批失敗時逐筆重試，只讓有問題的事件失敗
+                logger.error(f"批次寫入事件失敗，改為逐筆寫入: {e}", exc_info=True)
+                for item in batch:
+                    try:
+                        self._write([item])
+                    except Exception as e:
+                        logger.error(f"寫入事件失敗: {e}", exc_info=True)
+                        with self._stats_lock:
+                            self._failed += 1
+                        item[0].set_exception(e)
+
+    def _write(self, batch):
+        """在同一個交易中新增整批事件並遞增群組清單版本"""
+        started = time.monotonic()
+        # 先取得群組鍵（新群組以獨立交易建立），再開始寫入事件
+        group_keys = [self.group_keys.resolve(group_id) for _, (group_id, _) in batch]
+        session = Session()
+        try:
+            events = [
+                Event(group_key=group_key, remind_level=0, **values)
+                for group_key, (_, (_, values)) in zip(group_keys, batch)
+            ]
+            session.add_all(events)
+            bump_list_versions(session, group_keys)
+            session.flush()
+            # commit 後物件會過期，先在 flush 後取出 id（避免每筆再查詢一次）
+            scheduled = [(event.id, event.next_fire_epoch, event.shard_key) for event in events]
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+        with self._stats_lock:
+            self._batches += 1
+            self._rows += len(batch)
+            self._batch_max = max(self._batch_max, len(batch))
+            self._commit_total += time.monotonic() - started
+        for (future, _), (event_id, next_fire_epoch, shard_key) in zip(batch, scheduled):
+            notify_event_scheduled(event_id, next_fire_epoch, shard_key)
+            future.set_result(event_id)
+
+    def stats(self):
+        """批次大小與 commit 耗時統計"""
+        with self._stats_lock:
+            return {
+                'depth': self._queue.qsize(),
+                'batches': self._batches,
+                'rows': self._rows,
+                'failed': self._failed,
+                'batch_avg': round(self._rows / self._batches, 2) if self._batches else 0.0,
+                'batch_max': self._batch_max,
+                'commit_avg_ms': round(self._commit_total / self._batches * 1000, 2) if self._batches else 0.0,
+            }
@@ -0,0 +1,78 @@
+"""
+群組鍵快取
+LINE 的來源 ID（33 字元的 groupId / roomId / userId）只存在 groups 資料表，事件以整數群組鍵參照；
+每個訊息都需要將來源 ID 轉為群組鍵，因此在行程內以 LRU 快取已存在的對應（群組鍵建立後不會變更，不需要失效）；
+未命中時以自己的短暫 Session 查詢或建立，呼叫端應在開始使用自己的 Session 之前取得群組鍵，
+避免同一個執行緒同時佔用兩個連線（連線池耗盡時會互相等待）
+"""
+import threading
+from collections import OrderedDict
+from models import Session, create_group, find_group_key
+
+
+class GroupKeyCache:
+    """LINE 來源 ID 到群組鍵的對應（執行緒安全）"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def _get(self, line_id):
+        with self._lock:
+            group_key = self._keys.get(line_id)
+            if group_key is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+                self._keys.move_to_end(line_id)
+            return group_key
+
+    def _put(self, line_id, group_key):
+        with self._lock:
+            self._keys[line_id] = group_key
+            self._keys.move_to_end(line_id)
+            while len(self._keys) > self.maxsize:
+                self._keys.popitem(last=False)
+
+    def lookup(self, line_id):
+        """
+        查詢群組鍵（不會建立群組）
+
+        Args:
+            line_id: LINE 的來源 ID
+
+        Returns:
+            int: 群組鍵，群組尚未建立（沒有新增過事件）時為 None
+        """
+        group_key = self._get(line_id)
+        if group_key is None:
+            session = Session()
+            try:
+                group_key = find_group_key(session, line_id)
+            finally:
+                session.close()
+            if group_key is not None:
+                self._put(line_id, group_key)
+        return group_key
+
+    def resolve(self, line_id):
+        """取得群組鍵，群組不存在時以獨立的交易建立（新增事件前呼叫）"""
+        group_key = self.lookup(line_id)
+        if group_key is None:
+            group_key = create_group(line_id)
+            self._put(line_id, group_key)
+        return group_key
+
+    def stats(self):
+        """快取命中統計"""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'cached_groups': len(self._keys),
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': round(self._hits / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,10 @@
+"""
+gunicorn 設定（在專案目錄執行 gunicorn 時自動載入）
+"""
+
+
+def worker_exit(server, worker):
+    """worker 結束前停止接收 webhook，並等待佇列中已回應 200 的事件處理完成"""
+    from app import event_queue
+    from config import Config
+    event_queue.shutdown(Config.WEBHOOK_SHUTDOWN_TIMEOUT)
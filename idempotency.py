@@ -0,0 +1,113 @@
+"""
+Webhook 冪等處理
+以 LINE 的 webhookEventId 去除重送事件：行程內 TTL/LRU 快取作為快速路徑，
+資料表主鍵保證不同 worker 收到的重送也只會處理一次
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from models import Session, ProcessedWebhookEvent
+
+logger = logging.getLogger(__name__)
+
+# 每處理多少次新事件清理一次資料表中過期的紀錄
+PRUNE_EVERY = 1000
+
+
+class WebhookDeduplicator:
+    """webhookEventId 去重"""
+
+    def __init__(self, maxsize, ttl_seconds):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self._memory_hits = 0
+        self._db_hits = 0
+        self._misses = 0
+
+    def _remember(self, webhook_event_id):
+        """記錄到記憶體快取，超過容量時淘汰最舊的項目"""
+        with self._lock:
+            self._seen[webhook_event_id] = time.monotonic() + self.ttl_seconds
+            self._seen.move_to_end(webhook_event_id)
+            while len(self._seen) > self.maxsize:
+                self._seen.popitem(last=False)
+
+    def _seen_recently(self, webhook_event_id):
+        with self._lock:
+            expires_at = self._seen.get(webhook_event_id)
+            if expires_at is None:
+                return False
+            if expires_at < time.monotonic():
+                del self._seen[webhook_event_id]
+                return False
+            self._memory_hits += 1
+            return True
+
+    def claim(self, webhook_event_id):
+        """
+        登記事件為處理中
+
+        Args:
+            webhook_event_id: LINE webhook 事件 ID
+
+        Returns:
+            bool: 第一次收到時回傳 True，重送的事件回傳 False
+        """
+        if self._seen_recently(webhook_event_id):
+            return False
+
+        session = Session()
+        try:
+            session.add(ProcessedWebhookEvent(webhook_event_id=webhook_event_id))
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+            self._remember(webhook_event_id)
+            with self._lock:
+                self._db_hits += 1
+            return False
+        finally:
+            session.close()
+
+        self._remember(webhook_event_id)
+        with self._lock:
+            self._misses += 1
+            should_prune = self._misses % PRUNE_EVERY == 0
+        if should_prune:
+            self.prune()
+        return True
+
+    def prune(self):
+        """刪除資料表中超過 TTL 的紀錄"""
+        cutoff = datetime.now() - timedelta(seconds=self.ttl_seconds)
+        session = Session()
+        try:
+            count = session.query(ProcessedWebhookEvent).filter(
+                ProcessedWebhookEvent.created_at < cutoff
+            ).delete(synchronize_session=False)
+            session.commit()
+            if count:
+                logger.info(f"已清理 {count} 筆過期的 webhook 事件紀錄")
+        except Exception as e:
+            logger.error(f"清理 webhook 事件紀錄失敗: {e}")
+            session.rollback()
+        finally:
+            session.close()
+
+    def stats(self):
+        """重送命中統計"""
+        with self._lock:
+            hits = self._memory_hits + self._db_hits
+            total = hits + self._misses
+            return {
+                'cached': len(self._seen),
+                'memory_hits': self._memory_hits,
+                'db_hits': self._db_hits,
+                'misses': self._misses,
+                'redelivery_rate': round(hits / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,158 @@
+"""
+排程器領導者選舉
+以資料表中的租約列搭配心跳續約，多個 gunicorn worker 或容器中只有持有租約的行程會執行提醒檢查；
+持有者停止心跳後，其他行程會在租約到期後接手；
+領導者提交檢查結果前在同一個交易中確認仍持有租約（fence），檢查期間失去租約的舊領導者不會提交
+"""
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from config import Config
+from models import Session, SchedulerLease, tz, to_local_naive
+
+logger = logging.getLogger(__name__)
+
+
+def default_holder_id():
+    """行程識別字串：主機名稱:PID:隨機碼"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class LeaderLease:
+    """資料表租約式領導者選舉"""
+
+    def __init__(self, name='reminder-scheduler', ttl_seconds=None, holder=None, on_elected=None):
+        self.name = name
+        self.ttl = timedelta(seconds=ttl_seconds or Config.SCHEDULER_LEASE_SECONDS)
+        self.holder = holder or default_holder_id()
+        self.on_elected = on_elected
+        self.is_leader = False
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def is_active(self):
+        """目前是否應執行提醒檢查"""
+        return self.is_leader
+
+    def event_criteria(self):
+        """領導者負責所有事件，不需要額外過濾條件"""
+        return []
+
+    def owns(self, shard_key):
+        """領導者負責所有事件"""
+        return True
+
+    def try_acquire(self):
+        """
+        取得或續約租約
+
+        Returns:
+            bool: 目前是否為領導者
+        """
+        now = to_local_naive(datetime.now(tz))
+        session = Session()
+        try:
+            # 自己持有或已過期的租約可以直接接手
+            result = session.execute(
+                update(SchedulerLease)
+                .where(
+                    SchedulerLease.name == self.name,
+                    (SchedulerLease.holder == self.holder) | (SchedulerLease.expires_at < now)
+                )
+                .values(holder=self.holder, expires_at=now + self.ttl)
+            )
+            acquired = result.rowcount == 1
+            if not acquired and session.get(SchedulerLease, self.name) is None:
+                session.add(SchedulerLease(name=self.name, holder=self.holder, expires_at=now + self.ttl))
+                acquired = True
+            session.commit()
+        except IntegrityError:
+            # 其他行程同時建立了租約
+            session.rollback()
+            acquired = False
+        except Exception as e:
+            logger.error(f"[租約] 續約失敗: {e}")
+            session.rollback()
+            acquired = False
+        finally:
+            session.close()
+
+        was_leader = self.is_leader
+        self.is_leader = acquired
+        if acquired and not was_leader:
+            logger.info(f"[租約] 成為排程領導者: {self.holder}")
+            if self.on_elected:
+                self.on_elected()
+        elif was_leader and not acquired:
+            logger.warning(f"[租約] 失去排程領導者身分: {self.holder}")
+        return acquired
+
+    def fence(self, session):
+        """
+        在呼叫端的交易中確認租約仍由本行程持有且尚未過期（提交前呼叫）
+        以 UPDATE 鎖定租約列直到呼叫端 commit：其他行程接手租約的 UPDATE 會等待本交易結束，
+        本交易之前已被接手時條件不成立，呼叫端應 rollback，不會覆寫新領導者的處理結果
+
+        Returns:
+            bool: 租約仍有效
+        """
+        now = to_local_naive(datetime.now(tz))
+        result = session.execute(
+            update(SchedulerLease)
+            .where(
+                SchedulerLease.name == self.name,
+                SchedulerLease.holder == self.holder,
+                SchedulerLease.expires_at >= now
+            )
+            .values(holder=self.holder)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 1:
+            return True
+        logger.warning(f"[租約] 租約已過期或被其他行程接手，放棄本次變更: {self.holder}")
+        self.is_leader = False
+        return False
+
+    def release(self):
+        """主動釋放租約，讓其他行程立即接手"""
+        if not self.is_leader:
+            return
+        session = Session()
+        try:
+            session.execute(
+                update(SchedulerLease)
+                .where(SchedulerLease.name == self.name, SchedulerLease.holder == self.holder)
+                .values(expires_at=to_local_naive(datetime.now(tz)))
+            )
+            session.commit()
+            logger.info(f"[租約] 已釋放排程領導者租約: {self.holder}")
+        except Exception as e:
+            logger.error(f"[租約] 釋放租約失敗: {e}")
+            session.rollback()
+        finally:
+            session.close()
+            self.is_leader = False
+
+    def start(self):
+        """啟動心跳執行緒，每 1/3 租約時間續約或嘗試接手"""
+        self.try_acquire()
+        self._thread = threading.Thread(target=self._heartbeat, name='leader-lease', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止心跳並釋放租約"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.release()
+
+    def _heartbeat(self):
+        interval = self.ttl.total_seconds() / 3
+        while not self._stopped.wait(interval):
+            self.try_acquire()
@@ -0,0 +1,135 @@
+"""
+LINE Messaging API 用戶端
+Webhook 回覆與排程推播共用同一個 keep-alive 連線池，避免每次呼叫都重新建立 TCP+TLS 連線；
+所有請求先通過共用的令牌桶速率限制（rate_limit.TokenBucket），收到 429 時依 Retry-After 暫停發送；
+LINE API 連續逾時或 5xx 時由斷路器（circuit_breaker.CircuitBreaker）直接拒絕請求，不再等待逾時
+"""
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from circuit_breaker import CircuitBreaker
+from config import Config
+from rate_limit import (
+    DEFAULT_RETRY_AFTER_SECONDS, PRIORITY_HIGH, PRIORITY_NORMAL, TokenBucket, parse_retry_after
+)
+
+logger = logging.getLogger(__name__)
+
+
+class LineApiError(Exception):
+    """LINE API 回應非 2xx 狀態碼"""
+
+    def __init__(self, status_code, body, retry_after=None):
+        super().__init__(f"LINE API 錯誤: {status_code} - {body}")
+        self.status_code = status_code
+        self.body = body
+        self.retry_after = retry_after  # 429 回應的 Retry-After 秒數
+
+
+class LineClient:
+    """共用連線池的 LINE Messaging API 用戶端（執行緒安全）"""
+
+    def __init__(self, access_token=None, base_url=None, pool_size=None,
+                 connect_timeout=None, read_timeout=None, verify=True, limiter=None, breaker=None):
+        self.base_url = (base_url or Config.LINE_API_BASE_URL).rstrip('/')
+        self.timeout = (
+            connect_timeout or Config.LINE_CONNECT_TIMEOUT,
+            read_timeout or Config.LINE_READ_TIMEOUT
+        )
+
+        self.verify = verify
+        self.limiter = limiter or TokenBucket(Config.LINE_RATE_LIMIT_RPS, Config.LINE_RATE_LIMIT_BURST)
+        self.breaker = breaker or CircuitBreaker(
+            'LINE API', Config.LINE_BREAKER_FAILURE_THRESHOLD, Config.LINE_BREAKER_RESET_SECONDS
+        )
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {access_token or Config.LINE_CHANNEL_ACCESS_TOKEN}"
+        })
+
+        # 只連線到單一主機，連線池大小即為可同時使用的 keep-alive 連線數
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size or Config.LINE_HTTP_POOL_SIZE,
+            max_retries=0
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _post(self, path, payload, headers=None, priority=PRIORITY_NORMAL):
+        """發送 POST 請求，非 2xx 回應時拋出 LineApiError，斷路器開啟時拋出 CircuitOpenError"""
+        self.breaker.before_call()
+        self.limiter.acquire(priority)
+        try:
+            response = self.session.post(
+                f"{self.base_url}{path}",
+                json=payload,
+                headers=headers,
+                timeout=self.timeout,
+                verify=self.verify
+            )
+        except Exception as e:
+            self.breaker.record_failure(e)
+            raise
+        # 4xx（包含 429）代表 LINE API 仍在正常回應，只有 5xx 計入斷路器失敗
+        if response.status_code >= 500:
+            self.breaker.record_failure(f"HTTP {response.status_code}")
+        else:
+            self.breaker.record_success()
+        if response.status_code == 429:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            pause = DEFAULT_RETRY_AFTER_SECONDS if retry_after is None else retry_after
+            self.limiter.pause(pause)
+            logger.warning(f"LINE API 限流 (429)，暫停發送 {pause} 秒")
+            raise LineApiError(response.status_code, response.text, retry_after=pause)
+        if not 200 <= response.status_code < 300:
+            raise LineApiError(response.status_code, response.text)
+        return response
+
+    def reply(self, reply_token, messages, priority=PRIORITY_HIGH):
+        """使用 reply token 回覆訊息（reply token 很快過期，預設最高優先順序）"""
+        return self._post("/v2/bot/message/reply", {
+            "replyToken": reply_token,
+            "messages": messages
+        }, priority=priority)
+
+    def push(self, to, messages, retry_key=None, priority=PRIORITY_NORMAL):
+        """推播訊息到群組/聊天室/使用者"""
+        headers = {"X-Line-Retry-Key": retry_key} if retry_key else None
+        return self._post("/v2/bot/message/push", {
+            "to": to,
+            "messages": messages
+        }, headers=headers, priority=priority)
+
+    def multicast(self, to, messages, retry_key=None, priority=PRIORITY_NORMAL):
+        """推播同樣的訊息給多個使用者（最多 500 人）"""
+        headers = {"X-Line-Retry-Key": retry_key} if retry_key else None
+        return self._post("/v2/bot/message/multicast", {
+            "to": list(to),
+            "messages": messages
+        }, headers=headers, priority=priority)
+
+    def close(self):
+        """關閉連線池"""
+        self.session.close()
+
+
+def text_message(text):
+    """建立文字訊息物件"""
+    return {"type": "text", "text": text}
+
+
+# 行程內共用的用戶端
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """取得行程內共用的 LINE 用戶端（延遲建立）"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = LineClient()
+    return _client
@@ -0,0 +1,81 @@
+"""
+/list 回覆訊息快取
+行程內以 group_id 為單位的 LRU/TTL 快取，保存已渲染的清單頁面；
+每個項目記錄渲染時的群組清單版本（groups.list_version），版本不同即視為過期，
+因此其他 worker 新增、刪除事件或排程器變更 remind_level 後，各行程的快取都不會回傳舊的清單
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class ListPageCache:
+    """已渲染的 /list 頁面（執行緒安全）"""
+
+    def __init__(self, maxsize, ttl_seconds):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        # {group_id: (版本, 過期時間, {頁面鍵: 訊息})}
+        self._groups = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def get(self, group_id, page_key, version):
+        """
+        取得快取的頁面
+
+        Args:
+            group_id: 群組 ID
+            page_key: 頁面鍵（日期、頁數與游標）
+            version: 群組目前的清單版本
+
+        Returns:
+            快取的訊息，沒有或已過期時為 None
+        """
+        with self._lock:
+            entry = self._groups.get(group_id)
+            messages = None
+            if entry is not None:
+                cached_version, expires_at, pages = entry
+                if cached_version != version or expires_at < time.monotonic():
+                    del self._groups[group_id]
+                else:
+                    messages = pages.get(page_key)
+                    self._groups.move_to_end(group_id)
+            if messages is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+            return messages
+
+    def put(self, group_id, page_key, version, messages):
+        """保存渲染好的頁面，超過容量時淘汰最久未使用的群組"""
+        with self._lock:
+            entry = self._groups.get(group_id)
+            if entry is None or entry[0] != version:
+                entry = (version, time.monotonic() + self.ttl_seconds, {})
+                self._groups[group_id] = entry
+            entry[2][page_key] = messages
+            self._groups.move_to_end(group_id)
+            while len(self._groups) > self.maxsize:
+                self._groups.popitem(last=False)
+
+    def invalidate(self, group_id):
+        """清除群組的所有頁面（本行程寫入後立即釋放，其他行程依版本判斷）"""
+        with self._lock:
+            if self._groups.pop(group_id, None) is not None:
+                self._invalidations += 1
+
+    def stats(self):
+        """快取命中統計"""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'cached_groups': len(self._groups),
+                'hits': self._hits,
+                'misses': self._misses,
+                'invalidations': self._invalidations,
+                'hit_ratio': round(self._hits / total, 4) if total else 0.0,
+            }
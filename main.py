@@ -1,6 +1,6 @@
 """
 LINE 提醒機器人主程式
-整合 Flask Web Server 和 APScheduler 排程器
+整合 Flask Web Server 和提醒排程器
 """
 from app import app
 from scheduler import start_scheduler
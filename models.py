@@ -1,23 +1,168 @@
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text
+import hashlib
+import pytz
+from sqlalchemy import (
+    create_engine, event, inspect, text, update, bindparam, BigInteger, Column, ForeignKey, Index, Integer, String,
+    DateTime, Text
+)
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from config import Config
 
+
+def engine_options(url):
+    """
+    依資料庫種類產生 create_engine 的連線池與連線參數
+
+    Args:
+        url: 資料庫連線字串
+
+    Returns:
+        dict: create_engine 的關鍵字參數
+    """
+    if make_url(url).get_backend_name() != 'postgresql':
+        return {}
+    options = {
+        'pool_size': Config.DB_POOL_SIZE,
+        'max_overflow': Config.DB_MAX_OVERFLOW,
+        # 定期汰換並在取出前檢查連線，平台關閉閒置連線後第一次排程檢查不會失敗
+        'pool_recycle': Config.DB_POOL_RECYCLE_SECONDS,
+        'pool_pre_ping': Config.DB_POOL_PRE_PING,
+    }
+    if Config.DB_STATEMENT_TIMEOUT_MS:
+        options['connect_args'] = {'options': f"-c statement_timeout={Config.DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+
+def _configure_sqlite(dbapi_connection, connection_record):
+    """SQLite 連線設定：WAL 讓讀取不會被寫入阻擋，NORMAL 只在 checkpoint 時 fsync"""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA journal_mode={Config.SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={Config.SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA mmap_size={Config.SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA busy_timeout={Config.SQLITE_BUSY_TIMEOUT_MS}")
+    finally:
+        cursor.close()
+
+
+def create_database_engine(url):
+    """建立資料庫引擎（套用 Config 中的連線池與 SQLite 設定）"""
+    db_engine = create_engine(url, echo=False, **engine_options(url))
+    if db_engine.dialect.name == 'sqlite':
+        event.listen(db_engine, 'connect', _configure_sqlite)
+    return db_engine
+
+
 # 建立資料庫引擎
-engine = create_engine(Config.DATABASE_URL, echo=False)
+engine = create_database_engine(Config.DATABASE_URL)
 Session = sessionmaker(bind=engine)
 Base = declarative_base()
 
+# 時區設定
+tz = pytz.timezone(Config.TIMEZONE)
+
+# 各 remind_level 下一次需要排程處理的時間點（相對事件時間的分鐘數）
+# 0: 24 小時提醒視窗開啟 (1450 分鐘前)
+# 1: 60 分鐘提醒視窗開啟 (62 分鐘前)
+# 2: 30 分鐘提醒視窗開啟 (32 分鐘前)
+# 3: 整點提醒視窗開啟 (2 分鐘前)
+# 4: 清理已完成事件 (事件後 10 分鐘)
+NEXT_FIRE_OFFSETS = {
+    0: 1450,
+    1: 62,
+    2: 32,
+    3: 2,
+    4: -10,
+}
+
+# 分片用的雜湊桶數量（群組鍵取餘數），各排程分片負責連續的一段桶
+SHARD_BUCKETS = 1024
+
+# 長時間未處理的舊事件清理時間（事件時間過後的分鐘數）
+EXPIRE_AFTER_MINUTES = 1440
+
+
+def to_local_naive(dt):
+    """將時間轉為設定時區的 naive datetime（資料庫內統一格式）"""
+    if dt.tzinfo is None:
+        return dt
+    return dt.astimezone(tz).replace(tzinfo=None)
+
+
+def to_epoch(dt):
+    """將時間轉為 UTC epoch 秒數（naive datetime 視為設定時區的時間）"""
+    if dt.tzinfo is None:
+        dt = tz.localize(dt)
+    return int(dt.timestamp())
+
+
+def from_epoch(epoch):
+    """將 UTC epoch 秒數轉為設定時區的 naive datetime"""
+    return datetime.fromtimestamp(epoch, tz).replace(tzinfo=None)
+
+
+def next_fire_offset(remind_level):
+    """remind_level 對應的下一次處理時間（事件前的分鐘數；未知等級為過期清理時間）"""
+    return NEXT_FIRE_OFFSETS.get(remind_level, -(EXPIRE_AFTER_MINUTES + 1))
+
+
+def compute_next_fire_epoch(event_epoch, remind_level):
+    """
+    計算事件下一次需要排程處理的時間
+
+    Args:
+        event_epoch: 事件時間的 UTC epoch 秒數
+        remind_level: 目前的提醒等級
+
+    Returns:
+        int: UTC epoch 秒數
+    """
+    return event_epoch - next_fire_offset(remind_level) * 60
+
+
+def hash_description(description):
+    """事件描述的 SHA-256（/rm 以索引比對雜湊，不直接比較長文字）"""
+    return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+
+def compute_shard_key(group_key):
+    """計算群組鍵所屬的雜湊桶（同一群組的事件一定落在同一個分片）"""
+    return group_key % SHARD_BUCKETS
+
+
+class Group(Base):
+    """LINE 來源（群組、聊天室或個人）與整數群組鍵的對應，以及群組的清單版本與設定"""
+    __tablename__ = 'groups'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    line_id = Column(String(100), nullable=False, unique=True)  # LINE 的 groupId / roomId / userId
+    # 群組行程清單的版本（事件新增、刪除或 remind_level 變更時遞增，各 worker 的 /list 快取據此判斷是否過期）
+    list_version = Column(Integer, default=0, nullable=False)
+    settings = Column(Text, nullable=True)  # JSON 格式的群組設定
+    created_at = Column(DateTime, default=datetime.now)
+    
+    def __repr__(self):
+        return f"<Group(id={self.id}, line_id={self.line_id}, list_version={self.list_version})>"
+
 
 class Event(Base):
     """事件資料表模型"""
     __tablename__ = 'events'
+    __table_args__ = (
+        # /list、/rm 以 (group_key, event_epoch, description_hash) 查詢，前綴涵蓋整天與整個群組
+        Index('ix_events_group_key_event_epoch', 'group_key', 'event_epoch', 'description_hash'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    group_id = Column(String(100), nullable=False, index=True)
-    event_datetime = Column(DateTime, nullable=False, index=True)
+    group_key = Column(Integer, ForeignKey('groups.id'), nullable=False)  # groups.id（不重複存放 LINE 的來源 ID）
+    event_datetime = Column(DateTime, nullable=False, index=True)  # 設定時區的 naive datetime（顯示用）
+    # 事件時間的 UTC epoch 秒數，排程與查詢只比較整數，不受資料庫時區設定影響
+    event_epoch = Column(BigInteger, nullable=True, index=True)
     description = Column(Text, nullable=False)
+    description_hash = Column(String(64), nullable=True)  # description 的 SHA-256
     remind_level = Column(Integer, default=0, nullable=False)
     # remind_level 說明:
     # 0: 未提醒
@@ -26,26 +171,339 @@ class Event(Base):
     # 3: 已發送 30 分鐘提醒
     # 4: 已發送整點提醒（完成）
     
+    # 下一次需要排程處理的時間（UTC epoch 秒數，隨 remind_level 更新），排程器只查詢已到期的事件
+    next_fire_epoch = Column(BigInteger, nullable=True, index=True)
+    
+    # 分片排程：group_id 的雜湊桶，以及領取處理中事件的行程與領取期限
+    shard_key = Column(Integer, nullable=True, index=True)
+    claimed_by = Column(String(200), nullable=True)
+    claimed_until = Column(DateTime, nullable=True)
+    
     created_at = Column(DateTime, default=datetime.now)
     
     def __repr__(self):
-        return f"<Event(id={self.id}, group_id={self.group_id}, event_datetime={self.event_datetime}, description={self.description}, remind_level={self.remind_level})>"
+        return f"<Event(id={self.id}, group_key={self.group_key}, event_datetime={self.event_datetime}, description={self.description}, remind_level={self.remind_level})>"
     
     def to_dict(self):
         """轉換為字典格式"""
         return {
             'id': self.id,
-            'group_id': self.group_id,
+            'group_key': self.group_key,
             'event_datetime': self.event_datetime.isoformat(),
             'description': self.description,
             'remind_level': self.remind_level,
+            'event_epoch': self.event_epoch,
+            'next_fire_epoch': self.next_fire_epoch,
             'created_at': self.created_at.isoformat()
         }
 
 
+class ProcessedWebhookEvent(Base):
+    """已處理的 webhook 事件（以 LINE 的 webhookEventId 去除重送）"""
+    __tablename__ = 'processed_webhook_events'
+    
+    webhook_event_id = Column(String(64), primary_key=True)
+    created_at = Column(DateTime, default=datetime.now, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f"<ProcessedWebhookEvent(webhook_event_id={self.webhook_event_id}, created_at={self.created_at})>"
+
+
+class OutboxMessage(Base):
+    """待發送訊息（交易式 outbox），由發送 worker 批次取出發送"""
+    __tablename__ = 'outbox'
+    __table_args__ = (
+        Index('ix_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String(20), nullable=False)  # push / reply
+    target = Column(String(200), nullable=False)  # 推播對象 ID 或 reply token
+    payload = Column(Text, nullable=False)  # JSON 格式的訊息物件清單
+    retry_key = Column(String(36), nullable=True)  # X-Line-Retry-Key（推播重試冪等用）
+    status = Column(String(20), default='pending', nullable=False)  # pending / dead
+    priority = Column(Integer, default=1, nullable=False)  # 發送優先順序（0 最先，見 rate_limit）
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(Text, nullable=True)
+    next_attempt_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=True)  # reply token 過期時間、提醒推播的時間窗關閉時間
+    claimed_by = Column(String(200), nullable=True)
+    claimed_until = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.now)
+    
+    def __repr__(self):
+        return f"<OutboxMessage(id={self.id}, kind={self.kind}, target={self.target}, status={self.status}, attempts={self.attempts})>"
+
+
+class SchedulerLease(Base):
+    """排程器領導者租約（確保同一時間只有一個行程執行提醒檢查）"""
+    __tablename__ = 'scheduler_leases'
+    
+    name = Column(String(100), primary_key=True)
+    holder = Column(String(200), nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f"<SchedulerLease(name={self.name}, holder={self.holder}, expires_at={self.expires_at})>"
+
+
+class SchedulerCheckpoint(Base):
+    """排程器最後一次成功檢查的時間（重新啟動時據此找出停機期間錯過的提醒）"""
+    __tablename__ = 'scheduler_checkpoints'
+    
+    name = Column(String(100), primary_key=True)  # 領導者模式為固定名稱，分片模式依雜湊桶範圍區分
+    last_tick_at = Column(DateTime, nullable=False)  # 設定時區的 naive datetime
+    
+    def __repr__(self):
+        return f"<SchedulerCheckpoint(name={self.name}, last_tick_at={self.last_tick_at})>"
+
+
+def find_group_key(session, line_id):
+    """查詢 LINE 來源 ID 對應的群組鍵（尚未建立時為 None）"""
+    return session.query(Group.id).filter(Group.line_id == line_id).scalar()
+
+
+def create_group(line_id):
+    """
+    以獨立的交易建立群組（呼叫端的交易 rollback 時群組仍然存在，快取的群組鍵不會失效）
+
+    Returns:
+        int: 群組鍵（其他 worker 同時建立時為既有的群組鍵）
+    """
+    session = Session()
+    try:
+        group = Group(line_id=line_id, list_version=0)
+        session.add(group)
+        session.flush()
+        group_key = group.id
+        session.commit()
+        return group_key
+    except IntegrityError:
+        session.rollback()
+        return find_group_key(session, line_id)
+    finally:
+        session.close()
+
+
+def get_list_version(session, group_key):
+    """群組目前的清單版本（群組尚未建立時為 0）"""
+    if group_key is None:
+        return 0
+    return session.query(Group.list_version).filter(Group.id == group_key).scalar() or 0
+
+
+def bump_list_versions(session, group_keys):
+    """
+    遞增群組的清單版本（由呼叫端在寫入事件的同一個交易中 commit）
+    
+    Args:
+        session: 資料庫 Session
+        group_keys: 行程清單有變動的群組鍵
+    """
+    group_keys = sorted(set(group_keys))  # 固定順序更新，避免並行交易互相等待鎖
+    chunk_size = Config.SCHEDULER_BULK_CHUNK_SIZE
+    for i in range(0, len(group_keys), chunk_size):
+        session.execute(
+            update(Group)
+            .where(Group.id.in_(group_keys[i:i + chunk_size]))
+            .values(list_version=Group.list_version + 1)
+            .execution_options(synchronize_session=False)
+        )
+
+
+@event.listens_for(Event, 'before_insert')
+def _set_next_fire_on_insert(mapper, connection, target):
+    """新增事件時計算 event_epoch、next_fire_epoch、description_hash 與 shard_key"""
+    target.description_hash = hash_description(target.description)
+    if target.remind_level is None:
+        target.remind_level = 0
+    if target.event_epoch is None:
+        target.event_epoch = to_epoch(target.event_datetime)
+    # 有時區的時間統一存成設定時區的 naive datetime（PostgreSQL 不會依連線時區轉換）
+    target.event_datetime = to_local_naive(target.event_datetime)
+    if target.next_fire_epoch is None:
+        target.next_fire_epoch = compute_next_fire_epoch(target.event_epoch, target.remind_level)
+    if target.shard_key is None:
+        target.shard_key = compute_shard_key(target.group_key)
+
+
+@event.listens_for(Event, 'before_update')
+def _set_next_fire_on_update(mapper, connection, target):
+    """描述、事件時間或 remind_level 變更時重新計算 description_hash、event_epoch 與 next_fire_epoch"""
+    state = inspect(target)
+    if state.attrs.description.history.has_changes():
+        target.description_hash = hash_description(target.description)
+    if state.attrs.event_datetime.history.has_changes():
+        target.event_epoch = to_epoch(target.event_datetime)
+        target.event_datetime = to_local_naive(target.event_datetime)
+    elif not state.attrs.remind_level.history.has_changes():
+        return
+    if not state.attrs.next_fire_epoch.history.has_changes():
+        target.next_fire_epoch = compute_next_fire_epoch(target.event_epoch, target.remind_level)
+
+
+def _legacy_storage_timezone(conn):
+    """
+    舊版 event_datetime 的時區
+    舊版寫入的是有時區的時間：SQLite 直接存成設定時區的時間，
+    PostgreSQL 的 timestamp 欄位則先換算成連線時區（伺服器的 TimeZone 設定，postgres 映像檔預設為 UTC）
+    """
+    if conn.dialect.name != 'postgresql':
+        return tz
+    name = conn.execute(text("SHOW timezone")).scalar()
+    try:
+        return pytz.timezone(name)
+    except pytz.UnknownTimeZoneError:
+        # POSIX 格式等 pytz 不認得的時區，改用目前的 UTC 偏移
+        offset = conn.execute(text("SELECT EXTRACT(TIMEZONE FROM now())")).scalar()
+        return pytz.FixedOffset(int(offset) // 60)
+
+
+def _backfill_event_epoch(conn, legacy_tz=None):
+    """
+    回填既有事件的 event_epoch，並將 event_datetime 統一為設定時區的時間
+
+    Args:
+        conn: 資料庫連線
+        legacy_tz: 舊版 event_datetime 的時區，預設依資料庫判斷（見 _legacy_storage_timezone）
+    """
+    legacy_tz = legacy_tz or _legacy_storage_timezone(conn)
+    rows = conn.execute(text("SELECT id, event_datetime FROM events")).fetchall()
+    updates = []
+    for row in rows:
+        event_datetime = row.event_datetime
+        if isinstance(event_datetime, str):
+            event_datetime = datetime.fromisoformat(event_datetime)
+        epoch = to_epoch(legacy_tz.localize(event_datetime))
+        updates.append({'_id': row.id, '_epoch': epoch, '_datetime': from_epoch(epoch)})
+    if updates:
+        conn.execute(
+            Event.__table__.update()
+            .where(Event.__table__.c.id == bindparam('_id'))
+            .values(event_epoch=bindparam('_epoch'), event_datetime=bindparam('_datetime')),
+            updates
+        )
+
+
+def _backfill_next_fire_epoch(conn):
+    """回填既有事件的 next_fire_epoch"""
+    rows = conn.execute(text("SELECT id, event_epoch, remind_level FROM events")).fetchall()
+    updates = [
+        {'_id': row.id, '_epoch': compute_next_fire_epoch(row.event_epoch, row.remind_level)}
+        for row in rows
+    ]
+    if updates:
+        conn.execute(
+            Event.__table__.update()
+            .where(Event.__table__.c.id == bindparam('_id'))
+            .values(next_fire_epoch=bindparam('_epoch')),
+            updates
+        )
+
+
+def _backfill_description_hash(conn):
+    """回填既有事件的 description_hash"""
+    rows = conn.execute(text("SELECT id, description FROM events")).fetchall()
+    updates = [{'_id': row.id, '_hash': hash_description(row.description)} for row in rows]
+    if updates:
+        conn.execute(
+            Event.__table__.update()
+            .where(Event.__table__.c.id == bindparam('_id'))
+            .values(description_hash=bindparam('_hash')),
+            updates
+        )
+
+
+def _backfill_shard_key(conn):
+    """回填既有事件的 shard_key"""
+    conn.execute(text("UPDATE events SET shard_key = group_key % :buckets"), {'buckets': SHARD_BUCKETS})
+
+
+def _backfill_group_key(conn):
+    """
+    為既有事件的 group_id 建立群組並回填 group_key，shard_key 改以群組鍵重新計算
+    （清單版本改存於 groups.list_version，舊的 group_list_versions 資料表不再使用）
+    """
+    conn.execute(text(
+        "INSERT INTO groups (line_id, list_version) "
+        "SELECT DISTINCT group_id, 0 FROM events WHERE group_id NOT IN (SELECT line_id FROM groups)"
+    ))
+    conn.execute(text(
+        "UPDATE events SET group_key = (SELECT groups.id FROM groups WHERE groups.line_id = events.group_id)"
+    ))
+    # 更早的資料庫還沒有 shard_key，之後補上欄位時才回填
+    if 'shard_key' in {c['name'] for c in inspect(conn).get_columns('events')}:
+        _backfill_shard_key(conn)
+    conn.execute(text("DROP TABLE IF EXISTS group_list_versions"))
+
+
+# 既有資料庫需要補上的欄位：(資料表, 欄位名稱, 型別, 是否建立索引, 回填函數)
+_ADDED_COLUMNS = [
+    ('events', 'group_key', 'INTEGER REFERENCES groups(id)', False, _backfill_group_key),
+    ('events', 'event_epoch', 'BIGINT', True, _backfill_event_epoch),
+    ('events', 'next_fire_epoch', 'BIGINT', True, _backfill_next_fire_epoch),
+    ('events', 'shard_key', 'INTEGER', True, _backfill_shard_key),
+    ('events', 'claimed_by', 'VARCHAR(200)', False, None),
+    ('events', 'claimed_until', 'TIMESTAMP', False, None),
+    ('events', 'description_hash', 'VARCHAR(64)', False, _backfill_description_hash),
+    ('outbox', 'priority', 'INTEGER NOT NULL DEFAULT 1', False, None),
+]
+
+
+# 既有資料庫需要移除的欄位：(資料表, 欄位名稱, 需要先刪除的索引)
+_DROPPED_COLUMNS = [
+    ('events', 'group_id', ('ix_events_group_id', 'ix_events_group_id_event_epoch')),
+    ('events', 'next_fire_at', ('ix_events_next_fire_at',)),
+]
+
+
+# 既有資料庫需要補上的複合索引：(資料表, 索引名稱, 欄位)
+_ADDED_INDEXES = [
+    ('events', 'ix_events_group_key_event_epoch', 'group_key, event_epoch, description_hash'),
+]
+
+
+def _upgrade_schema():
+    """為既有資料庫補上新增的欄位與索引"""
+    inspector = inspect(engine)
+    columns = {}
+    
+    for table, name, column_type, indexed, backfill in _ADDED_COLUMNS:
+        if table not in columns:
+            columns[table] = {c['name'] for c in inspector.get_columns(table)}
+        if name in columns[table]:
+            continue
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}"))
+            if indexed:
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_{name} ON {table} ({name})"))
+            if backfill:
+                backfill(conn)
+        print(f"已更新資料表結構：{table}.{name}")
+    
+    # 回填完成後才移除被取代的欄位
+    for table, name, indexes in _DROPPED_COLUMNS:
+        if name not in {c['name'] for c in inspect(engine).get_columns(table)}:
+            continue
+        with engine.begin() as conn:
+            for index in indexes:
+                conn.execute(text(f"DROP INDEX IF EXISTS {index}"))
+            conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {name}"))
+        print(f"已移除欄位：{table}.{name}")
+    
+    # 新增的欄位補上之後才建立複合索引
+    for table, name, index_columns in _ADDED_INDEXES:
+        if name in {index['name'] for index in inspector.get_indexes(table)}:
+            continue
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({index_columns})"))
+        print(f"已建立索引：{name}")
+
+
 def init_database():
     """初始化資料庫"""
     Base.metadata.create_all(engine)
+    _upgrade_schema()
     print("資料庫初始化完成！")
 
 
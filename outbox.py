@@ -0,0 +1,290 @@
+"""
+交易式 outbox
+排程器與 webhook 在寫入資料的同一個交易中加入「待發送訊息」，由發送 worker 批次取出，
+推播以 X-Line-Retry-Key 冪等重試並以指數退避延後，達成 at-least-once 發送且不阻塞排程檢查；
+LINE API 斷路器開啟期間不取出訊息，訊息保留在 outbox 中，恢復後再發送且不計入失敗次數；
+提醒推播在時間窗關閉後過期，恢復時不會送出內容已過時的提醒
+"""
+import json
+import logging
+import random
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import requests
+from sqlalchemy import delete, or_, select, update
+from circuit_breaker import CircuitOpenError
+from config import Config
+from line_client import LineApiError, get_client
+from leader import default_holder_id
+from models import Session, OutboxMessage, tz, to_local_naive
+from rate_limit import PRIORITY_HIGH, PRIORITY_NORMAL
+
+logger = logging.getLogger(__name__)
+
+KIND_PUSH = 'push'
+KIND_REPLY = 'reply'
+
+STATUS_PENDING = 'pending'
+STATUS_DEAD = 'dead'
+
+# 發送結果
+RESULT_SENT = 'sent'
+RESULT_RETRY = 'retry'
+RESULT_DEAD = 'dead'
+RESULT_RELEASE = 'release'  # 未送出（斷路器開啟），釋放領取
+
+
+def _now():
+    return to_local_naive(datetime.now(tz))
+
+
+def new_push(to, messages, priority=PRIORITY_NORMAL, expires_at=None):
+    """建立推播訊息列（由呼叫端在同一個交易中 add；expires_at 之後內容已過時，不再發送）"""
+    return OutboxMessage(
+        kind=KIND_PUSH,
+        target=to,
+        payload=json.dumps(messages, ensure_ascii=False),
+        retry_key=str(uuid.uuid4()),
+        status=STATUS_PENDING,
+        priority=priority,
+        attempts=0,
+        next_attempt_at=_now(),
+        expires_at=expires_at
+    )
+
+
+def new_reply(reply_token, messages, expires_at=None):
+    """建立回覆訊息列（reply token 過期後不再重試）"""
+    now = _now()
+    return OutboxMessage(
+        kind=KIND_REPLY,
+        target=reply_token,
+        payload=json.dumps(messages, ensure_ascii=False),
+        status=STATUS_PENDING,
+        priority=PRIORITY_HIGH,
+        attempts=0,
+        next_attempt_at=now,
+        expires_at=expires_at or now + timedelta(seconds=Config.REPLY_TOKEN_TTL_SECONDS)
+    )
+
+
+def enqueue_reply(reply_token, messages):
+    """將發送失敗的回覆寫入 outbox，交由發送 worker 重試"""
+    session = Session()
+    try:
+        session.add(new_reply(reply_token, messages))
+        session.commit()
+    finally:
+        session.close()
+    notify_dispatcher()
+
+
+def is_retryable_error(error):
+    """網路錯誤、429、5xx 與斷路器開啟可以重試；其他 4xx 重試也不會成功"""
+    if isinstance(error, LineApiError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, (requests.RequestException, CircuitOpenError))
+
+
+def backoff_seconds(attempts):
+    """第 N 次失敗後的等待秒數（指數退避加上隨機抖動）"""
+    delay = min(Config.OUTBOX_BACKOFF_MAX_SECONDS, Config.OUTBOX_BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class OutboxDispatcher:
+    """從 outbox 批次取出待發送訊息，透過有上限的執行緒池並行發送"""
+
+    def __init__(self, client=None, batch_size=None, concurrency=None, poll_seconds=None):
+        self.client = client
+        self.batch_size = batch_size or Config.OUTBOX_BATCH_SIZE
+        self.poll_seconds = poll_seconds or Config.OUTBOX_POLL_SECONDS
+        self.holder = default_holder_id()
+        self._pool = ThreadPoolExecutor(
+            max_workers=concurrency or Config.PUSH_CONCURRENCY,
+            thread_name_prefix='outbox-send'
+        )
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """啟動發送執行緒"""
+        self._thread = threading.Thread(target=self._run, name='outbox-dispatcher', daemon=True)
+        self._thread.start()
+
+    def shutdown(self, wait=True, timeout=None):
+        """停止發送執行緒（等待進行中的批次完成）"""
+        self._stopped.set()
+        self._wakeup.set()
+        if wait and self._thread is not None:
+            self._thread.join(timeout)
+        self._pool.shutdown(wait=wait)
+
+    def notify(self):
+        """有新的待發送訊息時立即喚醒"""
+        self._wakeup.set()
+
+    def _circuit_open(self):
+        breaker = getattr(self.client or get_client(), 'breaker', None)
+        return breaker is not None and breaker.is_open()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                # 斷路器冷卻中不取出訊息，冷卻結束後的第一則訊息即為試探請求
+                if self._circuit_open():
+                    self._wakeup.wait(self.poll_seconds)
+                    self._wakeup.clear()
+                    continue
+                # 取滿一批代表可能還有待發送的訊息，立即繼續
+                if self.drain_once() >= self.batch_size:
+                    continue
+            except Exception as e:
+                logger.error(f"[outbox] 發送批次失敗: {e}", exc_info=True)
+            self._wakeup.wait(self.poll_seconds)
+            self._wakeup.clear()
+
+    def drain_once(self):
+        """
+        取出並發送一批到期的訊息
+
+        Returns:
+            int: 本批訊息數量
+        """
+        rows = self._claim_batch()
+        if not rows:
+            return 0
+        results = list(self._pool.map(self._deliver, rows))
+        self._apply_results(rows, results)
+        return len(rows)
+
+    def _claim_batch(self):
+        """領取一批到期且未被其他行程領取的訊息"""
+        now = _now()
+        session = Session()
+        try:
+            claimable = select(OutboxMessage.id).where(
+                OutboxMessage.status == STATUS_PENDING,
+                OutboxMessage.next_attempt_at <= now,
+                or_(OutboxMessage.claimed_until.is_(None), OutboxMessage.claimed_until < now)
+            ).order_by(OutboxMessage.priority, OutboxMessage.next_attempt_at).limit(self.batch_size)
+            if session.get_bind().dialect.name == 'postgresql':
+                claimable = claimable.with_for_update(skip_locked=True)
+            ids = session.execute(claimable).scalars().all()
+            if not ids:
+                session.rollback()
+                return []
+
+            session.execute(
+                update(OutboxMessage)
+                .where(
+                    OutboxMessage.id.in_(ids),
+                    or_(OutboxMessage.claimed_until.is_(None), OutboxMessage.claimed_until < now)
+                )
+                .values(claimed_by=self.holder, claimed_until=now + timedelta(seconds=Config.OUTBOX_CLAIM_SECONDS))
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+
+            return session.query(
+                OutboxMessage.id, OutboxMessage.kind, OutboxMessage.target, OutboxMessage.payload,
+                OutboxMessage.retry_key, OutboxMessage.priority, OutboxMessage.attempts,
+                OutboxMessage.expires_at
+            ).filter(
+                OutboxMessage.id.in_(ids),
+                OutboxMessage.claimed_by == self.holder
+            ).order_by(OutboxMessage.priority, OutboxMessage.next_attempt_at).all()
+        finally:
+            session.close()
+
+    def _deliver(self, row):
+        """在工作執行緒中發送一則 outbox 訊息，回傳 (結果, 錯誤訊息, 最少等待秒數)"""
+        if row.expires_at is not None and row.expires_at < _now():
+            return RESULT_DEAD, "reply token 已過期" if row.kind == KIND_REPLY else "提醒時間窗已關閉", None
+
+        client = self.client or get_client()
+        messages = json.loads(row.payload)
+        try:
+            if row.kind == KIND_REPLY:
+                client.reply(row.target, messages, priority=row.priority)
+            else:
+                client.push(row.target, messages, retry_key=row.retry_key, priority=row.priority)
+            logger.info(f"[outbox] 已發送 {row.kind} {len(messages)} 則訊息到 {row.target}")
+            return RESULT_SENT, None, None
+        except CircuitOpenError as e:
+            return RESULT_RELEASE, str(e), None
+        except LineApiError as e:
+            # 相同 X-Line-Retry-Key 的請求先前已被接受
+            if e.status_code == 409 and row.kind == KIND_PUSH:
+                return RESULT_SENT, None, None
+            error = e
+        except Exception as e:
+            error = e
+
+        logger.error(f"[outbox] 發送失敗 (第 {row.attempts + 1} 次): {row.id} - {error}")
+        if is_retryable_error(error) and row.attempts + 1 < Config.OUTBOX_MAX_ATTEMPTS:
+            return RESULT_RETRY, str(error), getattr(error, 'retry_after', None)
+        return RESULT_DEAD, str(error), None
+
+    def _apply_results(self, rows, results):
+        """依發送結果刪除、延後重試、釋放或標記為放棄"""
+        now = _now()
+        sent_ids = [row.id for row, (result, _, _) in zip(rows, results) if result == RESULT_SENT]
+        session = Session()
+        try:
+            if sent_ids:
+                session.execute(
+                    delete(OutboxMessage)
+                    .where(OutboxMessage.id.in_(sent_ids))
+                    .execution_options(synchronize_session=False)
+                )
+            for row, (result, error, retry_after) in zip(rows, results):
+                if result == RESULT_RETRY:
+                    # 429 至少等到 Retry-After 之後才重試
+                    delay = max(backoff_seconds(row.attempts + 1), retry_after or 0)
+                    values = {'attempts': row.attempts + 1, 'next_attempt_at': now + timedelta(seconds=delay)}
+                elif result == RESULT_DEAD:
+                    values = {'attempts': row.attempts + 1, 'status': STATUS_DEAD}
+                elif result == RESULT_RELEASE:
+                    # 請求沒有送出，不計入失敗次數
+                    values = {}
+                else:
+                    continue
+                session.execute(
+                    update(OutboxMessage)
+                    .where(OutboxMessage.id == row.id)
+                    .values(
+                        last_error=error,
+                        claimed_by=None,
+                        claimed_until=None,
+                        **values
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+            session.commit()
+        except Exception as e:
+            logger.error(f"[outbox] 更新發送結果失敗: {e}")
+            session.rollback()
+        finally:
+            session.close()
+
+
+# 目前行程內執行中的發送 worker（未啟動的行程為 None）
+_dispatcher = None
+
+
+def start_dispatcher():
+    """啟動行程內的 outbox 發送 worker"""
+    global _dispatcher
+    _dispatcher = OutboxDispatcher()
+    _dispatcher.start()
+    return _dispatcher
+
+
+def notify_dispatcher():
+    """通知行程內的發送 worker 有新訊息（其他行程寫入的訊息靠定期輪詢取得）"""
+    if _dispatcher is not None:
+        _dispatcher.notify()
@@ -0,0 +1,153 @@
+"""
+LINE API 發送速率限制
+回覆與推播共用同一個令牌桶，超過每秒請求預算時依優先順序排隊等待；
+收到 429 時依 Retry-After 暫停整個桶，避免在限流期間持續送出注定失敗的請求
+"""
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+# 優先順序（數字越小越先發送）
+PRIORITY_HIGH = 0    # webhook 回覆、「時間到」提醒
+PRIORITY_NORMAL = 1  # 60 / 30 分鐘前提醒
+PRIORITY_LOW = 2     # 24 小時前提醒
+
+PRIORITY_NAMES = {
+    PRIORITY_HIGH: 'high',
+    PRIORITY_NORMAL: 'normal',
+    PRIORITY_LOW: 'low',
+}
+
+# 429 回應沒有 Retry-After 時暫停的秒數
+DEFAULT_RETRY_AFTER_SECONDS = 1.0
+
+
+def priority_for_remind_type(remind_type):
+    """提醒類型對應的發送優先順序"""
+    if remind_type == 0:
+        return PRIORITY_HIGH
+    if remind_type == 1440:
+        return PRIORITY_LOW
+    return PRIORITY_NORMAL
+
+
+def parse_retry_after(value):
+    """
+    解析 Retry-After 標頭（秒數或 HTTP 日期）
+
+    Returns:
+        float: 需要等待的秒數，無法解析時回傳 None
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    """
+    有優先順序的令牌桶（執行緒安全）
+    每秒補充 rate 個令牌，最多累積 burst 個；有較高優先順序的請求在等待時，較低優先順序的請求不會取得令牌
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+        self._waiting = {priority: 0 for priority in PRIORITY_NAMES}
+        self._acquired = {priority: 0 for priority in PRIORITY_NAMES}
+        self._throttled = {priority: 0 for priority in PRIORITY_NAMES}
+        self._wait_total = {priority: 0.0 for priority in PRIORITY_NAMES}
+        self._wait_max = {priority: 0.0 for priority in PRIORITY_NAMES}
+        self._pauses = 0
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _higher_priority_waiting(self, priority):
+        return any(count for p, count in self._waiting.items() if p < priority)
+
+    def acquire(self, priority=PRIORITY_NORMAL):
+        """
+        取得一個令牌，必要時阻塞等待
+
+        Returns:
+            float: 等待的秒數
+        """
+        if self.rate <= 0:
+            return 0.0
+
+        started = time.monotonic()
+        with self._cond:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    delay = self._paused_until - now
+                    if delay <= 0:
+                        if self._higher_priority_waiting(priority):
+                            # 等較高優先順序的請求取得令牌後會被喚醒
+                            delay = 1.0 / self.rate
+                        elif self._tokens >= 1:
+                            self._tokens -= 1
+                            break
+                        else:
+                            delay = (1 - self._tokens) / self.rate
+                    self._cond.wait(delay)
+            finally:
+                self._waiting[priority] -= 1
+                self._cond.notify_all()
+
+            waited = time.monotonic() - started
+            self._acquired[priority] += 1
+            if waited > 0.001:
+                self._throttled[priority] += 1
+            self._wait_total[priority] += waited
+            self._wait_max[priority] = max(self._wait_max[priority], waited)
+        return waited
+
+    def pause(self, seconds):
+        """收到 429 時暫停發送 seconds 秒，並清空累積的令牌避免恢復時瞬間爆量"""
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens = 0.0
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._pauses += 1
+            self._cond.notify_all()
+
+    def stats(self):
+        """各優先順序的節流等待統計"""
+        with self._cond:
+            return {
+                'rate': self.rate,
+                'burst': self.capacity,
+                'paused_seconds': round(max(0.0, self._paused_until - time.monotonic()), 3),
+                'pauses': self._pauses,
+                'priorities': {
+                    name: {
+                        'waiting': self._waiting[priority],
+                        'acquired': self._acquired[priority],
+                        'throttled': self._throttled[priority],
+                        'wait_avg_ms': round(self._wait_total[priority] / self._acquired[priority] * 1000, 2)
+                        if self._acquired[priority] else 0.0,
+                        'wait_max_ms': round(self._wait_max[priority] * 1000, 2),
+                    }
+                    for priority, name in PRIORITY_NAMES.items()
+                },
+            }
@@ -1,217 +1,755 @@
-from datetime import datetime, timedelta
-from apscheduler.schedulers.background import BackgroundScheduler
+from datetime import datetime
+import heapq
+import threading
+import time
 import pytz
 import logging
-import requests
+from sqlalchemy import case, delete, update
+from sqlalchemy.exc import IntegrityError
 from config import Config
-from models import Session, Event
-from utils import get_remind_message
+from models import (
+    Session, Event, Group, SchedulerCheckpoint, EXPIRE_AFTER_MINUTES,
+    bump_list_versions, compute_next_fire_epoch, from_epoch, next_fire_offset, to_epoch, to_local_naive
+)
+from utils import get_missed_digest_message, get_remind_message
+from line_client import text_message
+from outbox import new_push, notify_dispatcher, start_dispatcher
+from rate_limit import priority_for_remind_type
+from leader import LeaderLease
+from sharding import ShardMembership, claim_due_events, release_claims
+from tick_engine import ACTION_ADVANCE, ACTION_DELETE, ACTION_PARK, ACTION_SEND, ColumnBatch, plan, segment_ids
 
 # 設定日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# LINE API 設定
-LINE_PUSH_URL = "https://api.line.me/v2/bot/message/push"
-LINE_HEADERS = {
-    "Content-Type": "application/json",
-    "Authorization": f"Bearer {Config.LINE_CHANNEL_ACCESS_TOKEN}"
-}
+# LINE 推播 API 每次最多可發送的訊息物件數量
+LINE_MAX_MESSAGES_PER_PUSH = 5
+
+# 摘要訊息每則最多列出的事件數量（LINE 文字訊息上限 5000 字）
+DIGEST_EVENTS_PER_MESSAGE = 20
+
+# 最後一次成功檢查時間的紀錄名稱
+CHECKPOINT_NAME = 'reminder-scheduler'
 
 # 時區設定
 tz = pytz.timezone(Config.TIMEZONE)
 
 
-def check_and_send_reminders():
+# 狀態轉換動作
+# ACTION_SEND: 發送提醒並前進到下一個等級
+# ACTION_ADVANCE: 不發送，直接跳到指定等級（時間不足或已過）
+# ACTION_DELETE: 清理事件
+# ACTION_PARK: 沒有狀態變化，延後到過期清理時間
+
+
+def evaluate_event(remind_level, time_diff):
     """
-    檢查資料庫並發送提醒
-    每分鐘執行一次
+    依提醒狀態機決定事件的下一步
+    （狀態機的規格；排程檢查以 tick_engine 的狀態表批次計算，兩者由測試確認等價）
+
+    Args:
+        remind_level: 目前的提醒等級
+        time_diff: 距離事件時間的分鐘數（負數表示已過）
+
+    Returns:
+        tuple: (動作, 新的 remind_level, 提醒類型)
     """
-    session = Session()
+    # 清理長時間未處理的舊事件（事件時間過後超過 1 天）
+    if time_diff < -EXPIRE_AFTER_MINUTES:
+        return ACTION_DELETE, None, None
+    
+    # 邏輯 A-D: 在提醒時間窗內發送提醒
+    if remind_level == 0 and 1430 <= time_diff <= 1450:
+        return ACTION_SEND, 1, 1440
+    if remind_level == 1 and 58 <= time_diff <= 62:
+        return ACTION_SEND, 2, 60
+    if remind_level == 2 and 28 <= time_diff <= 32:
+        return ACTION_SEND, 3, 30
+    if remind_level == 3 and -2 <= time_diff <= 2:
+        return ACTION_SEND, 4, 0
+    
+    # 例外處理：跳過已過的提醒階段（時間不足）
+    if remind_level == 0 and time_diff < 1430:
+        if 58 <= time_diff:
+            return ACTION_ADVANCE, 1, None
+        if 28 <= time_diff:
+            return ACTION_ADVANCE, 2, None
+        if -2 <= time_diff:
+            return ACTION_ADVANCE, 3, None
+        return ACTION_PARK, remind_level, None
+    if remind_level == 1 and time_diff < 58:
+        if 28 <= time_diff:
+            return ACTION_ADVANCE, 2, None
+        if -2 <= time_diff:
+            return ACTION_ADVANCE, 3, None
+        return ACTION_PARK, remind_level, None
+    if remind_level == 2 and -2 <= time_diff < 28:
+        return ACTION_ADVANCE, 3, None
+    
+    # 整點時間已過超過 2 分鐘，直接標記為完成
+    if remind_level == 3 and time_diff < -2:
+        return ACTION_ADVANCE, 4, None
+    
+    # 清理已過期且已完成的事件（事件時間過後 10 分鐘）
+    if remind_level == 4 and time_diff <= -10:
+        return ACTION_DELETE, None, None
+    
+    return ACTION_PARK, remind_level, None
+
+
+# 各 remind_level 的提醒時間窗關閉時間（事件前的分鐘數）與提醒類型，與 evaluate_event 的時間窗一致
+WINDOW_CLOSE_OFFSETS = {0: 1430, 1: 58, 2: 28, 3: -2}
+REMIND_TYPES = {0: 1440, 1: 60, 2: 30, 3: 0}
+
+
+def missed_reminders(remind_level, event_epoch, since, now):
+    """
+    找出在 (since, now] 之間關閉、但沒有發送的提醒時間窗
+
+    Args:
+        remind_level: 目前的提醒等級
+        event_epoch: 事件時間（UTC epoch 秒數）
+        since: 上次成功檢查的時間（或事件建立時間，取較晚者，UTC epoch 秒數）
+        now: 目前時間（UTC epoch 秒數）
+
+    Returns:
+        tuple: ([錯過的提醒類型], 新的 remind_level)
+    """
+    missed = []
+    level = remind_level
+    while level in WINDOW_CLOSE_OFFSETS:
+        closed_at = event_epoch - WINDOW_CLOSE_OFFSETS[level] * 60
+        if closed_at > now:
+            break
+        # 在上次檢查之前就已關閉的時間窗不是停機造成的（例如建立事件時已來不及）
+        if closed_at > since:
+            missed.append(REMIND_TYPES[level])
+        level += 1
+    return missed, level
+
+
+def _chunks(items, size):
+    """將序列依固定大小切分"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def apply_level_updates(session, updates):
+    """
+    以集合式 UPDATE ... SET remind_level = CASE ... 批次更新提醒等級
+
+    Args:
+        session: 資料庫 Session（由呼叫端負責 commit）
+        updates: {event_id: (remind_level, next_fire_epoch)}
+    """
+    ids = list(updates)
+    for chunk in _chunks(ids, Config.SCHEDULER_BULK_CHUNK_SIZE):
+        session.execute(
+            update(Event)
+            .where(Event.id.in_(chunk))
+            .values(
+                remind_level=case({i: updates[i][0] for i in chunk}, value=Event.id),
+                next_fire_epoch=case({i: updates[i][1] for i in chunk}, value=Event.id),
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+
+def list_changed_groups(batch, segments):
+    """
+    行程清單有變動的群組：未完成事件的 remind_level 改變或被清理
+    （延後不改變 remind_level；已完成的事件不在 /list 中）
+
+    Args:
+        batch: ColumnBatch
+        segments: tick_engine.plan() 的結果
+    """
+    group_keys = set()
+    for (action, _, _), ranges in segments.items():
+        if action == ACTION_PARK:
+            continue
+        for lo, hi in ranges:
+            # 每個區段都在同一個 remind_level 內
+            if batch.levels[lo] < 4:
+                group_keys.update(batch.group_keys[lo:hi])
+    return group_keys
+
+
+def load_event_details(session, event_ids):
+    """
+    只為需要顯示的事件載入描述、顯示用時間與推播對象（排程檢查本身不讀取 description 與 LINE 來源 ID）
+
+    Returns:
+        dict: {事件 ID: (id, group_id, description, event_datetime, event_epoch)}，group_id 為 LINE 的來源 ID
+    """
+    details = {}
+    for chunk in _chunks(list(event_ids), Config.SCHEDULER_BULK_CHUNK_SIZE):
+        for row in session.query(
+            Event.id, Group.line_id.label('group_id'), Event.description, Event.event_datetime, Event.event_epoch
+        ).join(Group, Group.id == Event.group_key).filter(Event.id.in_(chunk)):
+            details[row.id] = row
+    return details
+
+
+def move_events(session, event_ids, remind_level, fire_offset):
+    """
+    將一批事件設為同一個 remind_level，next_fire_epoch 由資料庫依 event_epoch 計算（不需要逐筆 CASE）
+
+    Args:
+        session: 資料庫 Session（由呼叫端負責 commit）
+        event_ids: 事件 ID
+        remind_level: 新的提醒等級
+        fire_offset: 下一次處理時間（事件前的分鐘數，見 models.next_fire_offset）
+    """
+    for chunk in _chunks(list(event_ids), Config.SCHEDULER_BULK_CHUNK_SIZE):
+        session.execute(
+            update(Event)
+            .where(Event.id.in_(chunk))
+            .values(remind_level=remind_level, next_fire_epoch=Event.event_epoch - fire_offset * 60)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def delete_events(session, event_ids):
+    """以 DELETE ... WHERE id IN (...) 批次刪除事件（由呼叫端負責 commit）"""
+    for chunk in _chunks(list(event_ids), Config.SCHEDULER_BULK_CHUNK_SIZE):
+        session.execute(
+            delete(Event)
+            .where(Event.id.in_(chunk))
+            .execution_options(synchronize_session=False)
+        )
+
+
+def group_push_jobs(sends):
+    """
+    將同一群組、同一提醒類型的到期提醒合併成推播工作，每個工作最多 LINE_MAX_MESSAGES_PER_PUSH 則訊息；
+    同一推播中的提醒時間窗一起關閉（推播的過期時間一致），「時間到」的提醒排在最前面的推播
+
+    Args:
+        sends: [(event, remind_type, new_level)]
+
+    Yields:
+        tuple: (group_id, [(event, remind_type, new_level)])
+    """
+    by_group = {}
+    for job in sends:
+        by_group.setdefault((job[0].group_id, job[1]), []).append(job)
+    for (group_id, remind_type), jobs in sorted(by_group.items(), key=lambda item: priority_for_remind_type(item[0][1])):
+        for chunk in _chunks(jobs, LINE_MAX_MESSAGES_PER_PUSH):
+            yield group_id, chunk
+
+
+def window_closes_at(event_epoch, remind_type):
+    """提醒時間窗關閉的時間（之後再送出的提醒內容已經過時，例如「還有 60 分鐘」）"""
+    level = next(level for level, value in REMIND_TYPES.items() if value == remind_type)
+    return from_epoch(event_epoch - WINDOW_CLOSE_OFFSETS[level] * 60)
+
+
+def checkpoint_names(shard=None):
+    """
+    檢查紀錄名稱：領導者模式只有一列；分片模式每個雜湊桶一列，重新平衡後新的負責者沿用同一個雜湊桶的紀錄
+    （沒有負責任何分片時為空）
+    """
+    if shard is None:
+        return [CHECKPOINT_NAME]
+    if not shard.is_active:
+        return []
+    lo, hi = shard.bucket_range()
+    return [bucket_checkpoint_name(bucket) for bucket in range(lo, hi)]
+
+
+def bucket_checkpoint_name(bucket):
+    """雜湊桶的檢查紀錄名稱"""
+    return f"{CHECKPOINT_NAME}:{bucket}"
+
+
+def record_checkpoint(session, names, now):
+    """記錄最後一次成功檢查的時間（由呼叫端負責 commit）"""
+    for chunk in _chunks(names, Config.SCHEDULER_BULK_CHUNK_SIZE):
+        result = session.execute(
+            update(SchedulerCheckpoint)
+            .where(SchedulerCheckpoint.name.in_(chunk))
+            .values(last_tick_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == len(chunk):
+            continue
+        existing = {
+            row.name for row in session.query(SchedulerCheckpoint.name).filter(SchedulerCheckpoint.name.in_(chunk))
+        }
+        for name in chunk:
+            if name in existing:
+                continue
+            # 重新平衡期間其他行程可能同時建立同一列，以 savepoint 隔離插入失敗
+            try:
+                with session.begin_nested():
+                    session.add(SchedulerCheckpoint(name=name, last_tick_at=now))
+            except IntegrityError:
+                pass
+
+
+def load_checkpoints(session, names):
+    """
+    讀取檢查紀錄
+
+    Returns:
+        dict: {名稱: 最後一次成功檢查的時間（UTC epoch 秒數）}
+    """
+    checkpoints = {}
+    for chunk in _chunks(names, Config.SCHEDULER_BULK_CHUNK_SIZE):
+        for row in session.query(SchedulerCheckpoint.name, SchedulerCheckpoint.last_tick_at).filter(
+            SchedulerCheckpoint.name.in_(chunk)
+        ):
+            checkpoints[row.name] = to_epoch(row.last_tick_at)
+    return checkpoints
+
+
+def check_and_send_reminders(shard=None, lease=None):
+    """
+    檢查資料庫並產生提醒
+    只查詢 next_fire_epoch 已到期事件的 (id, group_key, event_epoch, remind_level)，以 tick_engine 的狀態表
+    將整批事件切成各狀態轉換的區段，每個區段以一條批次語句套用；
+    要發送的提醒寫入 outbox，與 remind_level 變更在同一個交易中提交，不在檢查中等待網路
+    
+    Args:
+        shard: ShardMembership，分片模式下只領取並處理本分片的事件
+        lease: LeaderLease，提交前確認仍持有租約，檢查期間失去租約時放棄本次變更
+    """
+    session = Session(expire_on_commit=False)
     try:
         now = datetime.now(tz)
+        now_epoch = int(now.timestamp())
         logger.info(f"[排程] 開始檢查提醒 - {now.strftime('%Y-%m-%d %H:%M:%S')}")
         
-        # 查詢所有未完成的事件（remind_level < 4）
-        events = session.query(Event).filter(
-            Event.remind_level < 4
-        ).all()
+        # 只查詢已到期需要處理的事件（next_fire_epoch <= now），只取狀態機需要的欄位並串流存入欄位緩衝區
+        columns = (Event.id, Event.group_key, Event.event_epoch, Event.remind_level)
+        if shard is None:
+            rows = session.query(*columns).filter(
+                Event.next_fire_epoch <= now_epoch
+            ).order_by(Event.remind_level, Event.event_epoch).execution_options(yield_per=Config.QUERY_YIELD_PER)
+        elif shard.is_active:
+            rows = claim_due_events(session, shard.holder, shard.bucket_range(), now, columns)
+        else:
+            rows = []
+        batch = ColumnBatch(rows)
         
-        if not events:
+        if not batch:
             logger.info("[排程] 沒有待處理的提醒")
+            record_checkpoint(session, checkpoint_names(shard), to_local_naive(now))
+            session.commit()
             return
         
-        logger.info(f"[排程] 找到 {len(events)} 個待處理事件")
+        logger.info(f"[排程] 找到 {len(batch)} 個待處理事件")
         
-        for event in events:
-            try:
-                # 確保 event_datetime 有時區資訊
-                if event.event_datetime.tzinfo is None:
-                    event_datetime = tz.localize(event.event_datetime)
-                else:
-                    event_datetime = event.event_datetime.astimezone(tz)
-                
-                time_diff = (event_datetime - now).total_seconds() / 60  # 轉換為分鐘
-                
-                # 邏輯 A: 24 小時提醒 (1440 分鐘)
-                if event.remind_level == 0 and 1430 <= time_diff <= 1450:
-                    send_reminder(event, 1440)
-                    event.remind_level = 1
-                    session.commit()
-                    logger.info(f"[排程] 已發送 24 小時提醒: {event.description}")
-                
-                # 邏輯 B: 60 分鐘提醒
-                elif event.remind_level == 1 and 58 <= time_diff <= 62:
-                    send_reminder(event, 60)
-                    event.remind_level = 2
-                    session.commit()
-                    logger.info(f"[排程] 已發送 60 分鐘提醒: {event.description}")
-                
-                # 邏輯 C: 30 分鐘提醒
-                elif event.remind_level == 2 and 28 <= time_diff <= 32:
-                    send_reminder(event, 30)
-                    event.remind_level = 3
-                    session.commit()
-                    logger.info(f"[排程] 已發送 30 分鐘提醒: {event.description}")
-                
-                # 邏輯 D: 整點提醒
-                elif event.remind_level == 3 and -2 <= time_diff <= 2:
-                    send_reminder(event, 0)
-                    event.remind_level = 4
-                    session.commit()
-                    logger.info(f"[排程] 已發送整點提醒: {event.description}")
-                
-                # 例外處理：跳過已過的提醒階段
-                elif event.remind_level == 0 and time_diff < 1430:
-                    if 58 <= time_diff < 1430:
-                        # 跳過 24 小時，進入 60 分鐘提醒階段
-                        event.remind_level = 1
-                        session.commit()
-                        logger.info(f"[排程] 跳過 24 小時提醒（時間不足）: {event.description}")
-                    elif 28 <= time_diff < 58:
-                        # 跳過 24 小時和 60 分鐘，進入 30 分鐘提醒階段
-                        event.remind_level = 2
-                        session.commit()
-                        logger.info(f"[排程] 跳過 24 小時+60 分鐘提醒（時間不足）: {event.description}")
-                    elif -2 <= time_diff < 28:
-                        # 直接進入整點提醒階段
-                        event.remind_level = 3
-                        session.commit()
-                        logger.info(f"[排程] 跳過 24 小時+60+30 分鐘提醒（時間不足）: {event.description}")
-                
-                # 例外處理：如果 remind_level=1 但時間已不足 60 分鐘
-                elif event.remind_level == 1 and time_diff < 58:
-                    if 28 <= time_diff < 58:
-                        event.remind_level = 2
-                        session.commit()
-                        logger.info(f"[排程] 跳過 60 分鐘提醒（時間不足）: {event.description}")
-                    elif -2 <= time_diff < 28:
-                        event.remind_level = 3
-                        session.commit()
-                        logger.info(f"[排程] 跳過 60+30 分鐘提醒（時間不足）: {event.description}")
-                
-                # 例外處理：如果 remind_level=2 但時間已不足 30 分鐘
-                elif event.remind_level == 2 and -2 <= time_diff < 28:
-                    event.remind_level = 3
-                    session.commit()
-                    logger.info(f"[排程] 跳過 30 分鐘提醒（時間不足）: {event.description}")
-                
-                # 例外處理：如果 remind_level=3 但整點時間已過超過 2 分鐘
-                elif event.remind_level == 3 and time_diff < -2:
-                    # 直接標記為完成
-                    event.remind_level = 4
-                    session.commit()
-                    logger.info(f"[排程] 整點提醒時間已過，標記為完成: {event.description}")
-                
-                # 清理已過期且已完成的事件（事件時間過後 10 分鐘）
-                elif event.remind_level == 4 and time_diff < -10:
-                    session.delete(event)
-                    session.commit()
-                    logger.info(f"[排程] 清理已完成事件: {event.description}")
-                
-                # 清理長時間未處理的舊事件（事件時間過後超過 1 天）
-                elif time_diff < -1440:
-                    session.delete(event)
-                    session.commit()
-                    logger.info(f"[排程] 清理過期事件（超過1天）: {event.description}, remind_level={event.remind_level}")
-                    
-            except Exception as e:
-                logger.error(f"[排程] 處理事件失敗: {event.id} - {e}")
-                continue
+        # 以狀態表將整批事件切成各狀態轉換的區段
+        moves = []
+        deletes = []
+        sends = []
+        segments = plan(batch, now_epoch)
+        for (action, new_level, remind_type), ranges in segments.items():
+            ids = segment_ids(batch, ranges)
+            if action == ACTION_SEND:
+                sends.append((ids, new_level, remind_type))
+            elif action == ACTION_ADVANCE:
+                moves.append((ids, new_level, next_fire_offset(new_level)))
+            elif action == ACTION_DELETE:
+                deletes.extend(ids)
+            elif action == ACTION_PARK:
+                moves.append((ids, new_level, next_fire_offset(None)))
+        
+        # 只為要發送的事件載入描述與顯示用時間
+        details = load_event_details(session, [event_id for ids, _, _ in sends for event_id in ids])
+        jobs = [
+            (details[event_id], remind_type, new_level)
+            for ids, new_level, remind_type in sends
+            for event_id in ids
+            if event_id in details
+        ]
+        
+        # 要發送的提醒依群組合併成推播寫入 outbox，並前進到下一個等級
+        outbox_rows = []
+        # 推播在提醒時間窗關閉後過期（斷路器開啟期間累積的過時提醒不會在恢復後一次送出）
+        for group_id, group_jobs in group_push_jobs(jobs):
+            remind_type = group_jobs[0][1]
+            outbox_rows.append(new_push(
+                group_id,
+                [build_reminder_message(event, remind_type) for event, _, _ in group_jobs],
+                priority=priority_for_remind_type(remind_type),
+                expires_at=min(window_closes_at(event.event_epoch, remind_type) for event, _, _ in group_jobs)
+            ))
+            for event, remind_type, _ in group_jobs:
+                logger.info(f"[排程] 已排入提醒 ({remind_type} 分鐘): {event.description}")
+        for ids, new_level, _ in sends:
+            moves.append((ids, new_level, next_fire_offset(new_level)))
+        
+        # 狀態轉換、清理與 outbox 在同一個交易中提交
+        try:
+            if lease is not None and not lease.fence(session):
+                session.rollback()
+                return
+            for ids, new_level, fire_offset in moves:
+                move_events(session, ids, new_level, fire_offset)
+            delete_events(session, deletes)
+            bump_list_versions(session, list_changed_groups(batch, segments))
+            session.add_all(outbox_rows)
+            record_checkpoint(session, checkpoint_names(shard), to_local_naive(now))
+            session.commit()
+            logger.info(
+                f"[排程] 已更新 {sum(len(ids) for ids, _, _ in moves)} 個事件狀態，清理 {len(deletes)} 個事件，"
+                f"排入 {len(outbox_rows)} 則推播"
+            )
+        except Exception as e:
+            logger.error(f"[排程] 批次更新事件失敗: {e}")
+            session.rollback()
+            return
+        
+        if outbox_rows:
+            notify_dispatcher()
         
     except Exception as e:
         logger.error(f"[排程] 檢查提醒時發生錯誤: {e}")
     finally:
+        if shard is not None:
+            release_claims(session, shard.holder)
         session.close()
 
 
-def send_reminder(event, remind_type):
+def build_reminder_message(event, remind_type):
+    """產生單一事件的提醒訊息物件（event_datetime 為設定時區的時間，直接顯示）"""
+    return text_message(get_remind_message(event.description, event.event_datetime, remind_type))
+
+
+def catch_up_missed_reminders(shard=None, policy=None, lease=None):
     """
-    發送提醒訊息到 LINE 群組（使用 requests 避免 OpenSSL 問題）
+    停機後的補發檢查（取得租約或分片後、第一次檢查前執行）
+    以單一查詢找出上次成功檢查後關閉、但沒有處理的提醒時間窗，依 SCHEDULER_CATCHUP_POLICY
+    每個群組發送一則摘要（digest）或直接略過（drop），並以批次語句將事件前進到下一個等級
     
     Args:
-        event: Event 物件
-        remind_type: 提醒類型 (60, 30, 0)
+        shard: ShardMembership，分片模式下只處理本分片的事件
+        policy: digest 或 drop，預設為 Config.SCHEDULER_CATCHUP_POLICY
+        lease: LeaderLease，提交前確認仍持有租約
+    
+    Returns:
+        int: 錯過提醒的事件數量
     """
+    policy = policy or Config.SCHEDULER_CATCHUP_POLICY
+    names = checkpoint_names(shard)
+    if not names:
+        return 0
+    
+    session = Session()
     try:
-        # 確保 event_datetime 有時區資訊
-        if event.event_datetime.tzinfo is None:
-            event_datetime = tz.localize(event.event_datetime)
-        else:
-            event_datetime = event.event_datetime
+        now = datetime.now(tz)
+        now_epoch = now.timestamp()
+        checkpoints = load_checkpoints(session, names)
+        if not checkpoints:
+            logger.info("[補發] 沒有上次檢查的紀錄，略過補發")
+            return 0
+        since = from_epoch(min(checkpoints.values()))
         
-        message_text = get_remind_message(
-            event.description,
-            event_datetime,
-            remind_type
-        )
+        criteria = shard.event_criteria() if shard is not None else []
+        rows = session.query(
+            Event.id, Event.group_key, Event.shard_key, Event.event_epoch, Event.remind_level, Event.created_at
+        ).filter(
+            Event.next_fire_epoch <= now_epoch,
+            Event.remind_level < 4,
+            *criteria
+        ).execution_options(yield_per=Config.QUERY_YIELD_PER)
         
-        # 使用 requests 發送推播訊息
-        payload = {
-            "to": event.group_id,
-            "messages": [
-                {
-                    "type": "text",
-                    "text": message_text
-                }
-            ]
-        }
-        
-        response = requests.post(
-            LINE_PUSH_URL,
-            headers=LINE_HEADERS,
-            json=payload,
-            timeout=10
-        )
+        advances = {}
+        changed_groups = set()
+        missed_events = []
+        for row in rows:
+            # 分片模式依事件所屬雜湊桶的紀錄判斷（重新平衡前由其他行程負責的雜湊桶也有自己的紀錄）
+            name = bucket_checkpoint_name(row.shard_key) if shard is not None else CHECKPOINT_NAME
+            since_epoch = checkpoints.get(name)
+            if since_epoch is None:
+                # 沒有紀錄的雜湊桶（從未被檢查過）交給一般檢查
+                continue
+            # created_at 是伺服器本地時間的 naive datetime；停機期間才建立的事件不算錯過建立前的時間窗
+            created_epoch = row.created_at.timestamp() if row.created_at else since_epoch
+            missed, new_level = missed_reminders(
+                row.remind_level, row.event_epoch, max(since_epoch, created_epoch), now_epoch
+            )
+            if new_level != row.remind_level:
+                advances[row.id] = (new_level, compute_next_fire_epoch(row.event_epoch, new_level))
+                changed_groups.add(row.group_key)
+            if missed:
+                missed_events.append((row.id, row.group_key, missed))
         
-        if response.status_code == 200:
-            logger.info(f"成功發送提醒到群組 {event.group_id}")
-        else:
-            logger.error(f"發送提醒失敗: {response.status_code} - {response.text}")
-            raise Exception(f"LINE API 錯誤: {response.status_code}")
+        outbox_rows = []
+        if policy == 'digest':
+            # 摘要只需要載入錯過提醒的事件描述
+            missed_by_group = {}
+            details = load_event_details(session, [event_id for event_id, _, _ in missed_events])
+            for event_id, _, missed in missed_events:
+                detail = details.get(event_id)
+                if detail is not None:
+                    missed_by_group.setdefault(detail.group_id, []).append(
+                        (detail.description, detail.event_datetime, missed)
+                    )
+            for group_id, items in missed_by_group.items():
+                items.sort(key=lambda item: item[1])
+                messages = [
+                    text_message(get_missed_digest_message(chunk))
+                    for chunk in _chunks(items, DIGEST_EVENTS_PER_MESSAGE)
+                ]
+                for chunk in _chunks(messages, LINE_MAX_MESSAGES_PER_PUSH):
+                    outbox_rows.append(new_push(group_id, chunk))
         
-    except Exception as e:
-        logger.error(f"發送提醒失敗: {e}", exc_info=True)
+        missed_count = len(missed_events)
+        if lease is not None and not lease.fence(session):
+            session.rollback()
+            return 0
+        apply_level_updates(session, advances)
+        bump_list_versions(session, changed_groups)
+        session.add_all(outbox_rows)
+        record_checkpoint(session, names, to_local_naive(now))
+        session.commit()
+        logger.info(
+            f"[補發] 最早的上次檢查 {since.strftime('%Y-%m-%d %H:%M:%S')}，{len({group_key for _, group_key, _ in missed_events})} 個群組 "
+            f"{missed_count} 個事件錯過提醒（{policy}），前進 {len(advances)} 個事件，排入 {len(outbox_rows)} 則推播"
+        )
+    except Exception:
+        session.rollback()
         raise
+    finally:
+        session.close()
+    
+    if outbox_rows:
+        notify_dispatcher()
+    return missed_count
+
+
+class ReminderTimer:
+    """
+    以最小堆積 (min-heap) 保存熱區時間窗內即將到期的 next_fire_epoch，
+    睡眠到下一個到期時間才執行檢查；資料表仍是唯一的資料來源。
+    有設定租約時，只有持有租約（或負責分片）的行程會執行檢查；
+    檢查寫入 outbox 的訊息由同一行程的發送 worker 送出；
+    啟動或取得租約後，第一次檢查前先執行補發檢查（catch_up）。
+    """
+    
+    def __init__(self, tick=check_and_send_reminders, lease=None, dispatcher=None,
+                 catch_up=catch_up_missed_reminders):
+        self.tick = tick
+        self.catch_up = catch_up
+        self.lease = lease
+        self.dispatcher = dispatcher
+        self.window = Config.SCHEDULER_HOT_WINDOW_HOURS * 3600
+        self.rehydrate_interval = Config.SCHEDULER_REHYDRATE_SECONDS
+        self._heap = []
+        self._deadlines = {}
+        self._window_end = None
+        self._last_rehydrate = 0
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._catch_up = False
+        self._needs_catch_up = True
+        self._thread = None
+    
+    def start(self):
+        """從資料表載入熱區事件並啟動背景執行緒"""
+        self.rehydrate()
+        self._thread = threading.Thread(target=self._run, name='reminder-timer', daemon=True)
+        self._thread.start()
+    
+    def shutdown(self, wait=True, timeout=None):
+        """停止背景執行緒（等待進行中的檢查完成）並釋放租約"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if wait and self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.warning("[排程] 等待進行中的檢查逾時，強制結束")
+        if self.lease is not None:
+            self.lease.stop()
+        if self.dispatcher is not None:
+            self.dispatcher.shutdown(wait=wait, timeout=timeout)
+    
+    def wake(self):
+        """立即重新載入並執行一次檢查（例如剛成為領導者時補上已到期的事件）"""
+        with self._cond:
+            self._catch_up = True
+            self._needs_catch_up = True
+            self._cond.notify()
+    
+    def schedule(self, event_id, fire_at, shard_key=None):
+        """
+        新增或更新事件的下一次到期時間（UTC epoch 秒數；超出熱區時間窗的事件留待下次載入）
+        分片模式下略過其他分片的事件（由負責的行程排程）
+        """
+        if shard_key is not None and self.lease is not None and not self.lease.owns(shard_key):
+            return
+        with self._cond:
+            self._deadlines.pop(event_id, None)
+            if fire_at is None or self._window_end is None or fire_at > self._window_end:
+                return
+            self._deadlines[event_id] = fire_at
+            heapq.heappush(self._heap, (fire_at, event_id))
+            # 新的到期時間可能比目前等待的更早，喚醒執行緒重新計算
+            if self._heap[0][1] == event_id:
+                self._cond.notify()
+    
+    def cancel(self, event_id):
+        """移除事件（堆積中的舊項目會在彈出時略過）"""
+        with self._cond:
+            self._deadlines.pop(event_id, None)
+    
+    def rehydrate(self):
+        """從 events 資料表重新載入熱區時間窗內的到期時間"""
+        window_end = time.time() + self.window
+        session = Session()
+        try:
+            criteria = self.lease.event_criteria() if self.lease is not None else []
+            rows = session.query(Event.id, Event.next_fire_epoch).filter(
+                Event.next_fire_epoch <= window_end,
+                *criteria
+            ).execution_options(yield_per=Config.QUERY_YIELD_PER)
+            deadlines = {row.id: row.next_fire_epoch for row in rows}
+        finally:
+            session.close()
+        
+        with self._cond:
+            self._deadlines = deadlines
+            self._heap = [(fire_at, event_id) for event_id, fire_at in self._deadlines.items()]
+            heapq.heapify(self._heap)
+            self._window_end = window_end
+            self._last_rehydrate = time.monotonic()
+            self._cond.notify()
+        logger.info(f"[排程] 已載入 {len(deadlines)} 個 {Config.SCHEDULER_HOT_WINDOW_HOURS} 小時內到期的事件")
+    
+    def _pop_due(self, now):
+        """取出所有已到期的事件 ID；回傳 (到期 ID, 距離下一次到期的秒數)"""
+        due_ids = []
+        while self._heap:
+            fire_at, event_id = self._heap[0]
+            if self._deadlines.get(event_id) != fire_at:
+                heapq.heappop(self._heap)
+                continue
+            if fire_at > now:
+                return due_ids, fire_at - now
+            heapq.heappop(self._heap)
+            del self._deadlines[event_id]
+            due_ids.append(event_id)
+        return due_ids, None
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                due_ids, wait_seconds = self._pop_due(time.time())
+                catch_up, self._catch_up = self._catch_up, False
+                run_catch_up = self._needs_catch_up and (self.lease is None or self.lease.is_active)
+                if not due_ids and not catch_up and not run_catch_up:
+                    # 定期重新載入，涵蓋其他行程寫入的事件與前移的時間窗
+                    until_rehydrate = self._last_rehydrate + self.rehydrate_interval - time.monotonic()
+                    if until_rehydrate > 0:
+                        if wait_seconds is None or wait_seconds > until_rehydrate:
+                            wait_seconds = until_rehydrate
+                        self._cond.wait(wait_seconds)
+                        continue
+            
+            try:
+                if catch_up:
+                    self.rehydrate()
+                if due_ids or catch_up or run_catch_up:
+                    # 非領導者不執行檢查，到期事件會在下次重新載入時再次排入
+                    if self.lease is None or self.lease.is_active:
+                        if self._needs_catch_up and self.catch_up is not None:
+                            try:
+                                self.catch_up()
+                            except Exception as e:
+                                # 補發失敗時照常檢查，錯過的提醒依原本的邏輯略過，不讓排程停擺
+                                logger.error(f"[補發] 補發檢查失敗: {e}", exc_info=True)
+                        self._needs_catch_up = False
+                        self.tick()
+                        self._reschedule(due_ids)
+                else:
+                    self.rehydrate()
+            except Exception as e:
+                logger.error(f"[排程] 計時器執行失敗: {e}", exc_info=True)
+                time.sleep(1)
+    
+    def _reschedule(self, event_ids):
+        """
+        處理完成後依資料表中新的 next_fire_epoch 重新排入堆積；
+        next_fire_epoch 沒有前進的事件（檢查失敗 rollback 或由其他分片領取）延後 SCHEDULER_RETRY_SECONDS 再檢查，
+        避免立即再次到期而不斷重複檢查
+        """
+        if not event_ids:
+            return
+        session = Session()
+        try:
+            criteria = self.lease.event_criteria() if self.lease is not None else []
+            rows = session.query(Event.id, Event.next_fire_epoch).filter(
+                Event.id.in_(event_ids),
+                *criteria
+            ).all()
+        finally:
+            session.close()
+        now = time.time()
+        for row in rows:
+            fire_at = row.next_fire_epoch
+            if fire_at is not None and fire_at <= now:
+                fire_at = now + Config.SCHEDULER_RETRY_SECONDS
+            self.schedule(row.id, fire_at)
+
+
+# 目前行程內執行中的計時器（未啟動排程器的行程為 None）
+_timer = None
+
+
+def notify_event_scheduled(event_id, next_fire_epoch, shard_key=None):
+    """通知計時器事件已新增或更新（app 寫入資料表後呼叫；分片模式下只排程本分片的事件）"""
+    if _timer is not None:
+        _timer.schedule(event_id, next_fire_epoch, shard_key)
+
+
+def notify_event_removed(event_id):
+    """通知計時器事件已刪除"""
+    if _timer is not None:
+        _timer.cancel(event_id)
 
 
 def start_scheduler():
     """啟動排程器"""
-    scheduler = BackgroundScheduler(timezone=tz)
-    
-    # 每 10 秒執行一次檢查
-    scheduler.add_job(
-        check_and_send_reminders,
-        'interval',
-        seconds=10,
-        id='reminder_checker',
-        replace_existing=True
-    )
+    global _timer
     
-    scheduler.start()
-    logger.info("排程器已啟動，每 10 秒檢查一次提醒")
+    # outbox 發送 worker 以領取欄位協調，可以在每個行程中執行
+    dispatcher = start_dispatcher()
+    
+    if Config.SCHEDULER_MODE == 'sharded':
+        # 分片模式：每個行程負責一段群組鍵雜湊範圍
+        lease = ShardMembership()
+        _timer = ReminderTimer(
+            tick=lambda: check_and_send_reminders(shard=lease),
+            lease=lease,
+            dispatcher=dispatcher,
+            catch_up=lambda: catch_up_missed_reminders(shard=lease)
+        )
+    else:
+        # 以資料表租約選出唯一執行檢查的行程，其他 worker 或容器待命
+        lease = LeaderLease()
+        _timer = ReminderTimer(
+            tick=lambda: check_and_send_reminders(lease=lease),
+            lease=lease,
+            dispatcher=dispatcher,
+            catch_up=lambda: catch_up_missed_reminders(lease=lease)
+        )
+    lease.on_elected = _timer.wake
+    _timer.start()
+    lease.start()
+    logger.info(
+        f"排程器已啟動（{Config.SCHEDULER_MODE} 模式），依到期時間觸發檢查"
+        f"（熱區 {Config.SCHEDULER_HOT_WINDOW_HOURS} 小時，每 {Config.SCHEDULER_REHYDRATE_SECONDS} 秒重新載入）"
+    )
     
-    return scheduler
+    return _timer
 
 
 if __name__ == "__main__":
@@ -221,7 +759,6 @@ if __name__ == "__main__":
     
     try:
         # 保持運行
-        import time
         while True:
             time.sleep(1)
     except (KeyboardInterrupt, SystemExit):
@@ -0,0 +1,201 @@
+"""
+排程器水平分片
+每個排程行程負責群組鍵雜湊桶的一段連續範圍，並以 claimed_by / claimed_until 欄位領取到期事件；
+PostgreSQL 另外使用 SELECT ... FOR UPDATE SKIP LOCKED，重新平衡期間範圍重疊也不會重複發送
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_, select, update
+from config import Config
+from leader import default_holder_id
+from models import Session, Event, SchedulerLease, SHARD_BUCKETS, tz, to_local_naive
+
+logger = logging.getLogger(__name__)
+
+# 動態分片成員在 scheduler_leases 中的名稱前綴
+MEMBER_PREFIX = 'shard-member:'
+
+
+def bucket_range(shard_index, shard_count):
+    """分片負責的雜湊桶範圍 [lo, hi)"""
+    return (
+        shard_index * SHARD_BUCKETS // shard_count,
+        (shard_index + 1) * SHARD_BUCKETS // shard_count
+    )
+
+
+class ShardMembership:
+    """
+    分片成員資格
+    固定模式：由 Config.SCHEDULER_SHARD_COUNT / SCHEDULER_SHARD_INDEX 指定負責的分片
+    動態模式（SCHEDULER_SHARD_INDEX < 0）：每個行程以心跳維持一列成員租約，依存活成員排序決定分片，
+    成員離開後租約過期，其餘成員自動重新平衡
+    """
+
+    def __init__(self, shard_count=None, shard_index=None, ttl_seconds=None, holder=None, on_elected=None):
+        self.holder = holder or default_holder_id()
+        self.ttl = timedelta(seconds=ttl_seconds or Config.SCHEDULER_LEASE_SECONDS)
+        self.on_elected = on_elected
+        shard_count = shard_count or Config.SCHEDULER_SHARD_COUNT
+        shard_index = Config.SCHEDULER_SHARD_INDEX if shard_index is None else shard_index
+        self.dynamic = shard_index < 0
+        self._range = None if self.dynamic else bucket_range(shard_index, shard_count)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def member_name(self):
+        return f"{MEMBER_PREFIX}{self.holder}"
+
+    @property
+    def is_active(self):
+        """目前是否負責任何分片"""
+        return self._range is not None
+
+    def bucket_range(self):
+        """目前負責的雜湊桶範圍 [lo, hi)"""
+        return self._range
+
+    def event_criteria(self):
+        """只屬於本分片的事件過濾條件"""
+        if self._range is None:
+            return [Event.id.is_(None)]
+        lo, hi = self._range
+        return [Event.shard_key >= lo, Event.shard_key < hi]
+
+    def owns(self, shard_key):
+        """事件是否屬於本分片"""
+        if self._range is None:
+            return False
+        lo, hi = self._range
+        return lo <= shard_key < hi
+
+    def refresh(self):
+        """續約成員租約並依存活成員重新計算負責的分片"""
+        if not self.dynamic:
+            return self._range
+
+        now = to_local_naive(datetime.now(tz))
+        session = Session()
+        try:
+            result = session.execute(
+                update(SchedulerLease)
+                .where(SchedulerLease.name == self.member_name)
+                .values(holder=self.holder, expires_at=now + self.ttl)
+            )
+            if result.rowcount == 0:
+                session.add(SchedulerLease(name=self.member_name, holder=self.holder, expires_at=now + self.ttl))
+            session.commit()
+
+            members = [row.name for row in session.query(SchedulerLease.name).filter(
+                SchedulerLease.name.like(f"{MEMBER_PREFIX}%"),
+                SchedulerLease.expires_at >= now
+            ).order_by(SchedulerLease.name)]
+        except Exception as e:
+            logger.error(f"[分片] 續約成員租約失敗: {e}")
+            session.rollback()
+            return self._range
+        finally:
+            session.close()
+
+        new_range = None
+        if self.member_name in members:
+            new_range = bucket_range(members.index(self.member_name), len(members))
+        if new_range != self._range:
+            logger.info(f"[分片] 重新平衡: 成員 {len(members)} 個，負責雜湊桶 {new_range}")
+            self._range = new_range
+            if new_range is not None and self.on_elected:
+                self.on_elected()
+        return self._range
+
+    def start(self):
+        """啟動心跳執行緒"""
+        self.refresh()
+        if not self.dynamic:
+            return
+        self._thread = threading.Thread(target=self._heartbeat, name='shard-membership', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止心跳並移除成員租約，讓其他成員立即重新平衡"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        if not self.dynamic:
+            return
+        session = Session()
+        try:
+            session.query(SchedulerLease).filter(
+                SchedulerLease.name == self.member_name
+            ).delete(synchronize_session=False)
+            session.commit()
+        except Exception as e:
+            logger.error(f"[分片] 移除成員租約失敗: {e}")
+            session.rollback()
+        finally:
+            session.close()
+            self._range = None
+
+    def _heartbeat(self):
+        interval = self.ttl.total_seconds() / 3
+        while not self._stopped.wait(interval):
+            self.refresh()
+
+
+def claim_due_events(session, holder, shard_range, now, columns=(Event,)):
+    """
+    領取分片內已到期且未被其他行程領取的事件
+
+    Args:
+        session: 資料庫 Session
+        holder: 行程識別字串
+        shard_range: 雜湊桶範圍 (lo, hi)
+        now: 有時區的目前時間
+        columns: 要取回的欄位（預設為完整的 Event）
+
+    Returns:
+        Query: 本行程領取到的事件（依 remind_level、event_epoch 排序，以 yield_per 串流取回）
+    """
+    lo, hi = shard_range
+    now_epoch = now.timestamp()
+    now = to_local_naive(now)
+    claimable = and_(
+        Event.next_fire_epoch <= now_epoch,
+        Event.shard_key >= lo,
+        Event.shard_key < hi,
+        or_(Event.claimed_until.is_(None), Event.claimed_until < now)
+    )
+    claim = update(Event).values(
+        claimed_by=holder,
+        claimed_until=now + timedelta(seconds=Config.SCHEDULER_CLAIM_SECONDS)
+    ).execution_options(synchronize_session=False)
+
+    if session.get_bind().dialect.name == 'postgresql':
+        # 其他行程正在領取的列直接略過，不等待鎖
+        ids = select(Event.id).where(claimable).with_for_update(skip_locked=True)
+        session.execute(claim.where(Event.id.in_(ids.scalar_subquery())))
+    else:
+        # 條件式 UPDATE 本身即為原子領取（SQLite 寫入為序列化）
+        session.execute(claim.where(claimable))
+    session.commit()
+
+    return session.query(*columns).filter(
+        Event.claimed_by == holder,
+        Event.claimed_until >= now
+    ).order_by(Event.remind_level, Event.event_epoch).execution_options(yield_per=Config.QUERY_YIELD_PER)
+
+
+def release_claims(session, holder):
+    """釋放本行程領取的事件（發送失敗的事件可在下次檢查重試）"""
+    try:
+        session.execute(
+            update(Event)
+            .where(Event.claimed_by == holder)
+            .values(claimed_by=None, claimed_until=None)
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+    except Exception as e:
+        logger.error(f"[分片] 釋放領取的事件失敗: {e}")
+        session.rollback()
@@ -1,11 +1,118 @@
 """
 測試腳本 - 用於測試指令解析和時間處理邏輯
 """
+from contextlib import contextmanager
 from datetime import datetime
 import pytz
 from utils import parse_command, format_datetime, get_remind_message
 
 
+def _start_stub_https_server(certfile, keyfile):
+    """啟動本機 HTTPS 測試伺服器，記錄每個請求使用的連線"""
+    import ssl
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    
+    connections = []
+    
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            connections.append(self.client_address)
+            body = b'{}'
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, format, *args):
+            pass
+    
+    server = ThreadingHTTPServer(('localhost', 0), StubHandler)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile, keyfile)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, connections
+
+
+def _write_self_signed_cert(directory):
+    """產生本機測試用的自簽憑證"""
+    import os
+    from datetime import timedelta
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+    
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'localhost')])
+    now = datetime.now(pytz.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(minutes=1))
+        .not_valid_after(now + timedelta(hours=1))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName('localhost')]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    with open(certfile, 'wb') as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(keyfile, 'wb') as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption()
+        ))
+    return certfile, keyfile
+
+
+@contextmanager
+def _isolated_environ(**env):
+    """暫時設定環境變數（spawn 子行程會繼承），結束後還原"""
+    import os
+    saved = dict(os.environ)
+    os.environ.update(env)
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+
+def _run_isolated(target, *args, database_path=None, **env):
+    """
+    在 spawn 子行程中執行 target(result_path, *args)，回傳子行程寫入的 JSON 結果
+    
+    子行程使用暫存的 SQLite 資料庫（避免沿用本行程已載入的資料庫設定），結束後還原環境變數；
+    子行程沒有寫入結果時回傳 None
+    """
+    import json
+    import os
+    import tempfile
+    import multiprocessing
+    
+    with tempfile.TemporaryDirectory() as directory:
+        database_path = database_path or os.path.join(directory, 'test.db')
+        result_path = os.path.join(directory, 'result.json')
+        with _isolated_environ(DATABASE_URL=f"sqlite:///{database_path}", **env):
+            process = multiprocessing.get_context('spawn').Process(target=target, args=(result_path, *args))
+            process.start()
+            process.join()
+        if not os.path.exists(result_path):
+            return None
+        with open(result_path) as f:
+            return json.load(f)
+
+
 def test_parse_command():
     """測試指令解析功能"""
     print("=" * 60)
@@ -32,6 +139,163 @@ def test_parse_command():
             print(f"解析失敗")
 
 
+def test_command_grammar():
+    """測試指令文法：單次比對判斷指令種類，以及相對時間的新增指令"""
+    from commands import parse_message
+    
+    print("\n" + "=" * 60)
+    print("測試指令文法")
+    print("=" * 60)
+    
+    tz = pytz.timezone('Asia/Taipei')
+    now = tz.localize(datetime(2026, 1, 28, 10, 15, 30))
+    test_cases = [
+        # (輸入, 預期的指令種類, 預期的解析結果：事件時間、True 表示成功、None 表示格式錯誤或時間已過)
+        ("/+30m 倒垃圾", 'add', datetime(2026, 1, 28, 10, 45)),
+        ("/+2h 開會", 'add', datetime(2026, 1, 28, 12, 15)),
+        ("/tomorrow 09:00 早會", 'add', datetime(2026, 1, 29, 9, 0)),
+        ("/2027-02-01 08:00 出差", 'add', datetime(2027, 2, 1, 8, 0)),
+        ("/2025-02-01 08:00 已過去", 'add', None),
+        ("/01-27 08:00 同月已過", 'add', None),
+        ("/list 2", 'list', True),
+        ("/rm all", 'remove', True),
+        ("/listx", 'list', None),
+        ("隨便聊天", None, None),
+    ]
+    
+    for test_input, expected_kind, expected in test_cases:
+        kind, parsed = parse_message(test_input, now)
+        if isinstance(expected, datetime):
+            result = parsed['event_datetime'].replace(tzinfo=None) if parsed else None
+        else:
+            result = True if parsed else None
+        print(f"\n輸入: {test_input} → {kind} {result}")
+        if kind == expected_kind and result == expected:
+            print("✅ 正確")
+        else:
+            print(f"❌ 錯誤：預期 {expected_kind} {expected}")
+
+
+def test_command_timezones():
+    """測試新增指令的時間換算與 tz.localize 一致（包含日光節約與負日光節約時間的時區切換）"""
+    from datetime import timedelta
+    import commands
+    
+    print("\n" + "=" * 60)
+    print("測試指令時區換算")
+    print("=" * 60)
+    
+    original = commands.tz
+    try:
+        for zone in ('Asia/Taipei', 'America/New_York', 'Australia/Lord_Howe', 'Africa/Casablanca'):
+            tz = commands.tz = pytz.timezone(zone)
+            mismatches = []
+            # 目前時間分別在一般時間與日光節約（或齋戒月）期間，UTC 偏移不同
+            for now in (tz.localize(datetime(2026, 1, 1)), tz.localize(datetime(2026, 6, 1))):
+                local = now.replace(tzinfo=None)
+                while local < datetime(2027, 1, 1):
+                    local += timedelta(minutes=30)
+                    _, parsed = commands.parse_message(f"/{local.strftime('%Y-%m-%d %H:%M')} 時區", now)
+                    expected = tz.localize(local)
+                    if expected > now and (parsed is None or parsed['event_datetime'].utcoffset() != expected.utcoffset()):
+                        mismatches.append(local)
+            print(f"\n{zone}: {len(mismatches)} 個時間不一致")
+            print("✅ 正確" if not mismatches else f"❌ 錯誤：例如 {mismatches[0]}")
+    finally:
+        commands.tz = original
+
+
+def test_parse_remove_command():
+    """測試刪除指令解析（單一行程、整天、全部）"""
+    from utils import parse_remove_command
+    
+    print("\n" + "=" * 60)
+    print("測試刪除指令解析")
+    print("=" * 60)
+    
+    test_cases = [
+        # (輸入, 預期的 scope，None 表示解析失敗)
+        ("/rm 01-28 14:30 專案週會", 'event'),
+        ("/rm 01-28", 'day'),
+        ("/rm all", 'all'),
+        ("/rm ALL", 'all'),
+        ("/rm 01-28 14:30", None),
+        ("/rm 13-45", None),
+        ("/rm", None),
+    ]
+    
+    for test_input, expected in test_cases:
+        result = parse_remove_command(test_input)
+        scope = result['scope'] if result else None
+        print(f"\n輸入: {test_input} → {scope}")
+        if scope == expected:
+            print("✅ 正確")
+        else:
+            print(f"❌ 錯誤：預期 {expected}")
+
+
+def test_list_messages():
+    """測試清單指令解析與分頁訊息切分"""
+    from utils import parse_list_command, get_list_messages, LIST_MESSAGE_MAX_CHARS
+    
+    print("\n" + "=" * 60)
+    print("測試清單分頁")
+    print("=" * 60)
+    
+    test_cases = [
+        # (輸入, 預期的 (頁數, 游標)，None 表示解析失敗)
+        ("/list", (1, None)),
+        ("/list 3", (3, None)),
+        ("/list 01-28", (1, None)),
+        ("/list 01-28 2", (2, None)),
+        ("/list 2 @1769581800.42", (2, (1769581800, 42))),
+        ("/list 01-28 2 @1769581800.42", (2, (1769581800, 42))),
+        ("/list 0", None),
+        ("/list abc", None),
+        ("/list @1769581800.42", None),
+    ]
+    for test_input, expected in test_cases:
+        result = parse_list_command(test_input)
+        page = (result['page'], result['after']) if result else None
+        print(f"\n輸入: {test_input} → {page}")
+        print("✅ 正確" if page == expected else f"❌ 錯誤：預期 {expected}")
+    
+    rows = [(datetime(2026, 1, 28, 14, 30), 0, "很長的描述" * 100)] * 20
+    messages = get_list_messages("📋 目前有 20 個行程：", rows, 1, "👉 下一頁：/list 2")
+    print(f"\n20 個長描述事件 → {len(messages)} 則訊息，最長 {max(len(m) for m in messages)} 字元")
+    if 1 < len(messages) <= 5 and all(len(m) <= LIST_MESSAGE_MAX_CHARS for m in messages) and messages[-1].endswith("/list 2"):
+        print("✅ 正確")
+    else:
+        print("❌ 錯誤：訊息數量或長度超過上限")
+
+
+def test_list_cache():
+    """測試 /list 快取的版本判斷、LRU 淘汰與命中率"""
+    from list_cache import ListPageCache
+    
+    print("\n" + "=" * 60)
+    print("測試清單快取")
+    print("=" * 60)
+    
+    cache = ListPageCache(maxsize=2, ttl_seconds=60)
+    cache.put('group_a', (None, 1), 1, ["第 1 頁"])
+    cache.put('group_b', (None, 1), 1, ["第 1 頁"])
+    results = [cache.get('group_a', (None, 1), 1) == ["第 1 頁"]]  # 相同版本命中
+    cache.put('group_c', (None, 1), 1, ["第 1 頁"])                # 超過容量，淘汰最久未使用的 group_b
+    results += [
+        cache.get('group_b', (None, 1), 1) is None,
+        cache.get('group_a', (None, 1), 1) is not None,
+        cache.get('group_a', (None, 1), 2) is None,                # 其他 worker 已遞增版本
+    ]
+    
+    stats = cache.stats()
+    print(f"\n{stats}")
+    if all(results) and stats['hit_ratio'] == 0.5:
+        print("✅ 正確")
+    else:
+        print(f"❌ 錯誤：{results}")
+
+
 def test_year_logic():
     """測試年份處理邏輯"""
     print("\n" + "=" * 60)
@@ -110,15 +374,1078 @@ def test_time_validation():
         print("❌ 錯誤：未來的時間應該被接受（或者日期設定有問題）")
 
 
+def test_line_client_connection_reuse():
+    """測試 LINE 用戶端重複使用 keep-alive 連線"""
+    import tempfile
+    from line_client import LineClient, text_message
+    
+    print("\n" + "=" * 60)
+    print("測試 LINE 用戶端連線重用")
+    print("=" * 60)
+    
+    with tempfile.TemporaryDirectory() as directory:
+        certfile, keyfile = _write_self_signed_cert(directory)
+        server, connections = _start_stub_https_server(certfile, keyfile)
+        try:
+            client = LineClient(
+                access_token='test-token',
+                base_url=f"https://localhost:{server.server_address[1]}",
+                verify=certfile
+            )
+            for i in range(5):
+                client.push('test_group_123', [text_message(f"推播 {i}")])
+                client.reply(f"reply-token-{i}", [text_message(f"回覆 {i}")])
+            client.close()
+        finally:
+            server.shutdown()
+    
+    distinct = len(set(connections))
+    print(f"\n請求數: {len(connections)}，使用的連線數: {distinct}")
+    if distinct == 1:
+        print("✅ 正確：所有請求共用同一條連線")
+    else:
+        print("❌ 錯誤：請求沒有重複使用連線")
+
+
+def test_rate_limiter():
+    """測試令牌桶速率限制的優先順序與 Retry-After 暫停"""
+    import threading
+    import time
+    from rate_limit import PRIORITY_HIGH, PRIORITY_LOW, TokenBucket, parse_retry_after
+    
+    print("\n" + "=" * 60)
+    print("測試 LINE API 速率限制")
+    print("=" * 60)
+    
+    # 桶已用完時同時排隊，高優先順序的請求應該先取得令牌
+    bucket = TokenBucket(rate=20, burst=1)
+    bucket.acquire()
+    order = []
+    threads = [
+        threading.Thread(target=lambda p=p: (bucket.acquire(p), order.append(p)))
+        for p in [PRIORITY_LOW] * 5 + [PRIORITY_HIGH] * 5
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"\n取得令牌的順序: {order}")
+    if order == sorted(order):
+        print("✅ 正確：「時間到」與回覆優先於 24 小時提醒")
+    else:
+        print("❌ 錯誤：低優先順序的請求插隊")
+    
+    # 收到 429 後整個桶暫停 Retry-After 秒
+    bucket.pause(parse_retry_after('0.5'))
+    started = time.monotonic()
+    bucket.acquire(PRIORITY_HIGH)
+    waited = time.monotonic() - started
+    print(f"Retry-After 0.5 秒後等待: {waited:.2f} 秒")
+    if waited >= 0.45:
+        print("✅ 正確：限流期間暫停發送")
+    else:
+        print("❌ 錯誤：沒有遵守 Retry-After")
+    print(f"節流統計: {bucket.stats()['priorities']}")
+
+
+def test_circuit_breaker():
+    """測試斷路器 closed → open → half-open → closed"""
+    import time
+    from circuit_breaker import CircuitBreaker, CircuitOpenError
+    
+    print("\n" + "=" * 60)
+    print("測試 LINE API 斷路器")
+    print("=" * 60)
+    
+    breaker = CircuitBreaker('test', failure_threshold=3, reset_seconds=0.2)
+    states = [breaker.state]
+    for _ in range(3):
+        breaker.before_call()
+        breaker.record_failure(TimeoutError('逾時'))
+    states.append(breaker.state)
+    try:
+        breaker.before_call()
+        states.append('放行')
+    except CircuitOpenError:
+        states.append('拒絕')
+    time.sleep(0.25)
+    states.append(breaker.state)
+    breaker.before_call()  # 試探請求
+    breaker.record_success()
+    states.append(breaker.state)
+    
+    print(f"\n狀態變化: {states}")
+    if states == ['closed', 'open', '拒絕', 'half_open', 'closed']:
+        print("✅ 正確：開啟期間直接拒絕，試探成功後恢復")
+    else:
+        print("❌ 錯誤：斷路器狀態不正確")
+
+
+def test_missed_reminders():
+    """測試停機期間錯過的提醒時間窗計算"""
+    from datetime import timedelta
+    from models import to_epoch
+    from scheduler import missed_reminders
+    
+    print("\n" + "=" * 60)
+    print("測試停機補發")
+    print("=" * 60)
+    
+    now = datetime(2025, 1, 28, 12, 0)
+    since = now - timedelta(hours=1)  # 停機 1 小時
+    test_cases = [
+        # (remind_level, 事件時間, 預期錯過的提醒, 預期新等級)
+        (1, now + timedelta(minutes=20), [60, 30], 3),   # 停機期間錯過 1 小時與 30 分鐘提醒
+        (2, now + timedelta(minutes=30), [], 2),         # 30 分鐘提醒時間窗仍開啟，交給一般檢查
+        (3, now - timedelta(minutes=30), [0], 4),        # 停機期間錯過「時間到」
+        (0, now + timedelta(minutes=10), [60, 30], 3),   # 1 天前提醒在停機前就已來不及，不算錯過
+    ]
+    
+    for level, event_datetime, expected_missed, expected_level in test_cases:
+        missed, new_level = missed_reminders(level, to_epoch(event_datetime), to_epoch(since), to_epoch(now))
+        print(f"\n等級 {level}，事件 {event_datetime.strftime('%H:%M')}: 錯過 {missed}，新等級 {new_level}")
+        if missed == expected_missed and new_level == expected_level:
+            print("✅ 正確")
+        else:
+            print(f"❌ 錯誤：預期錯過 {expected_missed}，新等級 {expected_level}")
+
+
+def test_tick_engine():
+    """測試欄位式狀態機與 evaluate_event 的結果一致（邊界值與隨機值）"""
+    import random
+    from scheduler import evaluate_event
+    from tick_engine import STATE_TABLE, ColumnBatch, classify, plan
+    
+    print("\n" + "=" * 60)
+    print("測試欄位式狀態機")
+    print("=" * 60)
+    
+    now_epoch = 1738000000
+    offsets = set(random.Random(17).sample(range(-100000, 100000), 5000))
+    for bounds in STATE_TABLE.values():
+        for bound, _ in bounds:
+            offsets.update((bound - 1, bound, bound + 1))
+    offsets.update((-86401, -86400, -86399, 0))
+    
+    rows = sorted(
+        ((len(offsets) * level + i, i % 7, now_epoch + seconds_left, level)
+         for level in range(6) for i, seconds_left in enumerate(sorted(offsets))),
+        key=lambda row: (row[3], row[2])
+    )
+    expected = {row[0]: evaluate_event(row[3], (row[2] - now_epoch) / 60) for row in rows}
+    
+    mismatches = [row for row in rows if classify(row[3], row[2] - now_epoch) != expected[row[0]]]
+    batch = ColumnBatch(rows)
+    for result, ranges in plan(batch, now_epoch).items():
+        for lo, hi in ranges:
+            mismatches.extend(row for row in rows[lo:hi] if expected[row[0]] != result)
+    
+    print(f"\n比對 {len(rows)} 個事件")
+    if mismatches:
+        print(f"❌ 錯誤：{len(mismatches)} 個結果不一致，例如 {mismatches[0]}")
+    else:
+        print("✅ 正確")
+
+
+def _run_push_expiry(result_path):
+    """子行程：排入即將關閉時間窗的提醒，等時間窗關閉（模擬 LINE API 中斷）後再發送"""
+    import json
+    import time
+    from datetime import timedelta
+    from models import Session, Event, OutboxMessage, create_group, from_epoch, init_database
+    import scheduler
+    from outbox import OutboxDispatcher
+    
+    sent = []
+    
+    class FakeClient:
+        def push(self, to, messages, retry_key=None, priority=None):
+            sent.extend(message['text'].splitlines()[-1] for message in messages)
+    
+    init_database()
+    group_key = create_group("test_group_expiry")
+    now = datetime.now(pytz.timezone('Asia/Taipei'))
+    session = Session()
+    session.add_all([
+        # 60 分鐘提醒的時間窗在 5 秒後關閉
+        Event(group_key=group_key, event_datetime=now + timedelta(minutes=58, seconds=5), description="即將過時", remind_level=1),
+        Event(group_key=group_key, event_datetime=now + timedelta(days=1), description="明天的事件", remind_level=0),
+    ])
+    session.commit()
+    scheduler.check_and_send_reminders()
+    pushes = session.query(OutboxMessage.priority, OutboxMessage.expires_at).order_by(OutboxMessage.priority).all()
+    events = dict(session.query(Event.description, Event.event_epoch).all())
+    time.sleep(6)
+    dispatcher = OutboxDispatcher(client=FakeClient(), concurrency=1)
+    dispatcher.drain_once()
+    dispatcher.shutdown()
+    dead = [row.last_error for row in session.query(OutboxMessage.last_error).filter(OutboxMessage.status == 'dead')]
+    session.close()
+    with open(result_path, 'w') as f:
+        json.dump({
+            'expires': [expires_at.isoformat() for _, expires_at in pushes],
+            'expected': [
+                from_epoch(events["即將過時"] - 58 * 60).isoformat(),
+                from_epoch(events["明天的事件"] - 1430 * 60).isoformat(),
+            ],
+            'sent': sent,
+            'dead': dead,
+        }, f, ensure_ascii=False)
+
+
+def test_push_expiry():
+    """測試提醒推播在時間窗關閉後過期：LINE API 恢復後不送出過時的提醒"""
+    print("\n" + "=" * 60)
+    print("測試提醒推播過期")
+    print("=" * 60)
+    
+    result = _run_isolated(_run_push_expiry)
+    
+    print(f"\n推播過期時間: {result['expires']}")
+    if result['expires'] == result['expected']:
+        print("✅ 正確：不同提醒類型分開推播，各自在時間窗關閉時過期")
+    else:
+        print(f"❌ 錯誤：預期 {result['expected']}")
+    print(f"時間窗關閉後發送: {result['sent']}，放棄 {result['dead']}")
+    if len(result['sent']) == 1 and result['sent'][0].endswith("明天的事件") and result['dead'] == ["提醒時間窗已關閉"]:
+        print("✅ 正確：過時的提醒不再發送")
+    else:
+        print("❌ 錯誤：過時的提醒仍被發送")
+
+
+def _run_leader_lease(result_path):
+    """子行程：兩個行程競爭租約，記錄取得、到期接手、fence 與釋放後接手的結果"""
+    import json
+    import time
+    from datetime import timedelta
+    from models import Session, Event, OutboxMessage, create_group, init_database
+    from leader import LeaderLease
+    import scheduler
+    
+    init_database()
+    group_key = create_group("test_group_lease")
+    session = Session()
+    session.add(Event(
+        group_key=group_key,
+        event_datetime=datetime.now(pytz.timezone('Asia/Taipei')) + timedelta(minutes=1),
+        description="租約測試",
+        remind_level=3
+    ))
+    session.commit()
+    
+    def state():
+        return [session.query(Event.remind_level).scalar(), session.query(OutboxMessage).count()]
+    
+    a = LeaderLease(ttl_seconds=1, holder='worker-a')
+    b = LeaderLease(ttl_seconds=1, holder='worker-b')
+    result = {'acquire': [a.try_acquire(), b.try_acquire(), a.try_acquire()]}
+    # worker-a 停止心跳（例如長時間的檢查），租約到期後由 worker-b 接手
+    time.sleep(1.2)
+    result['takeover'] = [b.try_acquire(), a.try_acquire()]
+    # worker-a 仍以為自己是領導者並完成檢查：提交前的 fence 失敗，不寫入任何變更
+    a.is_leader = True
+    scheduler.check_and_send_reminders(lease=a)
+    result['stale'] = state() + [a.is_leader]
+    scheduler.check_and_send_reminders(lease=b)
+    session.expire_all()
+    result['leader'] = state()
+    # worker-b 正常結束時釋放租約，worker-a 不需要等待到期即可接手
+    b.release()
+    result['failover'] = [a.try_acquire(), b.is_leader]
+    session.close()
+    with open(result_path, 'w') as f:
+        json.dump(result, f)
+
+
+def test_leader_lease():
+    """測試領導者租約：取得、到期接手、失去租約後不提交、釋放後立即接手"""
+    print("\n" + "=" * 60)
+    print("測試排程領導者租約")
+    print("=" * 60)
+    
+    result = _run_isolated(_run_leader_lease)
+    
+    checks = [
+        ("取得租約：只有一個行程成為領導者，持有者可以續約", result['acquire'] == [True, False, True]),
+        ("到期接手：租約到期後由其他行程接手，舊領導者無法續約", result['takeover'] == [True, False]),
+        ("fence：失去租約的舊領導者不提交狀態變更與推播", result['stale'] == [3, 0, False]),
+        ("新領導者正常提交", result['leader'] == [4, 1]),
+        ("釋放租約後其他行程立即接手", result['failover'] == [True, False]),
+    ]
+    print(f"\n{result}")
+    for name, passed in checks:
+        print(f"✅ 正確：{name}" if passed else f"❌ 錯誤：{name}")
+
+
+def _run_shard_catch_up(result_path):
+    """子行程：單一分片記錄檢查紀錄後停機，重新平衡成兩個分片，由新的負責者執行補發檢查"""
+    import json
+    from datetime import timedelta
+    from sqlalchemy import delete, update
+    from models import Session, Event, Group, OutboxMessage, SchedulerCheckpoint, init_database, to_local_naive
+    import scheduler
+    from sharding import ShardMembership
+    
+    init_database()
+    now = datetime.now(pytz.timezone('Asia/Taipei'))
+    session = Session()
+    # 群組鍵 5 在前半段雜湊桶，600 與 700 在後半段
+    session.add_all([Group(id=group_key, line_id=f"test_group_{group_key}", list_version=0) for group_key in (5, 600, 700)])
+    session.commit()
+    
+    scheduler.check_and_send_reminders(shard=ShardMembership(shard_count=1, shard_index=0, holder='worker-a'))
+    # 停機 2 小時：停機前建立的事件在停機期間錯過 60 分鐘提醒；雜湊桶 700 從未被檢查過
+    session.execute(update(SchedulerCheckpoint).values(last_tick_at=to_local_naive(now - timedelta(hours=2))))
+    session.execute(delete(SchedulerCheckpoint).where(SchedulerCheckpoint.name == scheduler.bucket_checkpoint_name(700)))
+    session.add_all([
+        Event(group_key=group_key, event_datetime=now + timedelta(minutes=20), description=f"補發 {group_key}",
+              remind_level=1, created_at=datetime.now() - timedelta(hours=3))
+        for group_key in (5, 600, 700)
+    ])
+    session.commit()
+    
+    checkpoints = session.query(SchedulerCheckpoint).count()
+    shard = ShardMembership(shard_count=2, shard_index=1, holder='worker-b')
+    missed = scheduler.catch_up_missed_reminders(shard=shard, policy='digest')
+    session.expire_all()
+    result = {
+        'checkpoints': checkpoints,
+        'missed': missed,
+        'levels': {row.description: row.remind_level for row in session.query(Event.description, Event.remind_level)},
+        'pushes': [row.target for row in session.query(OutboxMessage.target)],
+    }
+    session.close()
+    with open(result_path, 'w') as f:
+        json.dump(result, f, ensure_ascii=False)
+
+
+def test_shard_catch_up():
+    """測試分片重新平衡後的補發檢查：新的負責者依雜湊桶的檢查紀錄找出錯過的提醒"""
+    print("\n" + "=" * 60)
+    print("測試分片補發檢查")
+    print("=" * 60)
+    
+    result = _run_isolated(_run_shard_catch_up)
+    
+    print(f"\n{result}")
+    if result['checkpoints'] == 1023 and result['missed'] == 1 and result['pushes'] == ["test_group_600"]:
+        print("✅ 正確：重新平衡後沿用雜湊桶的檢查紀錄，補發新分片內錯過的提醒")
+    else:
+        print("❌ 錯誤：補發的事件或摘要不正確")
+    if result['levels'] == {"補發 5": 1, "補發 600": 3, "補發 700": 1}:
+        print("✅ 正確：其他分片與沒有檢查紀錄的雜湊桶不受影響")
+    else:
+        print("❌ 錯誤：事件等級不正確")
+
+
+def _run_shard_worker(shard_index, shard_count, holder, sent_path):
+    """子行程：以指定分片執行一次提醒檢查並送出 outbox，將發送的訊息寫入檔案"""
+    import time
+    import scheduler
+    from outbox import OutboxDispatcher
+    from sharding import ShardMembership
+    
+    class FakeClient:
+        def push(self, to, messages, retry_key=None, priority=None):
+            time.sleep(0.02)  # 模擬 LINE API 延遲
+            with open(sent_path, 'a') as f:
+                for message in messages:
+                    f.write(message['text'].splitlines()[-1] + "\n")
+    
+    shard = ShardMembership(shard_count=shard_count, shard_index=shard_index, holder=holder)
+    dispatcher = OutboxDispatcher(client=FakeClient(), concurrency=1)
+    started = time.perf_counter()
+    scheduler.check_and_send_reminders(shard=shard)
+    while dispatcher.drain_once():
+        pass
+    dispatcher.shutdown()
+    with open(f"{sent_path}.time", 'a') as f:
+        f.write(f"{time.perf_counter() - started}\n")
+
+
+def test_sharded_scheduler():
+    """測試多行程分片排程不會重複發送"""
+    import os
+    import tempfile
+    import multiprocessing
+    
+    print("\n" + "=" * 60)
+    print("測試多行程分片排程")
+    print("=" * 60)
+    
+    def run(directory, name, assignments):
+        db_path = os.path.join(directory, f"{name}.db")
+        sent_path = os.path.join(directory, f"{name}.txt")
+        
+        # 在子行程中建立資料表與測試事件（避免沿用本行程已載入的資料庫設定）
+        with _isolated_environ(DATABASE_URL=f"sqlite:///{db_path}", PUSH_CONCURRENCY='1'):
+            ctx = multiprocessing.get_context('spawn')
+            setup = ctx.Process(target=_create_due_events, args=(400, 200))
+            setup.start()
+            setup.join()
+            
+            processes = [
+                ctx.Process(target=_run_shard_worker, args=(index, count, f"{name}-{i}", sent_path))
+                for i, (index, count) in enumerate(assignments)
+            ]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+        
+        with open(sent_path) as f:
+            sent = [line.strip() for line in f if line.strip()]
+        # 以最慢的分片檢查時間代表整體發送時間（不含子行程啟動時間）
+        with open(f"{sent_path}.time") as f:
+            elapsed = max(float(line) for line in f if line.strip())
+        return len(sent), len(set(sent)), elapsed
+    
+    with tempfile.TemporaryDirectory() as directory:
+        cases = [
+            ("1 個分片", [(0, 1)]),
+            ("4 個分片", [(i, 4) for i in range(4)]),
+            ("4 個行程負責同一範圍（模擬重新平衡）", [(0, 1)] * 4),
+        ]
+        for name, assignments in cases:
+            total, distinct, elapsed = run(directory, f"case{len(assignments)}{assignments[-1][1]}", assignments)
+            print(f"\n{name}: 發送 {total} 則，不重複 {distinct} 則，最慢分片耗時 {elapsed:.2f} 秒")
+            if total == distinct == 400:
+                print("✅ 正確：每個提醒只發送一次")
+            else:
+                print("❌ 錯誤：提醒重複或遺漏")
+
+
+def _run_webhook_queue(result_path):
+    """子行程：工作執行緒處理中且佇列已滿時送出 webhook，記錄 HTTP 狀態碼"""
+    import base64
+    import hashlib
+    import hmac
+    import json
+    import threading
+    import app
+    from webhook_queue import WebhookQueue
+    
+    release = threading.Event()
+    started = threading.Event()
+    
+    def handler(event_data):
+        started.set()
+        release.wait(10)
+    
+    # 1 個工作執行緒、容量 1：第一個請求處理中、第二個在佇列中，第三個應被拒絕
+    app.event_queue = WebhookQueue(handler, maxsize=1, workers=1)
+    client = app.app.test_client()
+    statuses = []
+    for i in range(3):
+        body = json.dumps({'events': [{'type': 'message', 'webhookEventId': f"queue-{i}"}]})
+        signature = base64.b64encode(
+            hmac.new(app.Config.LINE_CHANNEL_SECRET.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
+        ).decode('utf-8')
+        statuses.append(client.post('/webhook', data=body, headers={'X-Line-Signature': signature}).status_code)
+        if i == 0:
+            started.wait(5)
+    release.set()
+    with open(result_path, 'w') as f:
+        json.dump({'statuses': statuses, 'stats': app.event_queue.stats()}, f)
+
+
+def test_webhook_queue():
+    """測試 webhook 佇列已滿時回應 503（LINE 會稍後重送），未滿時立即回應 200"""
+    import os
+    
+    print("\n" + "=" * 60)
+    print("測試 Webhook 佇列")
+    print("=" * 60)
+    
+    result = _run_isolated(
+        _run_webhook_queue,
+        LINE_CHANNEL_SECRET=os.environ.get('LINE_CHANNEL_SECRET', 'test-channel-secret')
+    )
+    
+    stats = result['stats']
+    print(f"\n狀態碼: {result['statuses']}，拒絕 {stats['rejected']} 個請求")
+    if result['statuses'] == [200, 200, 503] and stats['rejected'] == 1 and stats['enqueued'] == 2:
+        print("✅ 正確：佇列已滿時回應 503")
+    else:
+        print(f"❌ 錯誤：{result}")
+
+
+def test_webhook_queue_shutdown():
+    """測試行程結束時停止接收 webhook，並在時限內處理完佇列中的事件"""
+    import threading
+    import time
+    from webhook_queue import WebhookQueue
+    
+    print("\n" + "=" * 60)
+    print("測試 Webhook 佇列關閉")
+    print("=" * 60)
+    
+    handled = []
+    webhook_queue = WebhookQueue(lambda event: (time.sleep(0.1), handled.append(event)), maxsize=10, workers=1)
+    for i in range(3):
+        webhook_queue.submit([f"event-{i}"])
+    pending = webhook_queue.shutdown(5)
+    accepted = webhook_queue.submit(['event-late'])
+    print(f"\n關閉後未處理: {pending}，已處理: {handled}，關閉後送出: {accepted}")
+    if pending == 0 and len(handled) == 3 and not accepted:
+        print("✅ 正確：關閉前處理完佇列，之後拒絕新的請求")
+    else:
+        print("❌ 錯誤：佇列中的事件在關閉時遺失")
+    
+    # 處理卡住時只等待到時限，回報遺失的請求數量
+    release = threading.Event()
+    webhook_queue = WebhookQueue(lambda event: release.wait(10), maxsize=10, workers=1)
+    for i in range(3):
+        webhook_queue.submit([f"event-{i}"])
+    started = time.monotonic()
+    pending = webhook_queue.shutdown(0.3)
+    waited = time.monotonic() - started
+    release.set()
+    print(f"處理卡住時等待 {waited:.2f} 秒，未處理: {pending}")
+    if pending == 3 and waited < 1:
+        print("✅ 正確：關閉等待有上限並回報遺失數量")
+    else:
+        print("❌ 錯誤：關閉等待沒有上限或數量不正確")
+
+
+def _run_webhook_dedup(result_path):
+    """子行程：兩個 worker（各自的記憶體快取）收到同一個 webhookEventId，記錄各自是否處理"""
+    import json
+    from models import Session, ProcessedWebhookEvent, init_database
+    from idempotency import WebhookDeduplicator
+    
+    init_database()
+    worker_a = WebhookDeduplicator(maxsize=100, ttl_seconds=3600)
+    worker_b = WebhookDeduplicator(maxsize=100, ttl_seconds=3600)
+    claims = [
+        worker_a.claim('event-1'),  # 第一次收到
+        worker_b.claim('event-1'),  # 重送到另一個 worker：由資料表判斷
+        worker_a.claim('event-1'),  # 同一個 worker 再次收到：記憶體快取判斷
+        worker_b.claim('event-2'),
+    ]
+    session = Session()
+    rows = session.query(ProcessedWebhookEvent).count()
+    session.close()
+    with open(result_path, 'w') as f:
+        json.dump({'claims': claims, 'rows': rows, 'a': worker_a.stats(), 'b': worker_b.stats()}, f)
+
+
+def test_webhook_dedup():
+    """測試 webhookEventId 去重：不同 worker 收到的重送也只處理一次"""
+    print("\n" + "=" * 60)
+    print("測試 Webhook 重送去重")
+    print("=" * 60)
+    
+    result = _run_isolated(_run_webhook_dedup)
+    
+    print(f"\n處理結果: {result['claims']}，資料表 {result['rows']} 筆")
+    if result['claims'] == [True, False, False, True] and result['rows'] == 2:
+        print("✅ 正確：重送的事件只處理一次")
+    else:
+        print(f"❌ 錯誤：{result}")
+    if result['b']['db_hits'] == 1 and result['a']['memory_hits'] == 1:
+        print("✅ 正確：其他 worker 處理過的事件由資料表判斷，同一個 worker 由記憶體快取判斷")
+    else:
+        print(f"❌ 錯誤：{result['a']} {result['b']}")
+
+
+def _run_remove_commands(result_path):
+    """子行程：以 webhook 事件新增行程後執行 /rm MM-DD 與 /rm all，記錄回覆與資料表中剩下的事件"""
+    import json
+    from datetime import timedelta
+    from models import Session, Event, Group, init_database
+    import app
+    
+    init_database()
+    replies = []
+    # 回覆訊息改為記錄下來，不呼叫 LINE API
+    app.send_reply = lambda reply_token, message: replies.append(message)
+    
+    def send(group_id, text):
+        app.handle_event({
+            'type': 'message',
+            'replyToken': 'test-reply-token',
+            'source': {'groupId': group_id},
+            'message': {'type': 'text', 'text': text},
+        })
+    
+    def remaining():
+        session = Session()
+        try:
+            rows = session.query(Group.line_id, Event.description).join(Group, Group.id == Event.group_key)
+            return sorted(f"{line_id} {description}" for line_id, description in rows)
+        finally:
+            session.close()
+    
+    now = datetime.now(pytz.timezone('Asia/Taipei'))
+    first, second = (now + timedelta(days=2)).strftime('%m-%d'), (now + timedelta(days=3)).strftime('%m-%d')
+    for group_id, text in (
+        ("group_a", f"/{first} 09:00 早會"),
+        ("group_a", f"/{first} 18:00 晚餐"),
+        ("group_a", f"/{second} 10:00 出差"),
+        ("group_b", f"/{first} 09:00 早會"),
+    ):
+        send(group_id, text)
+    result = {'created': remaining()}
+    send("group_a", f"/rm {first}")
+    result['day'] = remaining()
+    send("group_a", "/rm all")
+    result['all'] = remaining()
+    result['replies'] = replies[4:]
+    with open(result_path, 'w') as f:
+        json.dump(result, f, ensure_ascii=False)
+
+
+def test_remove_commands():
+    """測試 /rm MM-DD 與 /rm all 實際刪除資料表中的事件，且只影響同一個群組"""
+    print("\n" + "=" * 60)
+    print("測試刪除指令")
+    print("=" * 60)
+    
+    result = _run_isolated(_run_remove_commands)
+    
+    print(f"\n回覆: {result['replies']}")
+    if len(result['created']) == 4 and result['day'] == ["group_a 出差", "group_b 早會"]:
+        print("✅ 正確：/rm MM-DD 刪除群組當天的所有行程")
+    else:
+        print(f"❌ 錯誤：{result['created']} → {result['day']}")
+    if result['all'] == ["group_b 早會"]:
+        print("✅ 正確：/rm all 刪除群組所有行程，其他群組不受影響")
+    else:
+        print(f"❌ 錯誤：{result['all']}")
+    if len(result['replies']) == 2 and "2 個提醒" in result['replies'][0] and "全部 1 個提醒" in result['replies'][1]:
+        print("✅ 正確：回覆刪除的數量")
+    else:
+        print("❌ 錯誤：回覆訊息不正確")
+
+
+def _run_event_writer(result_path):
+    """子行程：多個執行緒同時送出新增事件，記錄取得的 id、資料表筆數與群組清單版本"""
+    import json
+    from concurrent.futures import ThreadPoolExecutor
+    from datetime import timedelta
+    from models import Session, Event, Group, init_database
+    from event_writer import EventWriter
+    from group_keys import GroupKeyCache
+    
+    init_database()
+    writer = EventWriter(max_batch=50, linger_seconds=0.01, group_keys=GroupKeyCache(100))
+    event_time = datetime.now(pytz.timezone('Asia/Taipei')) + timedelta(days=2)
+    with ThreadPoolExecutor(max_workers=20) as pool:
+        futures = [
+            pool.submit(lambda i: writer.submit(f"test_group_{i % 5}", event_time, f"批次寫入 {i}").result(timeout=10), i)
+            for i in range(200)
+        ]
+        ids = [future.result() for future in futures]
+    session = Session()
+    rows = session.query(Event.id, Event.description, Event.next_fire_epoch).all()
+    versions = dict(session.query(Group.line_id, Group.list_version).all())
+    session.close()
+    with open(result_path, 'w') as f:
+        json.dump({
+            'ids': ids,
+            'rows': len(rows),
+            'matched': sum(1 for row in rows if row.description == f"批次寫入 {ids.index(row.id)}"),
+            'scheduled': all(row.next_fire_epoch for row in rows),
+            'versions': versions,
+            'stats': writer.stats(),
+        }, f)
+
+
+def test_event_writer():
+    """測試批次寫入：每個指令取得自己事件的 id，多筆事件合併成較少的交易"""
+    print("\n" + "=" * 60)
+    print("測試事件批次寫入")
+    print("=" * 60)
+    
+    result = _run_isolated(_run_event_writer)
+    
+    stats = result['stats']
+    print(f"\n新增 {result['rows']} 筆，{stats['batches']} 個交易，平均每批 {stats['batch_avg']} 筆")
+    if len(set(result['ids'])) == result['rows'] == result['matched'] == 200 and result['scheduled']:
+        print("✅ 正確：每個指令取得自己事件的 id")
+    else:
+        print(f"❌ 錯誤：id 或事件內容不一致 {result}")
+    # 同一批中的群組只遞增一次版本，每個群組至少遞增一次
+    versions = result['versions']
+    if stats['batches'] < 200 and len(versions) == 5 and stats['batches'] <= sum(versions.values()) <= stats['rows']:
+        print("✅ 正確：多筆事件合併 commit，且每批都遞增群組清單版本")
+    else:
+        print(f"❌ 錯誤：批次數 {stats['batches']}，版本遞增 {result['versions']}")
+
+
+def _run_event_writer_timeout(result_path):
+    """子行程：batch 模式下寫入比等待時間慢，記錄回覆、寫入完成後的推播與事件數量"""
+    import json
+    import time
+    from datetime import timedelta
+    from models import Session, Event, OutboxMessage, init_database
+    import app
+    
+    init_database()
+    replies = []
+    app.send_reply = lambda reply_token, message: replies.append(message)
+    app.Config.EVENT_WRITE_MODE = 'batch'
+    app.Config.EVENT_WRITER_TIMEOUT_SECONDS = 0.1
+    
+    class SlowGroupKeys:
+        """取得群組鍵時延遲，讓寫入超過等待時間"""
+        def resolve(self, line_id):
+            time.sleep(0.5)
+            return app.group_keys.resolve(line_id)
+    
+    app.event_writer.group_keys = SlowGroupKeys()
+    event_time = datetime.now(pytz.timezone('Asia/Taipei')) + timedelta(days=2)
+    app.handle_event({
+        'type': 'message',
+        'replyToken': 'test-reply-token',
+        'source': {'groupId': 'test_group_timeout'},
+        'message': {'type': 'text', 'text': f"/{event_time.strftime('%m-%d')} 09:00 逾時測試"},
+    })
+    time.sleep(1)
+    session = Session()
+    result = {
+        'replies': replies,
+        'events': session.query(Event).count(),
+        'pushes': [row.payload for row in session.query(OutboxMessage.payload)],
+    }
+    session.close()
+    with open(result_path, 'w') as f:
+        json.dump(result, f, ensure_ascii=False)
+
+
+def test_event_writer_timeout():
+    """測試等待寫入逾時：回覆「稍後確認」而不是錯誤，事件仍寫入一次，完成後推播結果"""
+    print("\n" + "=" * 60)
+    print("測試事件寫入逾時")
+    print("=" * 60)
+    
+    result = _run_isolated(_run_event_writer_timeout)
+    
+    print(f"\n回覆: {result['replies']}，事件 {result['events']} 筆，推播 {len(result['pushes'])} 則")
+    if (len(result['replies']) == 1 and "稍後確認" in result['replies'][0] and result['events'] == 1
+            and len(result['pushes']) == 1 and "已設定提醒" in result['pushes'][0]):
+        print("✅ 正確：逾時時回覆稍後確認，寫入完成後推播設定結果")
+    else:
+        print(f"❌ 錯誤：{result}")
+
+
+def _run_list_paging(result_path):
+    """子行程：依清單結尾提示的指令逐頁查詢，記錄每頁的事件；中途刪除已看過的事件"""
+    import json
+    import re
+    from datetime import timedelta
+    from sqlalchemy import delete
+    from models import Session, Event, init_database
+    from group_keys import GroupKeyCache
+    from commands import parse_message
+    from app import render_list_page
+    
+    init_database()
+    group_key = GroupKeyCache(1).resolve("test_group_list")
+    base = datetime.now(pytz.timezone('Asia/Taipei')).replace(second=0, microsecond=0) + timedelta(days=2)
+    session = Session()
+    # 每兩個事件同一時間，確認游標以 (event_epoch, id) 區分
+    session.add_all([
+        Event(group_key=group_key, event_datetime=base + timedelta(minutes=i // 2), description=f"分頁 {i}", remind_level=0)
+        for i in range(45)
+    ])
+    session.commit()
+    
+    def descriptions(messages):
+        return re.findall(r'分頁 \d+', "".join(messages))
+    
+    pages, titles, command = [], [], "/list"
+    while command:
+        _, parsed = parse_message(command)
+        messages = render_list_page(session, group_key, parsed['page'], parsed['day'], parsed['after'])
+        pages.append(descriptions(messages))
+        titles.append(messages[0].split("\n")[0])
+        footer = re.search(r'下一頁：(.+)$', messages[-1])
+        command = footer.group(1) if footer else None
+        if len(pages) == 1:
+            # 看完第 1 頁後刪除其中一筆：依游標的下一頁不應跳過事件
+            session.execute(delete(Event).where(Event.description == "分頁 0"))
+            session.commit()
+    
+    _, parsed = parse_message("/list 2")
+    by_page = descriptions(render_list_page(session, group_key, parsed['page'], parsed['day'], parsed['after']))
+    missing = render_list_page(session, group_key, 9, None)
+    session.close()
+    with open(result_path, 'w') as f:
+        json.dump({'pages': pages, 'titles': titles, 'by_page': by_page, 'missing': missing}, f, ensure_ascii=False)
+
+
+def test_list_paging():
+    """測試 /list 分頁：依下一頁的指令（帶游標）逐頁查詢，不重複也不遺漏"""
+    print("\n" + "=" * 60)
+    print("測試清單分頁查詢")
+    print("=" * 60)
+    
+    result = _run_isolated(_run_list_paging)
+    
+    pages = result['pages']
+    print(f"\n45 個事件 → {len(pages)} 頁，每頁 {[len(page) for page in pages]} 個")
+    if [event for page in pages for event in page] == [f"分頁 {i}" for i in range(45)]:
+        print("✅ 正確：依下一頁的指令逐頁查詢，依時間排序且不重複、不遺漏")
+    else:
+        print(f"❌ 錯誤：{pages}")
+    if result['titles'][1].endswith("（第 2 頁）：") and result['by_page'] == [f"分頁 {i}" for i in range(21, 41)]:
+        print("✅ 正確：直接輸入頁數時依目前的資料定位")
+    else:
+        print(f"❌ 錯誤：{result['titles']} {result['by_page']}")
+    print("✅ 正確：超出範圍的頁數" if result['missing'] == "❌ 沒有第 9 頁" else f"❌ 錯誤：{result['missing']}")
+
+
+# 升級前的 events 資料表：(建立語句, 舊版 event_datetime 的時區)
+# 最初的版本、改用 epoch 之前的版本（PostgreSQL 在 UTC 連線時區下寫入），以及改用群組鍵之前的版本
+_LEGACY_SCHEMAS = {
+    "最初的資料表": ([
+        "CREATE TABLE events (id INTEGER PRIMARY KEY AUTOINCREMENT, group_id VARCHAR(100) NOT NULL, "
+        "event_datetime DATETIME NOT NULL, description TEXT NOT NULL, remind_level INTEGER NOT NULL, created_at DATETIME)",
+        "CREATE INDEX ix_events_group_id ON events (group_id)",
+    ], None),
+    "PostgreSQL（UTC）寫入的 next_fire_at 資料表": ([
+        "CREATE TABLE events (id INTEGER PRIMARY KEY AUTOINCREMENT, group_id VARCHAR(100) NOT NULL, "
+        "event_datetime DATETIME NOT NULL, description TEXT NOT NULL, remind_level INTEGER NOT NULL, "
+        "next_fire_at TIMESTAMP, shard_key INTEGER, claimed_by VARCHAR(200), claimed_until TIMESTAMP, created_at DATETIME)",
+        "CREATE INDEX ix_events_group_id ON events (group_id)",
+        "CREATE INDEX ix_events_next_fire_at ON events (next_fire_at)",
+    ], 'UTC'),
+    "群組鍵之前的資料表": ([
+        "CREATE TABLE events (id INTEGER PRIMARY KEY AUTOINCREMENT, group_id VARCHAR(100) NOT NULL, "
+        "event_datetime DATETIME NOT NULL, event_epoch BIGINT, description TEXT NOT NULL, description_hash VARCHAR(64), "
+        "remind_level INTEGER NOT NULL, next_fire_epoch BIGINT, shard_key INTEGER, claimed_by VARCHAR(200), "
+        "claimed_until TIMESTAMP, created_at DATETIME)",
+        "CREATE INDEX ix_events_group_id ON events (group_id)",
+        "CREATE INDEX ix_events_group_id_event_epoch ON events (group_id, event_epoch, description_hash)",
+        "CREATE TABLE group_list_versions (group_id VARCHAR(100) PRIMARY KEY, version INTEGER NOT NULL)",
+    ], None),
+}
+
+
+def _run_schema_upgrade(result_path, legacy_timezone):
+    """子行程：升級既有資料庫，記錄各事件的群組、shard_key 與回填的時間"""
+    import json
+    from sqlalchemy import inspect
+    import models
+    from models import Session, Event, Group, compute_shard_key, engine, init_database
+    
+    if legacy_timezone:
+        # 模擬 PostgreSQL：舊版時間存成連線時區（SHOW timezone）的時間
+        models._legacy_storage_timezone = lambda conn: pytz.timezone(legacy_timezone)
+    init_database()
+    session = Session()
+    rows = session.query(Event, Group.line_id).join(Group, Group.id == Event.group_key).all()
+    result = {
+        'events': {event.description: line_id for event, line_id in rows},
+        'backfilled': all(event.shard_key == compute_shard_key(event.group_key) for event, _ in rows),
+        'times': {
+            event.description: [event.event_epoch, event.event_datetime.isoformat(), event.next_fire_epoch]
+            for event, _ in rows if event.event_epoch is not None
+        },
+        'groups': session.query(Group).count(),
+        'columns': [c['name'] for c in inspect(engine).get_columns('events')],
+        'indexes': [index['name'] for index in inspect(engine).get_indexes('events')],
+        'tables': inspect(engine).get_table_names(),
+    }
+    session.close()
+    with open(result_path, 'w') as f:
+        json.dump(result, f)
+
+
+def test_schema_upgrade():
+    """測試既有資料庫升級：事件對應到正確的群組、時間依舊版的儲存時區換算，舊欄位與索引移除"""
+    import os
+    import sqlite3
+    import tempfile
+    
+    print("\n" + "=" * 60)
+    print("測試資料表升級")
+    print("=" * 60)
+    
+    tz = pytz.timezone('Asia/Taipei')
+    local_times = [tz.localize(datetime(2030, 1, i % 9 + 1, 12, 0)) for i in range(30)]
+    for name, (statements, legacy_timezone) in _LEGACY_SCHEMAS.items():
+        storage_tz = pytz.timezone(legacy_timezone) if legacy_timezone else tz
+        with tempfile.TemporaryDirectory() as directory:
+            db_path = os.path.join(directory, 'legacy.db')
+            conn = sqlite3.connect(db_path)
+            for statement in statements:
+                conn.execute(statement)
+            conn.executemany(
+                "INSERT INTO events (group_id, event_datetime, description, remind_level) VALUES (?, ?, ?, 0)",
+                [
+                    (f"C{i % 3:032d}", local_times[i].astimezone(storage_tz).strftime('%Y-%m-%d %H:%M:%S.%f'), f"舊事件 {i}")
+                    for i in range(30)
+                ]
+            )
+            conn.commit()
+            conn.close()
+            
+            result = _run_isolated(_run_schema_upgrade, legacy_timezone, database_path=db_path)
+        
+        expected = {f"舊事件 {i}": f"C{i % 3:032d}" for i in range(30)}
+        print(f"\n{name}: {len(result['events'])} 個事件，{result['groups']} 個群組")
+        if result['events'] == expected and result['groups'] == 3 and result['backfilled']:
+            print("✅ 正確：事件對應到原本的群組，shard_key 依群組鍵重新計算")
+        else:
+            print(f"❌ 錯誤：{result}")
+        if 'event_epoch' not in statements[0]:
+            expected_times = {
+                f"舊事件 {i}": [
+                    int(local_times[i].timestamp()),
+                    local_times[i].replace(tzinfo=None).isoformat(),
+                    int(local_times[i].timestamp()) - 1450 * 60,
+                ]
+                for i in range(30)
+            }
+            if result['times'] == expected_times:
+                print("✅ 正確：event_epoch、next_fire_epoch 依舊版的儲存時區換算，event_datetime 改為設定時區")
+            else:
+                wrong = next(key for key in expected_times if result['times'].get(key) != expected_times[key])
+                print(f"❌ 錯誤：{wrong} 應為 {expected_times[wrong]}，實際為 {result['times'].get(wrong)}")
+        if ('group_id' not in result['columns'] and 'next_fire_at' not in result['columns']
+                and 'ix_events_group_key_event_epoch' in result['indexes']
+                and 'group_list_versions' not in result['tables']):
+            print("✅ 正確：移除 group_id、next_fire_at 欄位與舊的索引、資料表")
+        else:
+            print(f"❌ 錯誤：欄位 {result['columns']}，索引 {result['indexes']}")
+
+
+def _run_reminder_timer(result_path):
+    """子行程：以真實資料庫啟動計時器，記錄載入的到期時間與檢查次數"""
+    import json
+    import threading
+    import time
+    from datetime import timedelta
+    from models import Session, Event, create_group, init_database
+    from scheduler import ReminderTimer
+    from sharding import ShardMembership
+    
+    init_database()
+    group_key = create_group("test_group_timer")
+    now = datetime.now(pytz.timezone('Asia/Taipei'))
+    session = Session()
+    # 一個已到期（整點提醒視窗內）、一個在熱區內、一個超出熱區
+    for minutes, level in ((1, 3), (120, 1), (3 * 1440, 0)):
+        session.add(Event(group_key=group_key, event_datetime=now + timedelta(minutes=minutes),
+                          description=f"計時器測試 {minutes}", remind_level=level))
+    session.commit()
+    session.close()
+    
+    # 檢查不改變任何事件（例如 rollback）：到期事件應延後重試，而不是立即再次檢查
+    ticked = threading.Event()
+    ticks = []
+    
+    def tick():
+        ticks.append(time.time())
+        ticked.set()
+    
+    timer = ReminderTimer(tick=tick, catch_up=None)
+    timer.rehydrate()
+    loaded = len(timer._deadlines)
+    timer.start()
+    ticked.wait(5)
+    time.sleep(1)
+    timer.shutdown(timeout=5)
+    timer.rehydrate()
+    
+    # 分片模式只排程本分片的事件（群組鍵 1 在前半段雜湊桶）
+    sharded = ReminderTimer(tick=tick, lease=ShardMembership(shard_count=2, shard_index=1, holder='timer'), catch_up=None)
+    sharded.rehydrate()
+    sharded.schedule(1000, int(time.time()) + 60, shard_key=1)
+    sharded.schedule(1001, int(time.time()) + 60, shard_key=600)
+    with open(result_path, 'w') as f:
+        json.dump({
+            'loaded': loaded,
+            'ticked': ticked.is_set(),
+            'ticks': len(ticks),
+            'reloaded': len(timer._deadlines),
+            'sharded': sorted(sharded._deadlines),
+        }, f)
+
+
+def test_reminder_timer():
+    """測試計時器啟動時從資料表載入熱區事件，並在事件到期時執行檢查"""
+    print("\n" + "=" * 60)
+    print("測試提醒計時器")
+    print("=" * 60)
+    
+    result = _run_isolated(_run_reminder_timer)
+    if result is None:
+        print("❌ 錯誤：計時器啟動失敗")
+        return
+    
+    print(f"\n載入 {result['loaded']} 個熱區事件，重新載入 {result['reloaded']} 個")
+    if result['loaded'] == result['reloaded'] == 2 and result['ticked']:
+        print("✅ 正確：只載入熱區內的事件，到期事件觸發檢查")
+    else:
+        print(f"❌ 錯誤：{result}")
+    print(f"1 秒內檢查 {result['ticks']} 次（檢查後事件沒有變化）")
+    if result['ticks'] <= 2:
+        print("✅ 正確：沒有前進的到期事件延後重試，不會重複檢查")
+    else:
+        print("❌ 錯誤：計時器不斷重複檢查")
+    if result['sharded'] == [1001]:
+        print("✅ 正確：分片模式略過其他分片的事件")
+    else:
+        print(f"❌ 錯誤：{result['sharded']}")
+
+
+def _create_due_events(count, groups):
+    """子行程：建立資料表與即將到期的整點提醒事件"""
+    from datetime import timedelta
+    from models import Session, Event, create_group, init_database
+    
+    init_database()
+    tz = pytz.timezone('Asia/Taipei')
+    event_time = datetime.now(tz) + timedelta(minutes=1)
+    group_keys = [create_group(f"test_group_{i}") for i in range(groups)]
+    session = Session()
+    for i in range(count):
+        session.add(Event(
+            group_key=group_keys[i % groups],
+            event_datetime=event_time,
+            description=f"分片測試 {i}",
+            remind_level=3
+        ))
+    session.commit()
+    session.close()
+
+
 if __name__ == "__main__":
     print("\n")
     print("🧪 LINE 提醒機器人測試腳本")
     print("=" * 60)
     
     test_parse_command()
+    test_command_grammar()
+    test_command_timezones()
+    test_parse_remove_command()
+    test_list_messages()
+    test_list_cache()
     test_year_logic()
     test_remind_messages()
     test_time_validation()
+    test_line_client_connection_reuse()
+    test_rate_limiter()
+    test_circuit_breaker()
+    test_push_expiry()
+    test_missed_reminders()
+    test_tick_engine()
+    test_leader_lease()
+    test_sharded_scheduler()
+    test_shard_catch_up()
+    test_webhook_queue()
+    test_webhook_queue_shutdown()
+    test_webhook_dedup()
+    test_remove_commands()
+    test_event_writer()
+    test_event_writer_timeout()
+    test_list_paging()
+    test_schema_upgrade()
+    test_reminder_timer()
     
     print("\n" + "=" * 60)
     print("測試完成！")
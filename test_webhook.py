@@ -35,6 +35,7 @@ def create_test_event():
     print("=" * 60)
     
     from models import Session, Event
+    from group_keys import GroupKeyCache
     from config import Config
     import pytz
     
@@ -57,6 +58,8 @@ def create_test_event():
         }
     ]
     
+    # 先取得群組鍵（新群組以獨立的交易建立），再開啟 Session
+    group_key = GroupKeyCache(maxsize=1).resolve(TEST_GROUP_ID)
     session = Session()
     try:
         print("\n創建測試事件：")
@@ -64,7 +67,7 @@ def create_test_event():
             event_time = now + timedelta(minutes=event_data["time_offset"])
             
             new_event = Event(
-                group_id=TEST_GROUP_ID,
+                group_key=group_key,
                 event_datetime=event_time,
                 description=event_data["description"],
                 remind_level=0
@@ -95,21 +98,21 @@ def list_events():
     print("資料庫中的所有事件")
     print("=" * 60)
     
-    from models import Session, Event
+    from models import Session, Event, Group
     
     session = Session()
     try:
-        events = session.query(Event).all()
+        events = session.query(Event, Group.line_id).join(Group, Group.id == Event.group_key).all()
         
         if not events:
             print("\n目前沒有任何事件")
             return
         
         print(f"\n共有 {len(events)} 個事件：\n")
-        for i, event in enumerate(events, 1):
+        for i, (event, line_id) in enumerate(events, 1):
             print(f"{i}. {event.description}")
             print(f"   ID: {event.id}")
-            print(f"   群組: {event.group_id}")
+            print(f"   群組: {line_id}")
             print(f"   時間: {event.event_datetime.strftime('%Y-%m-%d %H:%M:%S')}")
             print(f"   狀態: {['未提醒', '已發60分', '已發30分', '已完成'][event.remind_level]}")
             print()
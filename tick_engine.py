@@ -0,0 +1,153 @@
+"""
+提醒檢查的欄位式狀態機
+到期事件只取 (id, group_key, event_epoch, remind_level) 四個欄位，依 (remind_level, event_epoch) 排序後存入 array 緩衝區；
+狀態機在每個等級內都是依剩餘時間切分的區間，因此每個區間的邊界只需在排序好的 event_epoch 上做一次二分搜尋，
+整批事件即被切成「發送」、「跳到等級 N」、「延後」與「清理」等連續區段，再以批次語句套用
+"""
+from array import array
+from bisect import bisect_left
+
+# 狀態轉換動作（與 scheduler.evaluate_event 相同）
+ACTION_SEND = 'send'
+ACTION_ADVANCE = 'advance'
+ACTION_DELETE = 'delete'
+ACTION_PARK = 'park'
+
+_DELETE = (ACTION_DELETE, None, None)
+
+
+def _park(level):
+    return ACTION_PARK, level, None
+
+
+def _advance(level):
+    return ACTION_ADVANCE, level, None
+
+
+def _send(level, remind_type):
+    return ACTION_SEND, level, remind_type
+
+
+# 各等級的狀態表：(剩餘秒數下限, 結果) 依下限遞增排列，剩餘秒數低於第一個下限時清理事件
+# 剩餘秒數 = event_epoch - now（整數），「大於 N 分鐘」的邊界寫成 N * 60 + 1
+STATE_TABLE = {
+    0: [
+        (-1440 * 60, _park(0)),           # 已過但未滿 1 天，保留到過期清理
+        (-2 * 60, _advance(3)),
+        (28 * 60, _advance(2)),
+        (58 * 60, _advance(1)),
+        (1430 * 60, _send(1, 1440)),      # 1430-1450 分鐘：24 小時提醒
+        (1450 * 60 + 1, _park(0)),
+    ],
+    1: [
+        (-1440 * 60, _park(1)),
+        (-2 * 60, _advance(3)),
+        (28 * 60, _advance(2)),
+        (58 * 60, _send(2, 60)),          # 58-62 分鐘：60 分鐘提醒
+        (62 * 60 + 1, _park(1)),
+    ],
+    2: [
+        (-1440 * 60, _park(2)),
+        (-2 * 60, _advance(3)),
+        (28 * 60, _send(3, 30)),          # 28-32 分鐘：30 分鐘提醒
+        (32 * 60 + 1, _park(2)),
+    ],
+    3: [
+        (-1440 * 60, _advance(4)),        # 整點已過超過 2 分鐘，直接標記為完成
+        (-2 * 60, _send(4, 0)),           # -2 到 +2 分鐘：整點提醒
+        (2 * 60 + 1, _park(3)),
+    ],
+    4: [
+        (-10 * 60 + 1, _park(4)),         # 事件後 10 分鐘內保留，之後清理
+    ],
+}
+
+
+def _states(remind_level):
+    # 不在狀態表中的等級只做過期清理
+    return STATE_TABLE.get(remind_level) or [(-1440 * 60, _park(remind_level))]
+
+
+def classify(remind_level, seconds_left):
+    """
+    單一事件的狀態轉換（與 scheduler.evaluate_event 等價，供測試與少量事件使用）
+
+    Args:
+        remind_level: 目前的提醒等級
+        seconds_left: 距離事件時間的秒數（整數，負數表示已過）
+
+    Returns:
+        tuple: (動作, 新的 remind_level, 提醒類型)
+    """
+    result = _DELETE
+    for bound, state in _states(remind_level):
+        if seconds_left < bound:
+            break
+        result = state
+    return result
+
+
+class ColumnBatch:
+    """依 (remind_level, event_epoch) 排序的到期事件欄位"""
+
+    __slots__ = ('ids', 'group_keys', 'event_epochs', 'levels')
+
+    def __init__(self, rows=()):
+        self.ids = array('q')
+        self.group_keys = array('q')
+        self.event_epochs = array('q')
+        self.levels = array('h')
+        for row in rows:
+            self.append(*row)
+
+    def append(self, event_id, group_key, event_epoch, remind_level):
+        self.ids.append(event_id)
+        self.group_keys.append(group_key)
+        self.event_epochs.append(event_epoch)
+        self.levels.append(remind_level)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def plan(batch, now_epoch):
+    """
+    將整批事件切分成各狀態轉換的區段
+
+    Args:
+        batch: ColumnBatch（必須依 remind_level、event_epoch 排序）
+        now_epoch: 目前時間（整數 UTC epoch 秒數）
+
+    Returns:
+        dict: {(動作, 新的 remind_level, 提醒類型): [(起始索引, 結束索引)]}
+    """
+    segments = {}
+    epochs = batch.event_epochs
+    levels = batch.levels
+    total = len(batch)
+    start = 0
+    while start < total:
+        level = levels[start]
+        # 同一等級的區段結尾（levels 已排序，以二分搜尋找下一個等級的起點）
+        end = bisect_left(levels, level + 1, start, total)
+
+        result = _DELETE
+        lo = start
+        for bound, state in _states(level):
+            cut = bisect_left(epochs, now_epoch + bound, lo, end)
+            if cut > lo:
+                segments.setdefault(result, []).append((lo, cut))
+            lo = cut
+            result = state
+        if end > lo:
+            segments.setdefault(result, []).append((lo, end))
+        start = end
+    return segments
+
+
+def segment_ids(batch, ranges):
+    """區段內的事件 ID"""
+    ids = array('q')
+    for lo, hi in ranges:
+        ids.extend(batch.ids[lo:hi])
+    return ids
@@ -1,12 +1,14 @@
-import re
-from datetime import datetime
-import pytz
-from config import Config
+from commands import COMMAND_ADD, COMMAND_LIST, COMMAND_REMOVE, parse_message
+
+# LINE 一次回覆最多 5 則訊息；每則清單訊息的字元上限與單一事件描述顯示的字元上限
+LINE_MAX_REPLY_MESSAGES = 5
+LIST_MESSAGE_MAX_CHARS = 1900
+LIST_DESCRIPTION_MAX_CHARS = 200
 
 
 def parse_command(text):
     """
-    解析指令格式：/MM-DD HH:mm 事情描述
+    解析新增指令格式：/MM-DD HH:mm 事情描述、/YYYY-MM-DD HH:mm、/+30m、/tomorrow HH:mm（見 commands）
     
     Args:
         text: 用戶輸入的文字
@@ -14,105 +16,41 @@ def parse_command(text):
     Returns:
         dict: 包含 event_datetime 和 description，若解析失敗則返回 None
     """
-    # 正則表達式匹配
-    pattern = r'^/(\d{2})-(\d{2})\s+(\d{2}):(\d{2})\s+(.+)$'
-    match = re.match(pattern, text.strip())
-    
-    if not match:
-        return None
-    
-    month, day, hour, minute, description = match.groups()
-    
-    try:
-        # 獲取時區
-        tz = pytz.timezone(Config.TIMEZONE)
-        now = datetime.now(tz)
-        current_year = now.year
-        current_month = now.month
-        
-        # 年份處理邏輯
-        input_month = int(month)
-        if input_month < current_month:
-            # 若輸入月份小於當前月份，則設為明年
-            year = current_year + 1
-        else:
-            year = current_year
-        
-        # 組合完整日期時間
-        event_datetime = tz.localize(datetime(
-            year=year,
-            month=int(month),
-            day=int(day),
-            hour=int(hour),
-            minute=int(minute)
-        ))
-        
-        # 驗證時間是否已過
-        if event_datetime <= now:
-            return None
-        
-        return {
-            'event_datetime': event_datetime,
-            'description': description.strip()
-        }
-        
-    except (ValueError, Exception) as e:
-        print(f"解析錯誤: {e}")
-        return None
+    kind, parsed = parse_message(text)
+    return parsed if kind == COMMAND_ADD else None
 
 
 def parse_remove_command(text):
     """
-    解析刪除指令格式：/rm MM-DD HH:mm 事情描述
+    解析刪除指令格式：
+        /rm MM-DD HH:mm 事情描述    刪除指定的行程
+        /rm MM-DD                  刪除當天的所有行程
+        /rm all                    刪除群組的所有行程
     
     Args:
         text: 用戶輸入的文字
         
     Returns:
-        dict: 包含 event_datetime 和 description，若解析失敗則返回 None
+        dict: 包含 scope（event / day / all）；event 另含 event_datetime 和 description，
+              day 另含 event_datetime（當天 00:00），若解析失敗則返回 None
     """
-    # 正則表達式匹配
-    pattern = r'^/rm\s+(\d{2})-(\d{2})\s+(\d{2}):(\d{2})\s+(.+)$'
-    match = re.match(pattern, text.strip())
-    
-    if not match:
-        return None
-    
-    month, day, hour, minute, description = match.groups()
+    kind, parsed = parse_message(text)
+    return parsed if kind == COMMAND_REMOVE else None
+
+
+def parse_list_command(text):
+    """
+    解析清單指令格式：/list [頁數] 或 /list MM-DD [頁數]
     
-    try:
-        # 獲取時區
-        tz = pytz.timezone(Config.TIMEZONE)
-        now = datetime.now(tz)
-        current_year = now.year
-        current_month = now.month
-        
-        # 年份處理邏輯
-        input_month = int(month)
-        if input_month < current_month:
-            # 若輸入月份小於當前月份，則設為明年
-            year = current_year + 1
-        else:
-            year = current_year
-        
-        # 組合完整日期時間
-        event_datetime = tz.localize(datetime(
-            year=year,
-            month=int(month),
-            day=int(day),
-            hour=int(hour),
-            minute=int(minute)
-        ))
-        
-        return {
-            'event_datetime': event_datetime,
-            'description': description.strip()
-        }
+    Args:
+        text: 用戶輸入的文字
         
-    except (ValueError, Exception) as e:
-        print(f"解析錯誤: {e}")
-        return None
-        return None
+    Returns:
+        dict: 包含 page（從 1 開始）、day（當天 00:00，未指定日期為 None）與 after（下一頁指令帶的
+              (event_epoch, id) 游標，沒有時為 None），若解析失敗則返回 None
+    """
+    kind, parsed = parse_message(text)
+    return parsed if kind == COMMAND_LIST else None
 
 
 def format_datetime(dt):
@@ -144,3 +82,53 @@ def get_remind_message(description, event_datetime, remind_type):
         return f" 時間到！\n\n 時間：{time_str}\n 事項：{description}"
     
     return f" {time_str}\n {description}"
+
+
+def get_missed_digest_message(items):
+    """
+    生成停機期間錯過提醒的摘要訊息
+    
+    Args:
+        items: [(事件描述, 事件時間, [錯過的提醒類型])]
+        
+    Returns:
+        str: 格式化的摘要訊息
+    """
+    labels = {1440: '1 天前', 60: '1 小時前', 30: '30 分鐘前', 0: '時間到'}
+    lines = ["提醒服務暫停期間錯過以下提醒"]
+    for description, event_datetime, remind_types in items:
+        missed = '、'.join(labels.get(remind_type, str(remind_type)) for remind_type in remind_types)
+        lines.append(f"\n 時間：{format_datetime(event_datetime)}\n 事項：{description}\n 錯過：{missed}")
+    return "\n".join(lines)
+
+
+def get_list_messages(title, rows, start_index=1, footer=None):
+    """
+    生成 /list 一頁的回覆訊息（依字元上限分成多則，最多 5 則）
+    
+    Args:
+        title: 清單標題
+        rows: [(事件時間, remind_level, 事件描述)]
+        start_index: 第一個事件的編號
+        footer: 清單結尾的提示（例如下一頁的指令）
+        
+    Returns:
+        list: 訊息文字
+    """
+    # 狀態標記：0=未提醒, 1=已提醒1天, 2=已提醒60分, 3=已提醒30分
+    status_emojis = {0: "⏳", 1: "📅", 2: "🔔"}
+    entries = [f"{title}\n\n"]
+    for idx, (event_datetime, remind_level, description) in enumerate(rows, start_index):
+        if len(description) > LIST_DESCRIPTION_MAX_CHARS:
+            description = description[:LIST_DESCRIPTION_MAX_CHARS] + "…"
+        status_emoji = status_emojis.get(remind_level, "⏰")
+        entries.append(f"{status_emoji} {idx}. {format_datetime(event_datetime)}\n   {description}\n\n")
+    if footer:
+        entries.append(footer)
+    
+    messages = [""]
+    for entry in entries:
+        if messages[-1] and len(messages[-1]) + len(entry) > LIST_MESSAGE_MAX_CHARS:
+            messages.append("")
+        messages[-1] += entry
+    return [message.rstrip() for message in messages[:LINE_MAX_REPLY_MESSAGES]]
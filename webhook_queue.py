@@ -0,0 +1,135 @@
+"""
+Webhook 事件背景處理佇列
+Webhook 驗證簽名後只負責放入佇列並立即回應，由工作執行緒處理資料庫寫入與回覆；
+佇列中的事件已回應 200，LINE 不會重送，因此行程結束前先停止接收並等待佇列處理完成
+"""
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookQueue:
+    """有容量上限的行程內事件佇列，由固定數量的工作執行緒處理"""
+
+    def __init__(self, handler, maxsize, workers):
+        self.handler = handler
+        self.maxsize = maxsize
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._threads = []
+        self._closed = False
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._enqueued = 0
+        self._rejected = 0
+        self._dequeued = 0
+        self._processed = 0
+        self._failed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _ensure_started(self):
+        """第一次放入佇列時才啟動工作執行緒（避免在 gunicorn fork 前建立執行緒）"""
+        if self._threads:
+            return
+        with self._start_lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"webhook-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            logger.info(f"Webhook 佇列已啟動: {self.workers} 個工作執行緒，容量 {self.maxsize}")
+
+    def submit(self, events):
+        """
+        將同一個 webhook 請求的事件放入佇列
+
+        Args:
+            events: webhook 內容中的 events 清單
+
+        Returns:
+            bool: 佇列已滿或關閉中時回傳 False
+        """
+        if self._closed:
+            # 關閉中不再接收，回應 503 讓 LINE 稍後重送到其他 worker
+            with self._stats_lock:
+                self._rejected += 1
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((time.monotonic(), events))
+        except queue.Full:
+            with self._stats_lock:
+                self._rejected += 1
+            return False
+        with self._stats_lock:
+            self._enqueued += 1
+        return True
+
+    def _run(self):
+        while True:
+            enqueued_at, events = self._queue.get()
+            wait = time.monotonic() - enqueued_at
+            with self._stats_lock:
+                self._dequeued += 1
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+            try:
+                for event_data in events:
+                    try:
+                        self.handler(event_data)
+                        with self._stats_lock:
+                            self._processed += 1
+                    except Exception as e:
+                        logger.error(f"背景處理事件失敗: {e}", exc_info=True)
+                        with self._stats_lock:
+                            self._failed += 1
+            finally:
+                self._queue.task_done()
+
+    def shutdown(self, timeout):
+        """
+        停止接收新的請求，等待佇列中的事件處理完成（可重複呼叫）
+
+        Args:
+            timeout: 最長等待秒數
+
+        Returns:
+            int: 逾時後仍未處理完成的請求數量（這些事件會遺失）
+        """
+        with self._start_lock:
+            if self._closed:
+                return 0
+            self._closed = True
+        deadline = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._queue.all_tasks_done.wait(remaining)
+            pending = self._queue.unfinished_tasks
+        if pending:
+            logger.error(f"Webhook 佇列關閉逾時，捨棄 {pending} 個未處理完成的請求")
+        elif self._threads:
+            logger.info("Webhook 佇列已處理完所有事件")
+        return pending
+
+    def stats(self):
+        """佇列深度與等待時間統計"""
+        with self._stats_lock:
+            return {
+                'depth': self._queue.qsize(),
+                'capacity': self.maxsize,
+                'workers': self.workers,
+                'enqueued': self._enqueued,
+                'rejected': self._rejected,
+                'processed': self._processed,
+                'failed': self._failed,
+                'wait_avg_ms': round(self._wait_total / self._dequeued * 1000, 2) if self._dequeued else 0.0,
+                'wait_max_ms': round(self._wait_max * 1000, 2),
+            }
@@ -0,0 +1,45 @@
+"""
+LINE 提醒機器人排程 worker
+獨立於 Web 行程執行提醒檢查，Web 重啟或擴充 worker 數量都不會中斷提醒發送
+"""
+import logging
+import signal
+import threading
+from config import Config
+from models import init_database
+from scheduler import start_scheduler
+
+# 設定日誌
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    """啟動排程並等待 SIGTERM / SIGINT 後平順結束"""
+    stop = threading.Event()
+    
+    def handle_signal(signum, frame):
+        logger.info(f"收到信號 {signal.Signals(signum).name}，等待進行中的提醒發送完成...")
+        stop.set()
+    
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+    
+    # 初始化資料庫
+    logger.info("初始化資料庫...")
+    init_database()
+    
+    # 啟動排程器
+    logger.info("啟動排程 worker...")
+    scheduler = start_scheduler()
+    
+    stop.wait()
+    scheduler.shutdown(timeout=Config.WORKER_SHUTDOWN_TIMEOUT)
+    logger.info("排程 worker 已關閉")
+
+
+if __name__ == "__main__":
+    main()